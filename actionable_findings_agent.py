@@ -6,10 +6,15 @@ from agno.tools import Toolkit
 from agno.models.google import Gemini
 from agno.models.message import Message
 
-import streamlit as st
 from prompts import Prompts
+from study_context import StudyContext, streamlit_context
 
 from constants import LLM_MODEL_REPORT_AGENT
+from registry import get_gemini_client
+import constants as c
+from http_transport import get_transport
+from response_cache import get_response_cache
+from tracing import span
 
 prompts = Prompts()
 
@@ -23,7 +28,8 @@ class ActionableFindings(Toolkit):
         """Initialize the ActionableFindings agent."""
         super().__init__(name="actionable_findings")
 
-        self.model = Gemini(api_key=os.environ.get("GEMINI_API_KEY"), id=LLM_MODEL_REPORT_AGENT)
+        # Shares the process-wide Gemini client; this model is only used for plain completions
+        self.model = Gemini(id=LLM_MODEL_REPORT_AGENT, client=get_gemini_client())
 
         # Register functions for external access
         self.register(self.search_actionable_findings)
@@ -45,13 +51,27 @@ class ActionableFindings(Toolkit):
         Analyzes the current report in session state for actionable findings.
         Returns a list of dictionaries containing findings and their urgency levels.
         """
-        try:
-            report = st.session_state.report_text
-        except:
-            report = "RIGHT LUNG MASS AND CARDIOMEGALY"
+        with streamlit_context() as ctx:
+            return self.search_study_findings(ctx)
+
+    def search_study_findings(self, ctx: StudyContext) -> str:
+        """
+        Analyzes ctx.report_text for actionable findings. Same output as search_actionable_findings.
+        """
+        with span("findings.search", study_id=ctx.study_id, **{"report.chars": len(ctx.report_text or "")}):
+            return self._search_study_findings(ctx)
+
+    def _search_study_findings(self, ctx: StudyContext) -> str:
+        report = ctx.report_text
 
         prompt = self._generate_actionable_findings_prompt(report)
         messages = [Message(role="user", content=prompt)]
+
+        cache = get_response_cache()
+        cached = cache.get(LLM_MODEL_REPORT_AGENT, prompt)
+        if cached is not None:
+            print("Actionable findings served from the response cache")
+            return cached
         
         # Get response from model and extract content
         response = self.model.response(messages=messages)
@@ -71,7 +91,10 @@ class ActionableFindings(Toolkit):
             
             findings = json.loads(content)
             print(f"Successfully parsed JSON: {findings}")
-            return json.dumps(findings, indent=2)
+            result = json.dumps(findings, indent=2)
+            # Only well-formed answers are cached, so a parsing failure is retried next time
+            cache.put(LLM_MODEL_REPORT_AGENT, prompt, result)
+            return result
         except json.JSONDecodeError as e:
             print(f"JSON parsing error: {str(e)}")
             return "[]"
@@ -89,6 +112,13 @@ class ActionableFindings(Toolkit):
         Returns:
             str: JSON string with success status and additional information
         """
+        with streamlit_context() as ctx:
+            return self.notify_study(ctx, findings, email)
+
+    def notify_study(self, ctx: StudyContext, findings, email: str = None) -> str:
+        """
+        Sends the notification to email, or to ctx.notification_email if no email is given.
+        """
         print(f"Received findings: {findings}")
         print(f"Findings type: {type(findings)}")
         
@@ -130,8 +160,8 @@ class ActionableFindings(Toolkit):
             print("SendGrid API key not found in environment variables")
             return json.dumps({"success": False, "error": "no_api_key"})
 
-        # Use provided email if available, otherwise use the one from session state
-        recipient_email = email if email else st.session_state.get('notification_email')
+        # Use provided email if available, otherwise use the one from the study context
+        recipient_email = email if email else ctx.notification_email
         
         # If no email is available, return an error
         if not recipient_email:
@@ -139,7 +169,6 @@ class ActionableFindings(Toolkit):
             return json.dumps({"success": False, "error": "no_email"})
         
         try:
-            from sendgrid import SendGridAPIClient
             from sendgrid.helpers.mail import Mail
             
             message = Mail(
@@ -149,8 +178,12 @@ class ActionableFindings(Toolkit):
                 html_content=self._format_email_content(findings_list)
             )
             
-            sg = SendGridAPIClient(api_key)
-            response = sg.send(message)
+            # Sent through the shared pooled session (keep-alive) instead of a new SendGridAPIClient per call
+            response = get_transport().post(
+                c.SENDGRID_API_URL,
+                headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+                json=message.get(),
+            )
             
             if response.status_code == 202:
                 print(f"Email notification sent successfully to {recipient_email}!")
@@ -190,6 +223,13 @@ class ActionableFindings(Toolkit):
         Returns:
             str: JSON string of "True" if successful, "False" otherwise
         """
+        with streamlit_context() as ctx:
+            return self.update_study_notification_email(ctx, email)
+
+    def update_study_notification_email(self, ctx: StudyContext, email: str) -> str:
+        """
+        Validates email and stores it in ctx.notification_email.
+        """
         import re
         try:
             # Basic email validation
@@ -198,7 +238,7 @@ class ActionableFindings(Toolkit):
                 print(f"Invalid email format: {email}")
                 return json.dumps(False)
             
-            st.session_state.notification_email = email
+            ctx.notification_email = email
             print(f"Notification email updated to: {email}")
             return json.dumps(True)
         except Exception as e:
@@ -213,7 +253,8 @@ class ActionableFindings(Toolkit):
             str: JSON string containing the current email address
         """
         try:
-            email = st.session_state.get('notification_email', '')
+            with streamlit_context() as ctx:
+                email = ctx.notification_email or ''
             return json.dumps(email)
         except Exception as e:
             print(f"Failed to get notification email: {str(e)}")
@@ -223,7 +264,8 @@ if __name__ == "__main__":
     agent = ActionableFindings()
     
     # Example usage
-    findings = agent.search_actionable_findings()
+    ctx = StudyContext(report_text="RIGHT LUNG MASS AND CARDIOMEGALY")
+    findings = agent.search_study_findings(ctx)
     print(findings)
     if findings:
-        agent.send_notification(findings)
\ No newline at end of file
+        agent.notify_study(ctx, findings)
\ No newline at end of file
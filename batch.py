@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import constants as c
+from database import Database
+from sqlite_backend import iter_export
+from study_context import StudyContext
+from registry import get_image_interpreter, get_report_agent, get_actionable_findings
+
+
+class BatchTriage:
+    """
+    Headless triage of many studies: classification -> report draft -> actionable findings.
+
+    Studies run in a thread pool, with a separate concurrency limit for each upstream service, so
+    the HF endpoint and the Gemini quota are never flooded. Concurrent classifications are grouped
+    into micro-batches by the ImageInterpreterAgent. Every finished study is appended to a JSON
+    Lines file, which doubles as the checkpoint: a rerun skips the studies already in it.
+    """
+
+    def __init__(self, output_path=c.BATCH_OUTPUT_PATH, max_workers=c.BATCH_MAX_WORKERS,
+                 hf_concurrency=c.BATCH_HF_CONCURRENCY, gemini_concurrency=c.BATCH_GEMINI_CONCURRENCY):
+        self.output_path = output_path
+        self.max_workers = max_workers
+        self._hf_slots = threading.BoundedSemaphore(hf_concurrency)
+        self._gemini_slots = threading.BoundedSemaphore(gemini_concurrency)
+        self._write_lock = threading.Lock()
+
+    def completed_studies(self, retry_failed=False) -> set:
+        """
+        Returns the study IDs already in the output file (only the successful ones if retry_failed).
+        """
+        done = set()
+        if not os.path.exists(self.output_path):
+            return done
+        with open(self.output_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Last line of an interrupted run
+                if not retry_failed or record.get("status") == "ok":
+                    done.add(str(record["study_id"]))
+        return done
+
+    def run(self, studies, retry_failed=False) -> dict:
+        """
+        Processes the (study_id, image_url) pairs that are not checkpointed yet.
+
+        Returns:
+            dict: Number of studies "processed", "failed" and "skipped".
+        """
+        directory = os.path.dirname(self.output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        done = self.completed_studies(retry_failed)
+        pending = [(study_id, url) for study_id, url in studies if str(study_id) not in done]
+        counts = {"processed": 0, "failed": 0, "skipped": len(studies) - len(pending)}
+        print(f"{len(pending)} studies to process, {len(done)} already done")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            futures = [executor.submit(self.process_study, study_id, url) for study_id, url in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                self._append(record)
+                counts["processed"] += 1
+                if record["status"] != "ok":
+                    counts["failed"] += 1
+                print(f"[{counts['processed']}/{len(pending)}] Study {record['study_id']}: {record['status']}")
+
+        print(f"Batch finished in {time.perf_counter() - start:.1f}s: {counts}")
+        return counts
+
+    def process_study(self, study_id, image_url) -> dict:
+        ctx = StudyContext(study_id=study_id, image_url=image_url)
+        timings = {}
+        record = {"study_id": study_id, "image_url": image_url, "status": "ok", "error": None,
+                  "probabilities": None, "report": None, "actionable_findings": None, "timings": timings}
+
+        try:
+            with self._hf_slots:
+                stage_start = time.perf_counter()
+                probabilities = get_image_interpreter().interpret_image_url(image_url, batched=True)
+                timings["interpret"] = time.perf_counter() - stage_start
+            record["probabilities"] = json.loads(probabilities)
+            if "error" in record["probabilities"]:
+                raise RuntimeError(record["probabilities"]["error"])
+
+            with self._gemini_slots:
+                stage_start = time.perf_counter()
+                record["report"] = get_report_agent().generate_study_report(ctx, probabilities)
+                timings["report"] = time.perf_counter() - stage_start
+
+            with self._gemini_slots:
+                stage_start = time.perf_counter()
+                record["actionable_findings"] = json.loads(get_actionable_findings().search_study_findings(ctx))
+                timings["findings"] = time.perf_counter() - stage_start
+        except Exception as e:
+            print(f"Study {study_id} failed: {str(e)}")
+            record["status"] = "error"
+            record["error"] = str(e)
+
+        record["completed_at"] = datetime.now(timezone.utc).isoformat()
+        return record
+
+    def _append(self, record):
+        with self._write_lock:
+            with open(self.output_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def export_parquet(self, parquet_path):
+        """
+        Writes the latest result of every study in the output file to Parquet. Nested fields are
+        stored as JSON strings.
+        """
+        records = {}
+        with open(self.output_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[str(record["study_id"])] = record
+
+        df = pd.DataFrame(list(records.values()))
+        for column in ["probabilities", "actionable_findings", "timings"]:
+            if column in df:
+                df[column] = df[column].map(json.dumps)
+        df.to_parquet(parquet_path, index=False)
+        print(f"Wrote {len(df)} results to {parquet_path}")
+
+
+def worklist_studies(db: Database = None, page_size=500):
+    """
+    Returns every (study_id, image_url) of the worklist in Study ID order, read page by page.
+    """
+    db = db if db is not None else Database()
+    studies, last_id = [], None
+    while True:
+        cases_df, _, _ = db.query_worklist(page=1, page_size=page_size, sort_by="id", descending=False,
+                                           id_after=last_id)
+        if cases_df.empty:
+            return studies
+        studies.extend(zip(cases_df["id"].to_list(), cases_df["url"].to_list()))
+        last_id = studies[-1][0]
+
+
+def manifest_studies(path):
+    """
+    Returns the (study_id, image_url) pairs of a manifest (JSON Lines, JSON, CSV or Parquet) with
+    "id" or "Study ID" and "url" or "image_url" fields.
+    """
+    studies = []
+    for row in iter_export(path):
+        study_id = row.get("id", row.get("Study ID"))
+        url = row.get("url", row.get("image_url"))
+        if study_id is None or not url:
+            print(f"Skipping manifest row without a study ID and image URL: {row}")
+            continue
+        studies.append((study_id, url))
+    return studies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify, report and triage studies without the UI.")
+    parser.add_argument("--manifest", help="Studies to process (JSON Lines, JSON, CSV or Parquet); "
+                                           "defaults to the whole worklist")
+    parser.add_argument("--output", default=c.BATCH_OUTPUT_PATH, help="JSON Lines results file, also the checkpoint")
+    parser.add_argument("--parquet", help="Also export the results to this Parquet file")
+    parser.add_argument("--limit", type=int, help="Process at most this many studies")
+    parser.add_argument("--workers", type=int, default=c.BATCH_MAX_WORKERS)
+    parser.add_argument("--hf-concurrency", type=int, default=c.BATCH_HF_CONCURRENCY)
+    parser.add_argument("--gemini-concurrency", type=int, default=c.BATCH_GEMINI_CONCURRENCY)
+    parser.add_argument("--retry-failed", action="store_true", help="Process again the studies that failed")
+    args = parser.parse_args()
+
+    studies = manifest_studies(args.manifest) if args.manifest else worklist_studies()
+    if args.limit:
+        studies = studies[:args.limit]
+
+    triage = BatchTriage(output_path=args.output, max_workers=args.workers,
+                         hf_concurrency=args.hf_concurrency, gemini_concurrency=args.gemini_concurrency)
+    triage.run(studies, retry_failed=args.retry_failed)
+    if args.parquet:
+        triage.export_parquet(args.parquet)
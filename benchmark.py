@@ -0,0 +1,303 @@
+import io
+import os
+import json
+import math
+import time
+import uuid
+import wave
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import constants as c
+import fakes
+from batch import BatchTriage
+from read_pipeline import get_read_pipeline
+from registry import get_report_agent, get_actionable_findings, get_whisper_transcriber
+from response_cache import get_response_cache
+from study_context import StudyContext
+from whisper import WavRecording
+
+SCENARIOS = ["single_read", "concurrent_sessions", "bulk_triage", "dictation_burst"]
+
+
+def rss_mb():
+    """
+    Current resident memory of the process in MB (peak RSS where /proc is not available).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def latency_percentiles(latencies) -> dict:
+    if not latencies:
+        return {}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(latencies))}
+
+
+def dictation_wav(seconds, frequency, rate=16000) -> bytes:
+    """
+    Returns a mono 16-bit WAV of a tone, like the recordings st.audio_input produces.
+    """
+    samples = np.arange(int(seconds * rate)) / rate
+    pcm = (0.3 * 32767 * np.sin(2 * math.pi * frequency * samples)).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(rate)
+        audio.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+class Benchmark:
+    """
+    Scenario benchmarks of the workstation against the local fakes (see fakes.py): every scenario
+    runs the real agents, caches and pools, only the upstream services are simulated.
+
+    Each scenario returns its throughput (operations per second), latency percentiles (overall and
+    per operation), errors, memory (RSS, plus the Python heap peak with track_memory) and the
+    calls and errors seen by each fake service. Every run uses new image URLs, so the image and
+    inference caches start cold.
+    """
+
+    def __init__(self, seed=c.FAKE_SEED, track_memory=False):
+        self.seed = seed
+        self.track_memory = track_memory
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def _studies(self, scenario, count):
+        # Real Study IDs (so clinical data is found) with image URLs no cache has seen yet
+        return [(c.CASES[i % len(c.CASES)]["Study ID"],
+                 f"https://pacs.fake/{self.run_id}/{scenario}/{i}.png") for i in range(count)]
+
+    def measure(self, scenario, run, **params) -> dict:
+        """
+        Runs run() and summarizes the {operation: [latencies]} and error count it returns.
+        """
+        fakes.configure(seed=self.seed)
+        get_response_cache().clear()
+        if self.track_memory:
+            tracemalloc.start()
+        rss_before = rss_mb()
+
+        start = time.perf_counter()
+        latencies, errors = run(**params)
+        wall = time.perf_counter() - start
+
+        everything = [seconds for values in latencies.values() for seconds in values]
+        result = {
+            "scenario": scenario,
+            "params": params,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "wall_seconds": wall,
+            "operations": len(everything),
+            "errors": errors,
+            "throughput": len(everything) / wall if wall else 0.0,
+            "latency": latency_percentiles(everything),
+            "operation_latency": {operation: latency_percentiles(values) for operation, values in latencies.items()},
+            "rss_mb": rss_mb(),
+            "rss_delta_mb": rss_mb() - rss_before,
+            "services": fakes.get_stats(),
+        }
+        if self.track_memory:
+            result["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        return result
+
+    # ----------------- SCENARIOS -----------------
+    def single_read(self, reads=5):
+        """
+        One radiologist: the /read pipeline (classify, stream the report, actionable findings),
+        one study after another.
+        """
+        latencies, errors = {"read": []}, 0
+        for study_id, url in self._studies("single_read", reads):
+            start = time.perf_counter()
+            ctx = StudyContext(study_id=study_id, image_url=url)
+            result = get_read_pipeline().run(ctx, on_chunk=lambda chunk: None)
+            latencies["read"].append(time.perf_counter() - start)
+            errors += result["error"] is not None
+        return latencies, errors
+
+    def concurrent_sessions(self, sessions=8):
+        """
+        Sessions working at the same time, each one reading a study, editing the report and
+        notifying its actionable findings.
+        """
+        latencies = {"read": [], "edit": [], "notify": []}
+        errors = 0
+        lock = threading.Lock()
+
+        def session(study):
+            nonlocal errors
+            ctx = StudyContext(study_id=study[0], image_url=study[1], notification_email="bench@example.com")
+            steps = [
+                ("read", lambda: get_read_pipeline().run(ctx, on_chunk=lambda chunk: None)["error"] is None),
+                ("edit", lambda: bool(get_report_agent().update_study_report(ctx, "Add mild cardiomegaly."))),
+                ("notify", lambda: json.loads(get_actionable_findings().notify_study(
+                    ctx, get_actionable_findings().search_study_findings(ctx)))["success"]),
+            ]
+            for operation, step in steps:
+                start = time.perf_counter()
+                try:
+                    ok = step()
+                except Exception as e:
+                    print(f"Session step {operation} failed: {str(e)}")
+                    ok = False
+                with lock:
+                    latencies[operation].append(time.perf_counter() - start)
+                    errors += not ok
+
+        with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="bench-session") as executor:
+            list(executor.map(session, self._studies("concurrent_sessions", sessions)))
+        return latencies, errors
+
+    def bulk_triage(self, studies=64, workers=c.BATCH_MAX_WORKERS):
+        """
+        The headless batch triage (batch.py) over a worklist of studies.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            triage = BatchTriage(output_path=os.path.join(directory, "results.jsonl"), max_workers=workers)
+            counts = triage.run(self._studies("bulk_triage", studies))
+            with open(triage.output_path) as f:
+                records = [json.loads(line) for line in f]
+
+        # Time each study spent in its stages, without the wait for a free worker or service slot
+        return {"study": [sum(record["timings"].values()) for record in records]}, counts["failed"]
+
+    def dictation_burst(self, clips=16, concurrency=8, seconds=12.0):
+        """
+        Many radiologists dictating at once: concurrent transcriptions of in-memory recordings,
+        cropped to MAX_DURATION_AUDIO like the audio input does.
+        """
+        latencies, errors = {"transcribe": []}, 0
+        lock = threading.Lock()
+        recordings = [dictation_wav(seconds, 220 + 40 * i) for i in range(clips)]
+
+        def transcribe(recording):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                audio = WavRecording(recording).open(max_duration=c.MAX_DURATION_AUDIO)
+                ok = bool(get_whisper_transcriber().transcribe_audio(audio))
+            except Exception as e:
+                print(f"Transcription failed: {str(e)}")
+                ok = False
+            with lock:
+                latencies["transcribe"].append(time.perf_counter() - start)
+                errors += not ok
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-dictation") as executor:
+            list(executor.map(transcribe, recordings))
+        return latencies, errors
+
+
+def format_result(result) -> str:
+    latency = result["latency"]
+    lines = [f"{result['scenario']} {result['params']}: {result['operations']} ops in {result['wall_seconds']:.2f}s, "
+             f"{result['throughput']:.2f} ops/s, {result['errors']} errors, RSS {result['rss_mb']:.0f} MB "
+             f"({result['rss_delta_mb']:+.0f} MB)"
+             + (f", Python peak {result['python_peak_mb']:.1f} MB" if "python_peak_mb" in result else "")]
+    if latency:
+        lines.append(f"  all: p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s  "
+                     f"max {latency['max']:.3f}s")
+    for operation, values in result["operation_latency"].items():
+        if values:
+            lines.append(f"  {operation}: p50 {values['p50']:.3f}s  p95 {values['p95']:.3f}s  max {values['max']:.3f}s")
+    calls = ", ".join(f"{name} {stats['calls']}" + (f" ({stats['errors']} failed)" if stats["errors"] else "")
+                      for name, stats in result["services"].items() if stats["calls"])
+    lines.append(f"  upstream calls: {calls or 'none'}")
+    return "\n".join(lines)
+
+
+def find_regressions(result, baseline_path, tolerance) -> list:
+    """
+    Compares result with the latest run of the same scenario and parameters in baseline_path.
+    Returns a message for each metric that got worse by more than tolerance (a fraction).
+    """
+    baseline = None
+    with open(baseline_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["scenario"] == result["scenario"] and record["params"] == result["params"]:
+                baseline = record
+    if baseline is None:
+        return []
+
+    regressions = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.2f} -> {result['throughput']:.2f} ops/s")
+    for percentile in ["p95", "p99"]:
+        before, after = baseline["latency"].get(percentile), result["latency"].get(percentile)
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{percentile} {before:.3f}s -> {after:.3f}s")
+    if result["errors"] > baseline["errors"]:
+        regressions.append(f"errors {baseline['errors']} -> {result['errors']}")
+    return [f"{result['scenario']}: {message}" for message in regressions]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the workstation offline, against local fakes of "
+                                                 "Gemini, the HF endpoint, Whisper and SendGrid.")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run, among {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--reads", type=int, default=5, help="Studies read in single_read")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent sessions in concurrent_sessions")
+    parser.add_argument("--studies", type=int, default=64, help="Studies in bulk_triage")
+    parser.add_argument("--clips", type=int, default=16, help="Recordings in dictation_burst")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent dictations in dictation_burst")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplies every fake service's latency")
+    parser.add_argument("--error-rate", type=float, help="Share of failed calls for every fake service")
+    parser.add_argument("--seed", type=int, default=c.FAKE_SEED)
+    parser.add_argument("--track-memory", action="store_true", help="Also trace the Python heap peak (slower)")
+    parser.add_argument("--output", default=c.BENCHMARK_OUTPUT_PATH, help="JSON Lines file the results are appended to")
+    parser.add_argument("--baseline", help="Results file to compare with; exits with status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 20%%)")
+    args = parser.parse_args()
+    unknown = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    # Nothing may reach the real services: switch every client to the fakes before first use
+    c.USE_FAKES = True
+    os.environ.setdefault("SENDGRID_API_KEY", "fake")
+    fakes.configure(latency_scale=args.latency_scale, error_rate=args.error_rate, seed=args.seed)
+
+    benchmark = Benchmark(seed=args.seed, track_memory=args.track_memory)
+    params = {
+        "single_read": {"reads": args.reads},
+        "concurrent_sessions": {"sessions": args.sessions},
+        "bulk_triage": {"studies": args.studies},
+        "dictation_burst": {"clips": args.clips, "concurrency": args.concurrency},
+    }
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    regressions = []
+    for scenario in args.scenarios or SCENARIOS:
+        result = benchmark.measure(scenario, getattr(benchmark, scenario), **params[scenario])
+        result["fakes"] = {"latency_scale": args.latency_scale, "error_rate": args.error_rate, "seed": args.seed}
+        print(format_result(result))
+        if args.baseline and os.path.exists(args.baseline):
+            regressions += find_regressions(result, args.baseline, args.tolerance)
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    if regressions:
+        print("Regressions:\n" + "\n".join(f"- {message}" for message in regressions))
+        raise SystemExit(1)
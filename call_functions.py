@@ -1,6 +1,43 @@
 import streamlit as st
 import json
 
+from database import Database
+from prefetch import get_prefetcher
+from job_queue import current_job
+from study_context import StudyContext, streamlit_context
+
+MAX_CASES_PAGE_SIZE = 50  # Keeps list_available_cases answers small in the LLM context
+
+
+def open_case(ctx: StudyContext, case_number: int, db: Database = None) -> bool:
+    """
+    Points ctx at the study case_number and clears its report. The study is found through the
+    backend's Study ID index, not by scanning the worklist.
+
+    :return: True if the case was found, False otherwise.
+    """
+    db = db if db is not None else Database()
+    study = db.get_study(case_number)
+    if study is None:
+        return False
+
+    ctx.image_url = study["url"]
+    ctx.study_id = study["id"]
+    ctx.report_text = ""
+    return True
+
+
+def prefetch_following(image_url):
+    """
+    Keeps the studies that follow image_url on the visible worklist page warm. Script thread only.
+    """
+    cases_df = st.session_state.get("cases_df")
+    if cases_df is not None:
+        urls = cases_df["url"].to_list()
+        if image_url in urls:
+            get_prefetcher().schedule(urls[urls.index(image_url) + 1:])
+
+
 def load_case(case_number: int) -> str:
     """
     Opens a new case in the workstation by updating Streamlit session state.
@@ -8,32 +45,50 @@ def load_case(case_number: int) -> str:
     :param case_number: The index of the case to open.
     :return: A JSON string of "True" if loading was successful, or "False" otherwise.
     """
-    for idx, row in st.session_state.cases_df.iterrows():
-        if row["id"] == case_number:
-            # Update session state
-            st.session_state.image_url = row["url"]
-            st.session_state.study_id = row["id"]
-            st.session_state.report_text = ""
-
-            st.session_state["history"].append(
-                {
-                    "user_message": None,
-                    "assistant_message": f"Now viewing Study ID {row['id']}. How can I assist you?",
-                    "reasoning": None
-                }
-            )
-
+    with streamlit_context() as ctx:
+        loaded = open_case(ctx, case_number)
 
-            return json.dumps(True)
+    if loaded:
+        entry = {
+            "user_message": None,
+            "assistant_message": f"Now viewing Study ID {ctx.study_id}. How can I assist you?",
+            "reasoning": None
+        }
+        job = current_job()
+        if job is not None:
+            # Called by the copilot in a background job: the script thread adds the entry, and
+            # prefetches, when it applies the job's result
+            job.add_history(entry)
+        else:
+            prefetch_following(ctx.image_url)
+            st.session_state["history"].append(entry)
 
-    return json.dumps(False)
+    return json.dumps(loaded)
 
-def list_available_cases() -> str:
+def list_available_cases(page: int = 1, page_size: int = 20, modality: str = "", priority: str = "",
+                         ai_flagged_only: bool = False, after_case: int = 0) -> str:
     """
-    This function extracts all the case IDs and returns them as a list.
+    Lists one page of available cases, in ascending case ID order.
 
-    :return: A JSON string of a list of integers representing available case IDs.
+    :param page: Page number, starting at 1.
+    :param page_size: Cases per page (at most 50).
+    :param modality: Only cases of this modality, e.g. "Chest X-Ray". Empty for all.
+    :param priority: Only cases with this priority: "STAT", "Urgent" or "Routine". Empty for all.
+    :param ai_flagged_only: Only cases the image classifier flagged as abnormal.
+    :param after_case: Only cases with an ID greater than this one, e.g. to find the next case.
+    :return: A JSON string with "cases" (id, modality, date, priority, ai_flagged), "page", "pages" and "total".
     """
+    page_size = max(1, min(int(page_size), MAX_CASES_PAGE_SIZE))
+    cases_df, total, pages = Database().query_worklist(
+        page=int(page),
+        page_size=page_size,
+        sort_by="id",
+        descending=False,
+        modality=modality or None,
+        priority=[priority] if priority else None,
+        ai_flagged=True if ai_flagged_only else None,
+        id_after=after_case or None,
+    )
 
-    cases_id = json.dumps(st.session_state.cases_df.id.to_list())
-    return cases_id
\ No newline at end of file
+    cases = json.loads(cases_df.drop(columns=["url"]).to_json(orient="records"))
+    return json.dumps({"cases": cases, "page": int(page), "pages": pages, "total": total})
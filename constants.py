@@ -1,4 +1,5 @@
 # constants.py
+import os
 
 SAMPLE_CASES = [
     {"id": 101, "url": "https://prod-images-static.radiopaedia.org/images/1371188/0a1f5edc85aa58d5780928cb39b08659c1fc4d6d7c7dce2f8db1d63c7c737234_big_gallery.jpeg"},
@@ -10,9 +11,133 @@ SAMPLE_CASES = [
 LLM_MODEL_WORKFLOW_AGENT = "gemini-2.0-flash"
 LLM_MODEL_REPORT_AGENT = "gemini-2.0-flash"
 
+# GEMINI CONTEXT CACHING
+# Static request prefixes (system instructions, tool schemas, report template) are uploaded once as
+# cached contents and referenced by later requests. Caches live PROMPT_CACHE_TTL seconds and are
+# extended when a request arrives less than PROMPT_CACHE_REFRESH_MARGIN seconds before expiry.
+PROMPT_CACHE_ENABLED = True
+PROMPT_CACHE_TTL = 3600
+PROMPT_CACHE_REFRESH_MARGIN = 300
+PROMPT_CACHE_RETRY_DELAY = 60  # Seconds requests go uncached after a cache creation failed for a transient reason
+
+# PARALLEL TOOL CALLS
+# When the workflow agent requests several read-only tools in one turn, they run concurrently
+PARALLEL_TOOL_CALLS = True
+PARALLEL_TOOL_MAX_WORKERS = 4  # Tool calls of one turn run at the same time; further calls run after them
+TOOL_TIMEOUT = 120  # Seconds a tool may run before its call is reported as timed out
+TOOL_TIMEOUTS = {"duckduckgo_search": 20, "duckduckgo_news": 20, "get_clinical_data_from_patient": 30}
+
+# BACKGROUND JOB QUEUE (copilot turns run off the Streamlit script thread)
+JOB_QUEUE_WORKERS = 4  # Copilot turns running at the same time across all sessions
+JOB_QUEUE_MAX_JOBS = 1000  # Finished jobs kept for the sessions to collect
+JOB_POLL_INTERVAL = 0.5  # Seconds between UI refreshes of a running job
+COPILOT_MAX_TRIES = 3
+COPILOT_RETRY_DELAY = 2  # Seconds between attempts of a failed copilot turn
+
+# TRACING
+TRACING_ENABLED = True
+TRACE_EXPORT_PATH = ".cache/traces.jsonl"  # OpenTelemetry (OTLP/JSON) batches, one per line
+TRACE_SERVICE_NAME = "radiology-workstation"
+TRACE_WINDOW = 1000  # Recent durations kept per span name for the latency panel
+TRACE_FLUSH_EVERY = 200  # Spans buffered before they are written early
+TRACE_FLUSH_INTERVAL = 2.0  # Seconds between background writes of the buffered spans
+TRACE_MAX_FILE_BYTES = 50 * 1024 * 1024  # Export file size at which it is rotated to <path>.1
+
+# Edit reports with section-level patches instead of regenerating the whole report
+REPORT_INCREMENTAL_UPDATES = True
+
 # We will crop dictations larger than 10 s
 MAX_DURATION_AUDIO = 10
 
+# IMAGE CACHE CONFIG
+IMAGE_CACHE_DIR = ".cache/images"
+IMAGE_CACHE_MAX_MEMORY_BYTES = 512 * 1024 * 1024  # Decoded pixels kept in memory
+IMAGE_CACHE_MAX_DISK_BYTES = 2 * 1024 * 1024 * 1024  # Raw image bytes kept on disk
+IMAGE_CACHE_MAX_AGE = 3600  # Seconds before a cached URL is revalidated with the server
+IMAGE_CACHE_RESOLVE_WORKERS = 8  # Concurrent downloads when many URLs are hashed at once
+
+# WORKLIST PREFETCH CONFIG
+PREFETCH_AHEAD = 5  # Number of upcoming worklist studies to warm
+PREFETCH_MAX_WORKERS = 2  # Concurrent prefetches (each one may call the HF endpoint)
+PREFETCH_MAX_ENTRIES = 200  # Prefetched studies remembered; the oldest are forgotten first
+PREFETCH_WAIT_TIMEOUT = 30  # Seconds a request waits for a running prefetch before classifying the image itself
+
+# INFERENCE RESULT CACHE CONFIG
+INFERENCE_CACHE_PATH = ".cache/inference.sqlite3"
+INFERENCE_CACHE_TTL = 7 * 24 * 3600  # Seconds a classifier result stays valid
+
+# LLM RESPONSE CACHE CONFIG
+RESPONSE_CACHE_MAX_ENTRIES = 512  # Responses kept in memory (least recently used are evicted first)
+RESPONSE_CACHE_TTL = 1800  # Seconds a cached response stays valid
+RESPONSE_CACHE_SEMANTIC = False  # Also match near-duplicate phrasings of copilot messages by embedding
+RESPONSE_CACHE_EMBEDDING_MODEL = "text-embedding-004"
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = 0.95  # Minimum cosine similarity for a semantic hit
+RESPONSE_CACHE_HISTORY_TURNS = 4  # Previous copilot turns that must match for a cached follow-up answer to be reused
+RESPONSE_CACHE_FOLLOW_UP_MAX_WORDS = 4  # Messages this short are treated as follow-ups to the previous turns
+
+# BATCHED INFERENCE CONFIG
+INFERENCE_BATCH_MAX_SIZE = 8  # Images sent in one request to the HF endpoint
+INFERENCE_BATCH_MAX_WAIT = 0.05  # Seconds to wait for more images before sending a partial batch
+
+# HUGGING FACE ENDPOINT CLIENT CONFIG
+HF_COLD_START_MAX_WAIT = 60  # Seconds to wait for a scaled-to-zero endpoint to wake up
+HF_MAX_COLD_START_RETRIES = 3  # Requests retried after a 503 once the warm-up has finished
+HF_BACKOFF_BASE_DELAY = 1  # Seconds before the first readiness re-probe
+HF_BACKOFF_MAX_DELAY = 10  # Upper bound on the delay between readiness probes
+HF_READINESS_PATH = ""  # Appended to the endpoint URL for the readiness probe (GET)
+HF_REQUEST_TIMEOUT = 60
+HF_CONNECT_TIMEOUT = 10
+HF_MAX_CONNECTIONS = 20
+
+# SHARED HTTP TRANSPORT CONFIG
+HTTP_POOL_HOSTS = 10  # Number of hosts with their own connection pool
+HTTP_POOL_MAXSIZE = 20  # Kept-alive connections per host
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+SENDGRID_API_URL = "https://api.sendgrid.com/v3/mail/send"
+
+# EMR/PACS STORAGE CONFIG
+EMR_BACKEND = "sqlite"  # "sqlite" or "memory"
+EMR_DATABASE_PATH = ".cache/workstation.sqlite3"
+EMR_PAGE_SIZE = 100  # Rows returned per query page
+EMR_LOAD_BATCH_SIZE = 1000  # Studies committed per transaction by the bulk loader
+EMR_FETCH_MAX_WORKERS = 4  # Concurrent Record Details fetches
+EMR_FETCH_MAX_RECORDS = 1000  # Record Details kept in memory
+# Simulated HIS/PACS response time (seconds) for demos; it runs in the background. Set to 0 to disable.
+EMR_SIMULATED_LATENCY = {"HIS": 4, "PACS": 1.5}
+
+# HEADLESS BATCH CONFIG (batch.py)
+BATCH_MAX_WORKERS = 8  # Studies processed at the same time
+BATCH_HF_CONCURRENCY = 8  # Concurrent image classifications (matches INFERENCE_BATCH_MAX_SIZE)
+BATCH_GEMINI_CONCURRENCY = 4  # Concurrent Gemini completions (reports and findings)
+BATCH_OUTPUT_PATH = ".cache/batch_results.jsonl"
+
+# OFFLINE STAND-INS (fakes.py, benchmark.py)
+# With WORKSTATION_FAKES=1, Gemini, the HF endpoint, the image hosts, Whisper and SendGrid are
+# replaced by deterministic local fakes, so the app and the benchmarks run without keys or network.
+USE_FAKES = os.getenv("WORKSTATION_FAKES", "0") == "1"
+FAKE_SEED = 7
+# Per service: median latency (seconds), log-normal spread of the latency and share of failed calls
+FAKE_SERVICES = {
+    "gemini": {"latency": 0.6, "sigma": 0.35, "error_rate": 0.0},
+    "hf": {"latency": 0.35, "sigma": 0.3, "error_rate": 0.0},
+    "image": {"latency": 0.08, "sigma": 0.5, "error_rate": 0.0},
+    "whisper": {"latency": 0.9, "sigma": 0.3, "error_rate": 0.0},
+    "sendgrid": {"latency": 0.2, "sigma": 0.3, "error_rate": 0.0},
+}
+FAKE_STREAM_CHUNKS = 8  # Chunks per streamed Gemini answer
+FAKE_HF_BATCH_COST = 0.15  # Extra latency per additional image in a batch, as a share of one request
+FAKE_HF_COLD_START = 0  # Seconds the fake endpoint answers 503 (scaled to zero) after start
+FAKE_WHISPER_REALTIME_FACTOR = 0.05  # Extra transcription seconds per second of audio
+FAKE_IMAGE_SIZE = 512  # Side of the generated study images, in pixels
+BENCHMARK_OUTPUT_PATH = ".cache/benchmarks.jsonl"  # One line of results per scenario run
+LOAD_TEST_OUTPUT_PATH = ".cache/load_test.jsonl"  # One line of results per concurrency level
+
+# WORKLIST CONFIG
+WORKLIST_PAGE_SIZE = 25  # Studies fetched and rendered per worklist page
+PRIORITIES = ["STAT", "Urgent", "Routine"]  # Most urgent first
+AI_FLAG_THRESHOLD = 0.5  # A study is AI-flagged when any finding other than "No Finding" reaches this probability
+
 # List of LLMs to test
 # gemini-2.0-flash                    Input $0.10   Output $0.40
 # gemini-2.0-flash-lite-preview-02-05 Input $0.075  Output $0.30
@@ -24,6 +149,7 @@ CASES = [
         "Patient MRN": "101040",
         "Date": "2024-03-01",
         "Modality": "Chest X-Ray",
+        "Priority": "Routine",
         #"Report": "Normal heart size. Clear lungs without consolidation or effusion. No evidence of pneumothorax.",
         #"Radiologist": "Dr. Emily Carter",
         "medical_charts": [
@@ -37,6 +163,7 @@ CASES = [
         "Patient MRN": "102040",
         "Date": "2024-03-01",
         "Modality": "Chest X-Ray",
+        "Priority": "Urgent",
         #"Report": "Mild cardiomegaly with slight prominence of pulmonary vasculature suggestive of mild congestive heart failure. No acute infiltrates or effusions.",
         #"Radiologist": "Dr. Michael Zhang",
         "medical_charts": [
@@ -50,6 +177,7 @@ CASES = [
         "Patient MRN": "103010",
         "Date": "2024-03-01",
         "Modality": "Chest X-Ray",
+        "Priority": "STAT",
         #"Report": "Bilateral lower lobe infiltrates consistent with early pneumonia. Small left pleural effusion present.",
         #"Radiologist": "Dr. Priya Nair",
         "medical_charts": [
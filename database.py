@@ -1,14 +1,70 @@
+import threading
 
 import pandas as pd
-from constants import SAMPLE_CASES
+
+import constants as c
+from constants import CASES, SAMPLE_CASES
+from emr_store import get_emr_store
+from sqlite_backend import SQLiteBackend
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process-wide EMR/PACS backend selected by EMR_BACKEND:
+    "sqlite" (SQLiteBackend at EMR_DATABASE_PATH, seeded with the demo cases when empty)
+    or "memory" (EMRStore built from constants.CASES).
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if c.EMR_BACKEND == "sqlite":
+                _backend = SQLiteBackend(c.EMR_DATABASE_PATH)
+                if _backend.is_empty():
+                    _backend.seed(CASES, SAMPLE_CASES)
+            else:
+                _backend = get_emr_store()
+        return _backend
+
 
 class Database:
-    def __init__(self):
-        pass
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else get_backend()
 
-    def generate_samples(self):
-        cases_df = pd.DataFrame(SAMPLE_CASES)
+    def generate_samples(self, offset=0, limit=c.EMR_PAGE_SIZE) -> pd.DataFrame:
+        cases_df = self.backend.worklist(offset=offset, limit=limit)
 
         return cases_df
 
+    def query_worklist(self, page=1, page_size=c.WORKLIST_PAGE_SIZE, sort_by="date", descending=True,
+                       modality=None, priority=None, date_from=None, date_to=None, ai_flagged=None,
+                       id_after=None):
+        """
+        Returns (cases_df for one worklist page, total number of matching studies, number of pages).
+        Sorting and filtering happen in the backend; only the requested page is fetched.
+        """
+        filters = {
+            "modality": modality,
+            "priority": priority,
+            "date_from": date_from,
+            "date_to": date_to,
+            "ai_flagged": ai_flagged,
+            "id_after": id_after,
+        }
+        offset = (max(page, 1) - 1) * page_size
+        cases_df, total = self.backend.query_worklist(offset=offset, limit=page_size, sort_by=sort_by,
+                                                      descending=descending, filters=filters)
+        pages = max(1, -(-total // page_size))
+        return cases_df, total, pages
+
+    def get_study(self, study_id):
+        """
+        Returns the worklist record (id, url, modality, date, priority, ai_flagged) of one study,
+        looked up by key in the backend index, or None if there is no such study.
+        """
+        return self.backend.get_study(study_id)
 
+    def worklist_facets(self) -> dict:
+        return self.backend.worklist_facets()
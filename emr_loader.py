@@ -1,43 +1,22 @@
 import pandas as pd
-import streamlit as st
+from constants import EMR_PAGE_SIZE
+from database import get_backend
+from study_context import streamlit_context
 
-from constants import CASES
 
+def search_records(search_type: str, search_field: str, offset: int = 0, limit: int = EMR_PAGE_SIZE) -> pd.DataFrame:
+    """Search records by Study ID or Patient MRN, returning one page of reports or of the flattened chart view."""
+    store = get_backend()
 
-def search_records(search_type: str, search_field: str) -> pd.DataFrame:
-    """Search records by Study ID or Patient MRN, returning either reports or a flattened chart view."""
-    df = pd.DataFrame(CASES)
-
-    # 1) Narrow down the matches
-    if search_type == "Study ID":
-        result_df = df[df["Study ID"].astype(str).str.contains(search_field, case=False, na=False)]
-    elif search_type == "Patient MRN":
-        result_df = df[df["Patient MRN"].str.contains(search_field, case=False, na=False)]
-    else:
-        return pd.DataFrame()  # No valid search
-
-    if result_df.empty:
-        return pd.DataFrame()  # No matches
-
-    # 2) If searching by Study ID → return the "report" rows
+    # If searching by Study ID → return the "report" rows
     if search_type == "Study ID":
-        # Just return top-level columns
-        return result_df[
-            ["Study ID", "Patient MRN", "Date", "Modality"]].reset_index(drop=True)
+        return store.search_studies(search_field, offset=offset, limit=limit)
 
-    # 3) If searching by Patient MRN → flatten & return the medical charts
+    # If searching by Patient MRN → return the pre-flattened medical charts
     if search_type == "Patient MRN":
-        expanded_rows = []
-        for _, row in result_df.iterrows():
-            for chart_item in row["medical_charts"]:
-                flattened = {"Patient MRN": row["Patient MRN"]}
-                # Merge this particular chart entry
-                flattened.update(chart_item)
-                expanded_rows.append(flattened)
-        return pd.DataFrame(expanded_rows).reset_index(drop=True)
+        return store.search_charts(search_field, offset=offset, limit=limit)
 
-    # Fallback — should never be reached if you covered all search types
-    return pd.DataFrame()
+    return pd.DataFrame()  # No valid search
 
 
 def get_clinical_data_from_patient():
@@ -65,24 +44,23 @@ def get_clinical_data_from_patient():
 
         If no matching data is found, the message "No data was found" will be returned.
     """
-    df = pd.DataFrame(CASES)
+    with streamlit_context() as ctx:
+        study_id = ctx.study_id if ctx.study_id is not None else 0
+    return get_clinical_data(study_id)
 
-    if "study_id" in st.session_state:
-        study_id = st.session_state["study_id"]
-    else:
-        study_id = 0
 
-    # Step 1: Identify the patient using study_id
-    patient_data = df[df["Study ID"] == study_id]
+def get_clinical_data(study_id) -> str:
+    """
+    Same as get_clinical_data_from_patient, for an explicit study ID.
+    """
+    store = get_backend()
 
-    if patient_data.empty:
+    # Step 1: Identify the patient using study_id
+    if not store.has_study(study_id):
         return "No data was found"
 
-    # Step 2: Extract and sort medical charts by date (descending)
-    medical_charts = []
-    for _, row in patient_data.iterrows():
-        if "medical_charts" in row:
-            medical_charts.extend(row["medical_charts"])
+    # Step 2: Extract the medical charts of the study
+    medical_charts = store.charts_for_study(study_id)
 
     if not medical_charts:
         return "No clinical data available for this patient"
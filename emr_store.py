@@ -0,0 +1,232 @@
+import threading
+from collections import defaultdict
+
+import pandas as pd
+
+from constants import CASES, SAMPLE_CASES, PRIORITIES
+
+STUDY_COLUMNS = ["Study ID", "Patient MRN", "Date", "Modality"]
+WORKLIST_COLUMNS = ["id", "url", "modality", "date", "priority", "ai_flagged"]
+
+
+class NGramIndex:
+    """
+    Case-insensitive substring index over a set of string keys (Study IDs, MRNs).
+
+    Every 1-, 2- and 3-gram of a key points to the keys containing it. Queries of up to 3
+    characters are a single dictionary lookup; longer queries intersect the posting sets of
+    their trigrams and then verify the few remaining candidates.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self._postings = defaultdict(set)
+        self._keys = set()
+
+    def add(self, key):
+        key = str(key)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        lowered = key.lower()
+        for size in range(1, self.n + 1):
+            for i in range(len(lowered) - size + 1):
+                self._postings[lowered[i:i + size]].add(key)
+
+    def search(self, query):
+        query = str(query).lower()
+        if not query:
+            return set(self._keys)
+        if len(query) <= self.n:
+            return set(self._postings.get(query, ()))
+
+        grams = [query[i:i + self.n] for i in range(len(query) - self.n + 1)]
+        # Start from the rarest trigram to keep the intersection small
+        grams.sort(key=lambda gram: len(self._postings.get(gram, ())))
+        candidates = set(self._postings.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self._postings.get(gram, set())
+        return {key for key in candidates if query in key.lower()}
+
+
+class EMRStore:
+    """
+    In-memory EMR/PACS store built once per process from the case records.
+
+    - Studies are kept as columns (one list per field) with hash indexes on Study ID and MRN.
+    - Medical chart entries are flattened once into columnar rows, with row lists per MRN and study.
+    - Partial searches go through an n-gram index instead of scanning every record.
+    """
+
+    def __init__(self, cases=CASES, samples=SAMPLE_CASES):
+        self.samples = list(samples)
+        self._samples_by_study = {str(sample["id"]): sample for sample in self.samples}
+        self.studies = {column: [] for column in STUDY_COLUMNS}
+        self.charts = {"Patient MRN": []}  # column -> values, None where an entry has no such field
+        self._chart_count = 0
+
+        self._rows_by_study = defaultdict(list)  # str(Study ID) -> study rows
+        self._rows_by_mrn = defaultdict(list)  # MRN -> study rows
+        self._chart_rows_by_study = defaultdict(list)  # str(Study ID) -> chart rows
+        self._chart_rows_by_mrn = defaultdict(list)  # MRN -> chart rows
+
+        self._study_index = NGramIndex()
+        self._mrn_index = NGramIndex()
+
+        self._priority_by_study = {}
+        self._ai_flags = {}  # image url -> bool
+
+        for case in cases:
+            self.add_case(case)
+
+    def add_case(self, case):
+        row = len(self.studies["Study ID"])
+        for column in STUDY_COLUMNS:
+            self.studies[column].append(case.get(column))
+
+        study_key = str(case["Study ID"])
+        mrn = str(case["Patient MRN"])
+        self._rows_by_study[study_key].append(row)
+        self._rows_by_mrn[mrn].append(row)
+        self._study_index.add(study_key)
+        self._mrn_index.add(mrn)
+        self._priority_by_study[study_key] = case.get("Priority")
+
+        for chart_item in case.get("medical_charts", []):
+            chart_row = self._chart_count
+            self._chart_count += 1
+            for column, values in self.charts.items():
+                values.append(mrn if column == "Patient MRN" else chart_item.get(column))
+            for column, value in chart_item.items():
+                if column not in self.charts:
+                    # New field: pad the earlier rows so every column has one value per row
+                    self.charts[column] = [None] * chart_row + [value]
+            self._chart_rows_by_study[study_key].append(chart_row)
+            self._chart_rows_by_mrn[mrn].append(chart_row)
+
+    # ----------------- LOOKUPS -----------------
+    def search_studies(self, search_field, offset=0, limit=None) -> pd.DataFrame:
+        """
+        Returns the study rows whose Study ID contains search_field (case-insensitive).
+        """
+        rows = sorted(row for key in self._study_index.search(search_field) for row in self._rows_by_study[key])
+        return self._frame(self.studies, self._page(rows, offset, limit), STUDY_COLUMNS)
+
+    def search_charts(self, search_field, offset=0, limit=None) -> pd.DataFrame:
+        """
+        Returns the flattened chart rows of every patient whose MRN contains search_field.
+        """
+        rows = sorted(row for key in self._mrn_index.search(search_field) for row in self._chart_rows_by_mrn[key])
+        return self._frame(self.charts, self._page(rows, offset, limit), list(self.charts))
+
+    def worklist(self, offset=0, limit=None) -> pd.DataFrame:
+        """
+        Returns the worklist studies (id, url).
+        """
+        return pd.DataFrame(self._page(self.samples, offset, limit), columns=["id", "url"])
+
+    def query_worklist(self, offset=0, limit=None, sort_by="date", descending=True, filters=None):
+        """
+        Returns (one page of worklist studies, total number of matching studies).
+        Same filters and sort keys as SQLiteBackend.query_worklist.
+        """
+        filters = filters or {}
+        entries = [self._worklist_entry(sample) for sample in self.samples]
+
+        if filters.get("modality"):
+            entries = [e for e in entries if e["modality"] == filters["modality"]]
+        if filters.get("priority"):
+            entries = [e for e in entries if e["priority"] in filters["priority"]]
+        if filters.get("date_from"):
+            entries = [e for e in entries if e["date"] and e["date"] >= str(filters["date_from"])]
+        if filters.get("date_to"):
+            entries = [e for e in entries if e["date"] and e["date"] <= str(filters["date_to"])]
+        if filters.get("id_after"):
+            entries = [e for e in entries if e["id"] > int(filters["id_after"])]
+        if filters.get("ai_flagged") is not None:
+            entries = [e for e in entries if e["ai_flagged"] == bool(filters["ai_flagged"])]
+
+        if sort_by == "priority":
+            # Ranked by urgency, so the default descending sort puts STAT first and unknown priorities last
+            ranks = {name: len(PRIORITIES) - i for i, name in enumerate(PRIORITIES)}
+            sort_key = lambda e: ranks.get(e["priority"], 0)
+        else:
+            sort_key = lambda e: (e.get(sort_by) is not None, e.get(sort_by) or "")
+        entries.sort(key=lambda e: e["id"])
+        entries.sort(key=sort_key, reverse=descending)
+
+        return pd.DataFrame(self._page(entries, offset, limit), columns=WORKLIST_COLUMNS), len(entries)
+
+    def get_study(self, study_id):
+        """
+        Returns the worklist record of one study through the Study ID hash index, or None.
+        """
+        sample = self._samples_by_study.get(str(study_id))
+        return self._worklist_entry(sample) if sample is not None else None
+
+    def _worklist_entry(self, sample):
+        key = str(sample["id"])
+        rows = self._rows_by_study.get(key)
+        row = rows[0] if rows else None
+        return {
+            "id": sample["id"],
+            "url": sample["url"],
+            "modality": self.studies["Modality"][row] if row is not None else None,
+            "date": self.studies["Date"][row] if row is not None else None,
+            "priority": self._priority_by_study.get(key),
+            "ai_flagged": self._ai_flags.get(sample["url"], False),
+        }
+
+    def worklist_facets(self) -> dict:
+        modalities = sorted({value for value in self.studies["Modality"] if value is not None})
+        return {"modality": modalities, "priority": list(PRIORITIES)}
+
+    def set_ai_flag(self, image_url, flagged):
+        self._ai_flags[image_url] = bool(flagged)
+
+    def charts_for_study(self, study_id) -> list:
+        """
+        Returns the chart entries of an exact Study ID as dicts, without the empty fields.
+        """
+        rows = self._chart_rows_by_study.get(str(study_id), [])
+        return [
+            {column: values[row] for column, values in self.charts.items()
+             if column != "Patient MRN" and values[row] is not None}
+            for row in rows
+        ]
+
+    def has_study(self, study_id) -> bool:
+        return str(study_id) in self._rows_by_study
+
+    @staticmethod
+    def _page(rows, offset, limit):
+        return rows[offset:] if limit is None else rows[offset:offset + limit]
+
+    @staticmethod
+    def _frame(columns, rows, names) -> pd.DataFrame:
+        if not rows:
+            return pd.DataFrame()
+        data = {}
+        for name in names:
+            values = [columns[name][row] for row in rows]
+            # Drop chart fields none of the selected entries have, as the row-wise flattening did
+            if any(value is not None for value in values):
+                data[name] = values
+        return pd.DataFrame(data)
+
+
+_emr_store = None
+_emr_store_lock = threading.Lock()
+
+
+def get_emr_store() -> EMRStore:
+    """
+    Returns the process-wide EMRStore, building it on first use.
+    """
+    global _emr_store
+    with _emr_store_lock:
+        if _emr_store is None:
+            _emr_store = EMRStore()
+        return _emr_store
@@ -0,0 +1,540 @@
+import io
+import re
+import json
+import math
+import time
+import wave
+import random
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import httpx
+import numpy as np
+import openai
+import requests
+from PIL import Image
+from google.genai import errors, types
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import constants as c
+
+# Deterministic local stand-ins for every upstream service: Gemini, the HF endpoint, the image
+# hosts, OpenAI Whisper and SendGrid. They are used instead of the real clients when
+# c.USE_FAKES is set (WORKSTATION_FAKES=1), e.g. by benchmark.py and load_test.py.
+#
+# Answers only depend on the request (same image URL -> same probabilities, same prompt -> same
+# text). Latency is log-normal around each service's median and, like the injected errors, is
+# drawn from one seeded generator per service, so a single-threaded run replays exactly.
+
+
+class FakeService:
+    """
+    Latency and error model of one upstream service, plus its call counters.
+    """
+
+    def __init__(self, name, latency, sigma, error_rate, seed=c.FAKE_SEED):
+        self.name = name
+        self.latency = latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.reset(seed)
+
+    def reset(self, seed=c.FAKE_SEED):
+        with self._lock:
+            self._random = random.Random(f"{seed}:{self.name}")
+            self.stats = {"calls": 0, "errors": 0, "busy_seconds": 0.0}
+
+    def draw(self, scale=1.0):
+        """
+        Returns (latency in seconds, whether this call fails) for the next call.
+        """
+        with self._lock:
+            latency = self.latency * scale * math.exp(self._random.gauss(0, self.sigma)) if self.latency else 0.0
+            failed = self._random.random() < self.error_rate
+            self.stats["calls"] += 1
+            self.stats["errors"] += failed
+            self.stats["busy_seconds"] += latency
+        return latency, failed
+
+    def call(self, scale=1.0):
+        latency, failed = self.draw(scale)
+        time.sleep(latency)
+        return failed
+
+    async def call_async(self, scale=1.0):
+        latency, failed = self.draw(scale)
+        await asyncio.sleep(latency)
+        return failed
+
+
+SERVICES = {name: FakeService(name, **profile) for name, profile in c.FAKE_SERVICES.items()}
+
+
+def configure(latency_scale=None, error_rate=None, seed=None):
+    """
+    Rescales every service's median latency, overrides the error rate of every service and/or
+    reseeds them. Counters are reset.
+    """
+    for name, service in SERVICES.items():
+        if latency_scale is not None:
+            service.latency = c.FAKE_SERVICES[name]["latency"] * latency_scale
+        if error_rate is not None:
+            service.error_rate = error_rate
+        service.reset(c.FAKE_SEED if seed is None else seed)
+
+
+def get_stats() -> dict:
+    return {name: dict(service.stats) for name, service in SERVICES.items()}
+
+
+def _digest(*parts) -> bytes:
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).digest()
+
+
+# ----------------- GEMINI -----------------
+def _get(value, name):
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+
+def _text(value) -> str:
+    """
+    Flattens a str, Content, Part or list of them (as agno and prompt_cache pass them) to text.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return "\n".join(_text(item) for item in value)
+    if _get(value, "parts") is not None:
+        return _text(_get(value, "parts"))
+    return _get(value, "text") or ""
+
+
+def _tokens(text) -> int:
+    return max(1, len(text) // 4)
+
+
+def _section(prompt, header):
+    """
+    Returns the block of prompt after "### header:" up to the next "###" header or closing line.
+    """
+    match = re.search(rf"### {header}:\n(.*?)(?:\n\n###|\n\nReturn only|\Z)", prompt, re.S)
+    return match.group(1).strip() if match else ""
+
+
+class _FakePlanner:
+    """
+    Keyword-driven stand-in for the workflow agent's tool planning. A user message maps to a plan
+    of steps (tool calls that may run together); each model call asks for the first step whose
+    results are not in the conversation yet, then summarizes the tool results.
+    """
+
+    def plan(self, message, tools):
+        text = message.lower()
+        steps = []
+        email = re.search(r"[\w.+-]+@[\w-]+\.[\w.]+", message)
+        case = re.search(r"(?:case|study)\s*(?:id\s*)?#?\s*(\d+)", text)
+
+        if "list" in text and ("case" in text or "stud" in text):
+            steps.append([("list_available_cases", {})])
+        if case and any(word in text for word in ("load", "open", "read")):
+            steps.append([("load_case", {"case_number": int(case.group(1))})])
+        if re.search(r"\bread\b", text):
+            steps += [[("interpret_xray", {}), ("get_clinical_data_from_patient", {})],
+                      [("generate_report", None)], [("search_actionable_findings", {})]]
+        else:
+            if any(word in text for word in ("analy", "interpret", "classif")):
+                steps.append([("interpret_xray", {})])
+            if "report" in text and any(word in text for word in ("generate", "write", "draft", "create")):
+                if not any(name == "interpret_xray" for step in steps for name, _ in step):
+                    steps.append([("interpret_xray", {})])
+                steps.append([("generate_report", None)])
+            elif any(word in text for word in ("add", "change", "edit", "update", "remove", "replace")):
+                steps.append([("update_report", {"requested_changes": message})])
+            if any(word in text for word in ("history", "clinical", "vitals")):
+                steps.append([("get_clinical_data_from_patient", {})])
+            if any(word in text for word in ("notify", "notification", "send", "email")):
+                if email:
+                    steps.append([("_update_notification_email", {"email": email.group(0)})])
+                steps += [[("search_actionable_findings", {})], [("send_notification", None)]]
+            elif any(word in text for word in ("actionable", "critical", "urgent")):
+                steps.append([("search_actionable_findings", {})])
+
+        return [[(name, args) for name, args in step if name in tools] for step in steps
+                if any(name in tools for name, _ in step)]
+
+    def respond(self, contents, tools):
+        """
+        Returns ("calls", [(name, args)]) or ("text", answer) for the conversation in contents.
+        """
+        message, results, history = "", [], []
+        for content in contents:
+            for part in _get(content, "parts") or []:
+                response = _get(part, "function_response")
+                if response is not None:
+                    output = _get(response, "response") or {}
+                    output = output.get("result", output) if isinstance(output, dict) else output
+                    history.append((_get(response, "name"), str(output)))
+                    results.append((_get(response, "name"), str(output)))
+                elif _get(content, "role") == "user" and _get(part, "text"):
+                    message, results = _get(part, "text"), []
+
+        done = [name for name, _ in results]
+        for step in self.plan(message, tools):
+            if all(name in done for name, _ in step):
+                for name, _ in step:
+                    done.remove(name)
+                continue
+            return "calls", [(name, args if args is not None else self._arguments(name, history))
+                             for name, args in step]
+
+        if not results:
+            return "text", ("I can list and load cases, analyse the image, draft and edit the report, "
+                            "look for actionable findings and notify them. What would you like to do?")
+        lines = ["Done. Here is what I found:"]
+        lines += [f"- **{name}**: {output[:300]}" for name, output in results]
+        return "text", "\n".join(lines)
+
+    @staticmethod
+    def _arguments(name, history):
+        def latest(tool):
+            return next((output for called, output in reversed(history) if called == tool), "{}")
+
+        if name == "generate_report":
+            return {"findings": latest("interpret_xray")}
+        if name == "send_notification":
+            return {"findings": latest("search_actionable_findings")}
+        return {}
+
+
+def _complete(system, prompt) -> str:
+    """
+    Plain completions of ReportAgent and ActionableFindings, recognised by their prompts.
+    """
+    if "Return only a JSON list, without markdown" in prompt:
+        names = re.search(r"Use only these section names: (.*)", prompt)
+        sections = [name.strip() for name in names.group(1).split(",")] if names else ["IMPRESSION"]
+        section = "IMPRESSION" if "IMPRESSION" in sections else sections[-1]
+        current = _section(prompt, "CURRENT REPORT").partition(f"{section}:")[2]
+        lines = [line.strip() for line in current.split("\n\n")[0].splitlines() if line.strip()]
+        lines.append(f"{len(lines) + 1}. {_section(prompt, 'REQUESTED CHANGES')}")
+        return json.dumps([{"section": section, "lines": lines}])
+
+    if "### REQUESTED CHANGES:" in prompt:
+        report = _section(prompt, "CURRENT REPORT")
+        return f"{report}\n2. {_section(prompt, 'REQUESTED CHANGES')}"
+
+    if "### TEMPLATE:" in system:
+        template = _section(system, "TEMPLATE")
+        try:
+            findings = json.loads(_section(prompt, "FINDINGS"))
+            # The probabilities arrive as a JSON string encoded once more by ReportAgent
+            findings = json.loads(findings) if isinstance(findings, str) else findings
+        except ValueError:
+            findings = {}
+        positives = [label for label, score in (findings.items() if isinstance(findings, dict) else [])
+                     if label != "No Finding" and isinstance(score, (int, float)) and score >= 0.5]
+        if not positives:
+            return template
+        findings_part, _, _ = template.partition("IMPRESSION:")
+        impression = "\n".join(f"{i}. Findings suggestive of {label.lower()}." for i, label in enumerate(positives, 1))
+        return f"{findings_part.strip()}\n\nIMPRESSION:\n{impression}"
+
+    if "actionable findings" in prompt:
+        impression = prompt.partition("IMPRESSION:")[2]
+        findings = [line.split(".", 1)[1].strip() for line in impression.splitlines()
+                    if re.match(r"\s*\d+\.", line) and "normal" not in line.lower()]
+        return json.dumps([{"finding": finding, "urgency": "Urgent",
+                            "recommendation": "Clinical correlation and follow-up imaging."} for finding in findings])
+
+    return "OK."
+
+
+class _FakeModels:
+    def __init__(self, caches, service):
+        self._caches = caches
+        self._service = service
+        self._planner = _FakePlanner()
+
+    def _answer(self, model, contents, config):
+        cache_name = _get(config, "cached_content") if config is not None else None
+        cached = self._caches.lookup(cache_name) if cache_name else None
+        if cache_name and cached is None:
+            raise errors.ClientError(404, {"error": {"code": 404, "status": "NOT_FOUND",
+                                                     "message": f"{cache_name} not found (fake)."}})
+        system = _text(_get(config, "system_instruction") or (cached or {}).get("system_instruction"))
+        tools = _get(config, "tools") or (cached or {}).get("tools") or []
+        tool_names = {_get(declaration, "name") for tool in tools
+                      for declaration in (_get(tool, "function_declarations") or [])}
+        contents = contents if isinstance(contents, (list, tuple)) else [contents]
+
+        if tool_names:
+            kind, answer = self._planner.respond(contents, tool_names)
+        else:
+            kind, answer = "text", _complete(system, _text(contents))
+
+        if kind == "calls":
+            parts = [types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in answer]
+            text = json.dumps(answer)
+        else:
+            parts, text = None, answer
+
+        prefix_tokens = _tokens(system + str(tools))
+        prompt_tokens = prefix_tokens + _tokens(_text(contents))
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens, cached_content_token_count=prefix_tokens if cached else None,
+            candidates_token_count=_tokens(text), total_token_count=prompt_tokens + _tokens(text))
+        return parts, text, usage
+
+    @staticmethod
+    def _response(parts, usage=None):
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts),
+                                        finish_reason=types.FinishReason.STOP)],
+            usage_metadata=usage)
+
+    @staticmethod
+    def _fail():
+        raise errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE",
+                                                 "message": "The model is overloaded (fake)."}})
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        parts, text, usage = self._answer(model, contents, config)
+        if self._service.call(1.0 + _tokens(text) / 500):
+            self._fail()
+        return self._response(parts or [types.Part(text=text)], usage)
+
+    def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        parts, text, usage = self._answer(model, contents, config)
+        latency, failed = self._service.draw(1.0 + _tokens(text) / 500)
+        # Time to first token is about a third of the total, the rest is spread over the chunks
+        time.sleep(latency / 3)
+        if failed:
+            self._fail()
+        if parts:
+            yield self._response(parts, usage)
+            return
+
+        size = max(1, math.ceil(len(text) / c.FAKE_STREAM_CHUNKS))
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        # Like Gemini, every chunk carries usage metadata: zero counts until the final chunk has the totals
+        no_usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=0, candidates_token_count=0, total_token_count=0)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(2 * latency / 3 / len(chunks))
+            yield self._response([types.Part(text=chunk)], usage if i == len(chunks) - 1 else no_usage)
+
+    def embed_content(self, *, model, contents, config=None, **kwargs):
+        if self._service.call(0.2):
+            self._fail()
+        texts = contents if isinstance(contents, (list, tuple)) else [contents]
+        embeddings = []
+        for text in texts:
+            # Bag of hashed words: the same wording gives the same vector, shared words bring vectors closer
+            vector = np.zeros(256, dtype=np.float32)
+            for word in re.findall(r"\w+", _text(text).lower()):
+                vector[int.from_bytes(_digest(word)[:4], "little") % 256] += 1.0
+            embeddings.append(types.ContentEmbedding(values=vector.tolist()))
+        return types.EmbedContentResponse(embeddings=embeddings)
+
+
+class _FakeCaches:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # name -> {"system_instruction", "tools", "expires_at"}
+
+    def lookup(self, name):
+        with self._lock:
+            entry = self._entries.get(name) if name else None
+            if entry is None:
+                return None
+            if entry["expires_at"] < time.time():
+                del self._entries[name]
+                return None
+            return entry
+
+    @staticmethod
+    def _seconds(ttl):
+        return float(str(ttl or "3600s").rstrip("s"))
+
+    def create(self, *, model, config=None):
+        digest = _digest(model, _text(_get(config, "system_instruction")), str(_get(config, "tools")))
+        name = f"cachedContents/fake-{digest.hex()[:16]}"
+        expires_at = time.time() + self._seconds(_get(config, "ttl"))
+        with self._lock:
+            self._entries[name] = {"system_instruction": _get(config, "system_instruction"),
+                                   "tools": _get(config, "tools"), "expires_at": expires_at}
+        return types.CachedContent(name=name, model=model,
+                                   expire_time=datetime.fromtimestamp(expires_at, tz=timezone.utc))
+
+    def update(self, *, name, config=None):
+        with self._lock:
+            entry = self._entries[name]
+            entry["expires_at"] = time.time() + self._seconds(_get(config, "ttl"))
+        return types.CachedContent(name=name, expire_time=datetime.fromtimestamp(entry["expires_at"], tz=timezone.utc))
+
+    def delete(self, *, name, config=None):
+        with self._lock:
+            self._entries.pop(name, None)
+
+
+class FakeGeminiClient:
+    """
+    Stand-in for genai.Client with the parts the app uses: models.generate_content(_stream),
+    models.embed_content and caches. Responses are real google.genai types.
+    """
+
+    def __init__(self, service=None):
+        self.caches = _FakeCaches()
+        self.models = _FakeModels(self.caches, service or SERVICES["gemini"])
+
+
+# ----------------- OPENAI WHISPER -----------------
+TRANSCRIPTS = [
+    "Load case 101.",
+    "Analyse the image and generate the report.",
+    "Add mild cardiomegaly to the impression.",
+    "Are there any actionable findings?",
+    "Notify the actionable findings.",
+]
+
+
+class _FakeTranscriptions:
+    def __init__(self, service):
+        self._service = service
+
+    def create(self, *, model, file, response_format="json", **kwargs):
+        if isinstance(file, tuple):
+            file = file[1]
+        data = file if isinstance(file, (bytes, bytearray, memoryview)) else file.read()
+        data = bytes(data)
+
+        duration = 0.0
+        try:
+            with wave.open(io.BytesIO(data), "rb") as audio:
+                duration = audio.getnframes() / float(audio.getframerate())
+        except (wave.Error, EOFError):
+            pass
+
+        latency, failed = self._service.draw()
+        time.sleep(latency + duration * c.FAKE_WHISPER_REALTIME_FACTOR)
+        if failed:
+            request = httpx.Request("POST", "https://api.openai.com/v1/audio/transcriptions")
+            raise openai.InternalServerError("The server had an error (fake).",
+                                             response=httpx.Response(500, request=request), body=None)
+
+        text = TRANSCRIPTS[_digest(data)[0] % len(TRANSCRIPTS)]
+        return text if response_format == "text" else {"text": text}
+
+
+class _FakeAudio:
+    def __init__(self, service):
+        self.transcriptions = _FakeTranscriptions(service)
+
+
+class FakeOpenAI:
+    """
+    Stand-in for openai.OpenAI with audio.transcriptions.create. The transcript is picked from
+    TRANSCRIPTS by the audio bytes, so the same recording always gives the same text.
+    """
+
+    def __init__(self, service=None):
+        self.audio = _FakeAudio(service or SERVICES["whisper"])
+
+
+# ----------------- HTTP (IMAGE HOSTS, SENDGRID, HF ENDPOINT) -----------------
+def fake_image(url, size=c.FAKE_IMAGE_SIZE) -> bytes:
+    """
+    Returns a grayscale PNG of noise seeded by url, about as heavy to transfer and decode as a study.
+    """
+    rng = np.random.default_rng(int.from_bytes(_digest(url)[:8], "little"))
+    pixels = rng.integers(0, 256, (size, size), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def fake_probabilities(image_url) -> list:
+    """
+    The HF endpoint's answer for image_url: one score per label, derived from the URL.
+    """
+    digest = _digest(image_url)
+    return [{"label": f"LABEL_{i}", "score": round(digest[i] / 255, 4)} for i in range(5)]
+
+
+class FakeHTTPAdapter(BaseAdapter):
+    """
+    requests transport adapter serving the sync calls: image downloads (with ETag revalidation)
+    and SendGrid's mail/send.
+    """
+
+    def __init__(self, image_service=None, sendgrid_service=None):
+        super().__init__()
+        self._image_service = image_service or SERVICES["image"]
+        self._sendgrid_service = sendgrid_service or SERVICES["sendgrid"]
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        headers = CaseInsensitiveDict()
+        if urlsplit(request.url).netloc == urlsplit(c.SENDGRID_API_URL).netloc:
+            failed = self._sendgrid_service.call()
+            status, body = (500, b'{"errors": [{"message": "fake failure"}]}') if failed else (202, b"")
+        else:
+            failed = self._image_service.call()
+            etag = f'"{_digest(request.url).hex()[:16]}"'
+            headers["ETag"] = etag
+            if failed:
+                status, body = 503, b""
+            elif request.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+            else:
+                status, body = 200, fake_image(request.url)
+                headers["Content-Type"] = "image/png"
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = {200: "OK", 202: "Accepted", 304: "Not Modified"}.get(status, "Error")
+        response.headers = headers
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+class FakeHFTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport standing in for the HF endpoint. It answers 503 for the first
+    c.FAKE_HF_COLD_START seconds (scaled to zero), and a batch costs one request plus
+    c.FAKE_HF_BATCH_COST of one request per extra image.
+    """
+
+    def __init__(self, service=None, cold_start=c.FAKE_HF_COLD_START):
+        self._service = service or SERVICES["hf"]
+        self.cold_start = cold_start
+        self._started_at = time.monotonic()
+
+    async def handle_async_request(self, request):
+        if time.monotonic() - self._started_at < self.cold_start:
+            await asyncio.sleep(0.01)
+            return httpx.Response(503, json={"error": "Service Unavailable"}, request=request)
+        if request.method == "GET":
+            return httpx.Response(200, json={"status": "ready"}, request=request)
+
+        inputs = json.loads(await request.aread()).get("inputs")
+        batch = inputs if isinstance(inputs, list) else [inputs]
+        if await self._service.call_async(1.0 + c.FAKE_HF_BATCH_COST * (len(batch) - 1)):
+            return httpx.Response(500, json={"error": "Internal Server Error (fake)"}, request=request)
+
+        answer = [fake_probabilities(url) for url in batch] if isinstance(inputs, list) else fake_probabilities(inputs)
+        return httpx.Response(200, json=answer, request=request)
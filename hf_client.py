@@ -0,0 +1,157 @@
+import random
+import asyncio
+import threading
+import concurrent.futures
+
+import httpx
+
+import constants as c
+from http_transport import get_transport
+from tracing import current_span
+
+
+class EndpointWakeUpTimeout(Exception):
+    """Raised when the endpoint is still answering 503 after HF_COLD_START_MAX_WAIT seconds."""
+
+
+class AsyncInferenceClient:
+    """
+    asyncio/httpx client for a Hugging Face inference endpoint.
+
+    All requests run on one background event loop and share one httpx connection pool, so retries
+    never sleep in the caller's thread. The caller still waits for the answer, including any cold
+    start: request() blocks, so the app calls it from JobQueue, batcher or prefetch workers, never
+    from the script thread; submit() returns a Future for callers that must not wait at all.
+
+    When the endpoint is scaled to zero it answers 503 while it wakes up: the first caller starts a
+    single warm-up task that polls the endpoint with exponential backoff plus jitter, and every
+    other caller awaits that same task instead of polling on its own.
+    """
+
+    def __init__(self, api_url, headers):
+        self.api_url = api_url
+        self.headers = headers
+        self.ready = False
+        self._client = None
+        self._warmup = None  # asyncio.Task shared by every caller while the endpoint wakes up
+
+    @property
+    def warming(self):
+        return self._warmup is not None and not self._warmup.done()
+
+    # ----------------- SYNC API (any thread) -----------------
+    def submit(self, payload) -> concurrent.futures.Future:
+        """
+        Posts payload without waiting: returns a Future resolving to the httpx.Response, or raising
+        EndpointWakeUpTimeout if the endpoint does not wake up. Poll self.warming to report a cold start.
+        """
+        # The event loop does not see this thread's context: pass the span to record retries on
+        return asyncio.run_coroutine_threadsafe(self.infer(payload, trace_span=current_span()), _get_loop())
+
+    def request(self, payload, on_cold_start=None):
+        """
+        Posts payload and returns the httpx.Response, blocking the calling thread until it arrives,
+        up to HF_COLD_START_MAX_WAIT seconds while the endpoint wakes up. on_cold_start (if given)
+        is called once, in the calling thread, if the endpoint is waking up.
+        """
+        future = self.submit(payload)
+        notified = False
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except concurrent.futures.TimeoutError:
+                if self.warming and not notified and on_cold_start is not None:
+                    on_cold_start()
+                    notified = True
+
+    def warm_up(self):
+        """
+        Starts the readiness probe without waiting for it, e.g. when the app starts.
+        """
+        asyncio.run_coroutine_threadsafe(self._ensure_warm(), _get_loop())
+
+    # ----------------- ASYNC API (event loop) -----------------
+    async def infer(self, payload, trace_span=None):
+        for attempt in range(c.HF_MAX_COLD_START_RETRIES + 1):
+            if self.warming:
+                await self._ensure_warm()
+
+            response = await self._get_client().post(self.api_url, headers=self.headers, json=payload)
+            if response.status_code != 503:
+                self.ready = True
+                response.raise_for_status()
+                return response
+
+            # 503 means the endpoint is scaled to zero (cold start): wait for the shared warm-up
+            self.ready = False
+            if trace_span is not None:
+                trace_span.add_event("cold_start_retry", attempt=attempt + 1)
+            await self._ensure_warm()
+
+        response.raise_for_status()
+        return response
+
+    async def _ensure_warm(self):
+        if self.ready and not self.warming:
+            return
+        if self._warmup is None or self._warmup.done():
+            self._warmup = asyncio.ensure_future(self._probe_until_ready())
+        # shield: a caller giving up must not cancel the warm-up other callers are waiting on
+        await asyncio.shield(self._warmup)
+
+    async def _probe_until_ready(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + c.HF_COLD_START_MAX_WAIT
+        attempt = 0
+
+        while True:
+            try:
+                response = await self._get_client().get(self.api_url + c.HF_READINESS_PATH, headers=self.headers)
+                if response.status_code != 503:
+                    self.ready = True
+                    return
+            except httpx.TransportError as e:
+                print(f"Readiness probe failed: {str(e)}")
+
+            # Exponential backoff with equal jitter: half fixed, half random
+            delay = min(c.HF_BACKOFF_MAX_DELAY, c.HF_BACKOFF_BASE_DELAY * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            attempt += 1
+
+            if loop.time() + delay > deadline:
+                raise EndpointWakeUpTimeout(f"Endpoint not ready after {c.HF_COLD_START_MAX_WAIT} seconds")
+            await asyncio.sleep(delay)
+
+    def _get_client(self):
+        # One pooled client per endpoint from the shared transport, reused by every request
+        if self._client is None:
+            self._client = get_transport().async_client(
+                f"hf:{self.api_url}",
+                timeout=httpx.Timeout(c.HF_REQUEST_TIMEOUT, connect=c.HF_CONNECT_TIMEOUT),
+                max_connections=c.HF_MAX_CONNECTIONS,
+            )
+        return self._client
+
+
+_loop = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="hf-client-loop", daemon=True).start()
+        return _loop
+
+
+def get_inference_client(api_url, headers) -> AsyncInferenceClient:
+    """
+    Returns the process-wide client for api_url, creating it on first use.
+    """
+    with _lock:
+        if api_url not in _clients:
+            _clients[api_url] = AsyncInferenceClient(api_url, headers)
+        return _clients[api_url]
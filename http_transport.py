@@ -0,0 +1,139 @@
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+import constants as c
+
+
+class HttpTransport:
+    """
+    Shared HTTP layer used by every outbound client (image loader, inference client, notifier).
+
+    - Sync calls go through one requests.Session with a per-host urllib3 connection pool, so
+      repeated calls to the same host reuse a kept-alive TCP+TLS connection.
+    - Async calls (HF endpoint) go through one httpx.AsyncClient per name, with the same limits.
+    - Every call gets a (connect, read) timeout unless the caller passes its own.
+    - Per-host counters are kept for requests, errors and elapsed time, plus live pool usage.
+
+    adapter and async_transport replace the network layer of both sides (e.g. with the fakes).
+    """
+
+    def __init__(self, pool_hosts=c.HTTP_POOL_HOSTS, pool_maxsize=c.HTTP_POOL_MAXSIZE,
+                 timeout=(c.HTTP_CONNECT_TIMEOUT, c.HTTP_READ_TIMEOUT), adapter=None, async_transport=None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: {"requests": 0, "errors": 0, "elapsed": 0.0})
+        self._async_transport = async_transport
+
+        self._adapter = adapter or HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self.session.hooks["response"].append(self._record_response)
+
+        self._async_clients = {}
+
+    # ----------------- SYNC -----------------
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self._record_error(url)
+            raise
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    # ----------------- ASYNC -----------------
+    def async_client(self, name, timeout=None, max_connections=c.HTTP_POOL_MAXSIZE) -> httpx.AsyncClient:
+        """
+        Returns the shared httpx.AsyncClient registered under name, creating it on first use.
+        An AsyncClient must only be used from one event loop.
+        """
+        with self._lock:
+            if name not in self._async_clients:
+                connect, read = self.timeout
+                self._async_clients[name] = httpx.AsyncClient(
+                    timeout=timeout or httpx.Timeout(read, connect=connect),
+                    limits=httpx.Limits(max_connections=max_connections,
+                                        max_keepalive_connections=max_connections),
+                    event_hooks={"response": [self._record_async_response]},
+                    transport=self._async_transport,
+                )
+            return self._async_clients[name]
+
+    # ----------------- METRICS -----------------
+    def _record_response(self, response, *args, **kwargs):
+        with self._lock:
+            host_metrics = self._metrics[urlsplit(response.url).netloc]
+            host_metrics["requests"] += 1
+            host_metrics["elapsed"] += response.elapsed.total_seconds()
+
+    async def _record_async_response(self, response):
+        with self._lock:
+            self._metrics[response.request.url.host]["requests"] += 1
+
+    def _record_error(self, url):
+        with self._lock:
+            self._metrics[urlsplit(url).netloc]["errors"] += 1
+
+    def get_metrics(self):
+        """
+        Returns per-host request counters and the current usage of each connection pool.
+        """
+        with self._lock:
+            metrics = {"hosts": {host: dict(values) for host, values in self._metrics.items()}}
+
+        pools = {}
+        pool_manager = getattr(self._adapter, "poolmanager", None)
+        for key in list(pool_manager.pools.keys()) if pool_manager is not None else []:
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            pools[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests_sent": pool.num_requests,
+                "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+        metrics["sync_pools"] = pools
+
+        async_pools = {}
+        for name, client in self._async_clients.items():
+            try:
+                # httpx does not expose pool state publicly; this is read-only introspection
+                connections = client._transport._pool.connections
+                async_pools[name] = {
+                    "open_connections": len(connections),
+                    "idle_connections": sum(1 for conn in connections if conn.is_idle()),
+                }
+            except AttributeError:
+                async_pools[name] = {}
+        metrics["async_pools"] = async_pools
+        return metrics
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    """
+    Returns the process-wide HttpTransport, creating it on first use.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if c.USE_FAKES:
+                from fakes import FakeHTTPAdapter, FakeHFTransport
+                _transport = HttpTransport(adapter=FakeHTTPAdapter(), async_transport=FakeHFTransport())
+            else:
+                _transport = HttpTransport()
+        return _transport
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import constants as c
+from http_transport import get_transport
+from tracing import span, set_attribute
+
+
+class ImageCache:
+    """
+    Process-wide image cache shared by every Streamlit session.
+
+    Images are addressed by the SHA-256 of their bytes. A URL index maps each URL to the
+    content hash plus the validators (ETag / Last-Modified) returned by the server.
+
+    - Memory tier: LRU of fully decoded PIL images, bounded by an estimated pixel size in bytes.
+    - Disk tier: raw image bytes under cache_dir, bounded by total file size.
+    - A URL checked less than max_age seconds ago is served without touching the network;
+      older entries are revalidated with a conditional GET (If-None-Match / If-Modified-Since).
+    """
+
+    def __init__(self, cache_dir=c.IMAGE_CACHE_DIR, max_memory_bytes=c.IMAGE_CACHE_MAX_MEMORY_BYTES,
+                 max_disk_bytes=c.IMAGE_CACHE_MAX_DISK_BYTES, max_age=c.IMAGE_CACHE_MAX_AGE,
+                 resolve_workers=c.IMAGE_CACHE_RESOLVE_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+
+        self._lock = threading.RLock()
+        self._decoded = OrderedDict()  # content hash -> (PIL image, estimated size in bytes)
+        self._memory_bytes = 0
+        self._index = OrderedDict()  # url -> {"hash", "etag", "last_modified", "checked_at"}
+        self._disk_sizes = OrderedDict()  # content hash -> file size, least recently used first
+        self._resolver = ThreadPoolExecutor(max_workers=resolve_workers, thread_name_prefix="image-resolve")
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "not_modified": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    # ----------------- PUBLIC API -----------------
+    def get_image(self, url):
+        """
+        Returns the decoded PIL image for a URL, or None if it cannot be loaded.
+        """
+        content_hash = self._resolve(url)
+        if content_hash is None:
+            return None
+
+        with self._lock:
+            if content_hash in self._decoded:
+                self._decoded.move_to_end(content_hash)
+                self.stats["memory_hits"] += 1
+                return self._decoded[content_hash][0]
+
+        data = self._read_bytes(content_hash)
+        if data is None:
+            return None
+
+        image = Image.open(BytesIO(data))
+        image.load()  # Force the full decode now so cached images are ready to display
+        self._remember_decoded(content_hash, image)
+        return image
+
+    def get_bytes(self, url):
+        """
+        Returns (raw bytes, content hash) for a URL, or (None, None) if it cannot be loaded.
+        """
+        content_hash = self._resolve(url)
+        if content_hash is None:
+            return None, None
+        return self._read_bytes(content_hash), content_hash
+
+    def get_content_hash(self, url):
+        """
+        Returns the SHA-256 content hash for a URL, downloading the image if needed.
+        """
+        return self._resolve(url)
+
+    def get_content_hashes(self, urls) -> dict:
+        """
+        Returns {url: content hash} for several URLs, downloading the missing images concurrently.
+        A URL that cannot be loaded maps to None.
+        """
+        def resolve(url):
+            try:
+                return self._resolve(url)
+            except Exception as e:
+                print(f"Could not hash image {url}: {str(e)}")
+                return None
+
+        urls = list(dict.fromkeys(urls))
+        return dict(zip(urls, self._resolver.map(resolve, urls)))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_items"] = len(self._decoded)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_items"] = len(self._disk_sizes)
+            stats["disk_bytes"] = sum(self._disk_sizes.values())
+            return stats
+
+    # ----------------- URL RESOLUTION -----------------
+    def _resolve(self, url):
+        """
+        Maps a URL to a content hash, going to the network only when the entry is unknown or stale.
+        """
+        if not url:
+            return None
+
+        with self._lock:
+            entry = self._index.get(url)
+            if entry and entry["hash"] in self._disk_sizes:
+                self._index.move_to_end(url)
+                if time.time() - entry["checked_at"] < self.max_age:
+                    if entry["hash"] not in self._decoded:
+                        self.stats["disk_hits"] += 1
+                    set_attribute("image_cache.hit", True)
+                    return entry["hash"]
+            else:
+                entry = None
+
+        with self._lock:
+            self.stats["revalidations" if entry else "misses"] += 1
+
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        set_attribute("image_cache.hit", False)
+        with span("image.download", revalidation=bool(entry)):
+            response = get_transport().get(url, headers=headers)
+            set_attribute("http.status_code", response.status_code)
+            set_attribute("payload.bytes", len(response.content))
+
+        if entry and response.status_code == 304:
+            with self._lock:
+                entry["checked_at"] = time.time()
+                self.stats["not_modified"] += 1
+                self._save_index()
+            return entry["hash"]
+
+        response.raise_for_status()
+        content_hash = self._write_bytes(response.content)
+
+        with self._lock:
+            self._index[url] = {
+                "hash": content_hash,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "checked_at": time.time(),
+            }
+            self._index.move_to_end(url)
+            self._save_index()
+        return content_hash
+
+    # ----------------- MEMORY TIER -----------------
+    def _remember_decoded(self, content_hash, image):
+        size = image.width * image.height * len(image.getbands())
+        with self._lock:
+            if content_hash in self._decoded:
+                return
+            self._decoded[content_hash] = (image, size)
+            self._memory_bytes += size
+            # Always keep the most recent image, even if it alone exceeds the budget
+            while self._memory_bytes > self.max_memory_bytes and len(self._decoded) > 1:
+                _, (_, evicted_size) = self._decoded.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.stats["memory_evictions"] += 1
+
+    # ----------------- DISK TIER -----------------
+    def _path_for(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash)
+
+    def _read_bytes(self, content_hash):
+        try:
+            with open(self._path_for(content_hash), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_sizes.pop(content_hash, None)
+            return None
+        with self._lock:
+            if content_hash in self._disk_sizes:
+                self._disk_sizes.move_to_end(content_hash)
+        return data
+
+    def _write_bytes(self, data):
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._path_for(content_hash)
+
+        with self._lock:
+            if content_hash not in self._disk_sizes:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self._disk_sizes[content_hash] = len(data)
+            self._disk_sizes.move_to_end(content_hash)
+            self._evict_disk()
+        return content_hash
+
+    def _evict_disk(self):
+        total = sum(self._disk_sizes.values())
+        while total > self.max_disk_bytes and len(self._disk_sizes) > 1:
+            content_hash, size = self._disk_sizes.popitem(last=False)
+            total -= size
+            try:
+                os.remove(self._path_for(content_hash))
+            except FileNotFoundError:
+                pass
+            for url in [u for u, e in self._index.items() if e["hash"] == content_hash]:
+                del self._index[url]
+            self.stats["disk_evictions"] += 1
+
+    # ----------------- INDEX PERSISTENCE -----------------
+    def _index_path(self):
+        return os.path.join(self.cache_dir, "index.json")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+
+        for url, entry in index.items():
+            path = self._path_for(entry["hash"])
+            if os.path.exists(path):
+                self._index[url] = entry
+                self._disk_sizes[entry["hash"]] = os.path.getsize(path)
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path())
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """
+    Returns the process-wide ImageCache, creating it on first use.
+    """
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache()
+        return _image_cache
@@ -1,12 +1,67 @@
 import os
 import json
-import requests
+import httpx
 import streamlit as st
 
 from agno.tools import Toolkit
 
 import time
+import queue
+import threading
+from concurrent.futures import Future
 
+import constants as c
+from image_cache import get_image_cache
+from inference_cache import get_inference_cache
+from hf_client import get_inference_client, EndpointWakeUpTimeout
+from study_context import StudyContext, streamlit_context
+from database import get_backend
+from job_queue import current_job
+from tracing import span, set_attribute, add_event
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from any thread into micro-batches of at most max_batch_size items.
+    A batch is sent when it is full or max_wait seconds after its first item arrived, whichever
+    comes first. send_batch receives a list of items and returns one result per item, in order.
+    """
+
+    def __init__(self, send_batch, max_batch_size=c.INFERENCE_BATCH_MAX_SIZE, max_wait=c.INFERENCE_BATCH_MAX_WAIT):
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.send_batch(items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
 
 
 class ImageInterpreterAgent(Toolkit):
@@ -14,6 +69,16 @@ class ImageInterpreterAgent(Toolkit):
     ImageInterpreterAgent is a toolkit for analyzing medical images using an API.
     """
 
+    LABEL_MAPPING = {
+        "LABEL_4": "Cardiomegaly",
+        "LABEL_0": "Edema",
+        "LABEL_1": "Consolidation",
+        "LABEL_2": "Pneumonia",
+        "LABEL_3": "No Finding"
+    }
+    # Bump whenever LABEL_MAPPING changes so cached results with the old labels are ignored
+    LABEL_MAPPING_VERSION = "1"
+
     def __init__(self):
         HF_API_URL = "https://ll58hy3yilhy3pe7.us-east-1.aws.endpoints.huggingface.cloud" #kuriki
         HF_API_KEY = os.getenv("HF_API_KEY")
@@ -25,6 +90,9 @@ class ImageInterpreterAgent(Toolkit):
             "Authorization": f"Bearer {HF_API_KEY}",
             "Content-Type": "application/json"
         }
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
         self.register(self.interpret_xray)
 
     def interpret_xray(self) -> str:
@@ -41,88 +109,233 @@ class ImageInterpreterAgent(Toolkit):
             "fracture": 0.024887
         }
         """
+        def warn_cold_start():
+            # Copilot turns run this tool on a JobQueue worker (or a parallel tool thread of its
+            # turn), which must not draw: the note is shown by the page's polling fragment instead
+            job = current_job()
+            if job is not None:
+                job.set_note("Starting up HuggingFace agent. Please wait...")
+            else:
+                st.warning('Starting up HuggingFace agent. Please wait...', icon="⏳")
+
+        with streamlit_context() as ctx:
+            return self.interpret_study(ctx, on_cold_start=warn_cold_start)
+
+    def interpret_study(self, ctx: StudyContext, on_cold_start=None) -> str:
+        """
+        Classifies the image of the study in ctx. Same output as interpret_xray.
+        """
+        image_url = ctx.image_url
+
+        # If the worklist prefetcher is classifying this image, give it a moment to fill the inference cache
+        from prefetch import get_prefetcher
+        get_prefetcher().wait(image_url)
+
+        return self.interpret_image_url(image_url, on_cold_start=on_cold_start)
+
+    def interpret_image_url(self, image_url: str, on_cold_start=None, batched=False) -> str:
+        """
+        Classifies the image at image_url. Safe to call from worker threads: it does not touch
+        st.session_state, and on_cold_start (if given) is called once when the endpoint is waking up.
+        With batched, a cache miss joins the shared micro-batcher instead of sending its own request,
+        so concurrent callers (e.g. the batch triage workers) share requests.
+
+        Returns:
+            str: JSON response containing probability scores of detected conditions, or an error.
+        """
+        with span("hf.interpret", image_url=image_url):
+            return self._interpret_image_url(image_url, on_cold_start, batched)
+
+    def _interpret_image_url(self, image_url: str, on_cold_start=None, batched=False) -> str:
+        # Results are cached by image content, so the same study is only classified once per endpoint
         try:
-            image_url = st.session_state.image_url
-        except AttributeError as e:
-            # I'm running as a standalone python for testing
-            image_url = "https://prod-images-static.radiopaedia.org/images/27429050/0de8e5d6d8882005d17407a8283591_big_gallery.jpeg"
+            content_hash = get_image_cache().get_content_hash(image_url)
+        except Exception as e:
+            print(f"Could not hash image for the inference cache: {str(e)}")
+            content_hash = None
 
-        payload = {"inputs": image_url}
-        
+        if content_hash:
+            cached = get_inference_cache().get(content_hash, self.api_url, self.LABEL_MAPPING_VERSION)
+            set_attribute("inference_cache.hit", cached is not None)
+            if cached is not None:
+                return cached
+
+        if batched:
+            result = self._get_batcher().submit(image_url).result()
+        else:
+            result = self._request_inference(image_url, on_cold_start)
+
+        if "error" not in json.loads(result):
+            if content_hash:
+                get_inference_cache().put(content_hash, self.api_url, self.LABEL_MAPPING_VERSION, result)
+            self._record_ai_flag(image_url, result)
+        return result
+
+    @staticmethod
+    def _record_ai_flag(image_url: str, result: str):
+        """
+        Marks the worklist studies showing image_url as AI-flagged when any finding other than
+        "No Finding" reaches AI_FLAG_THRESHOLD, so the worklist can filter on it.
+        """
+        scores = json.loads(result)
+        flagged = any(label != "No Finding" and score >= c.AI_FLAG_THRESHOLD for label, score in scores.items())
         try:
-            try_count = 1
-            max_retries = 12  # Maximum number of retry attempts. In total, it will wait up to 1 min
-            sleep_time = 5  # Seconds to wait before retrying
-            send_notification = True
-
-            # Attempt to send inference request with retry logic
-            while try_count <= max_retries:
-                response = requests.post(self.api_url, headers=self.headers, json=payload)
-
-                if response.status_code == 503:
-                    if send_notification:
-                        st.warning('Starting up HuggingFace agent. Please wait...', icon="⏳")
-                        send_notification = False
-                    # Status code 503 indicates the Hugging Face endpoint might be inactive (cold start)
-                    if try_count < max_retries:
-                        time.sleep(sleep_time)  # Wait before retrying
-                        try_count += 1  # Increment retry count
-                        continue  # Retry request
-                    else:
-                        # Stop retrying if max attempts have been reached
-                        break
-                else:
-                    # If response is not 503, exit the loop as no retry is needed
-                    break
+            get_backend().set_ai_flag(image_url, flagged)
+        except Exception as e:
+            print(f"Could not record the AI flag: {str(e)}")
+
+    def interpret_xrays(self, image_urls: list) -> str:
+        """
+        Classifies several images at once, e.g. to triage a whole worklist. Images that were already
+        classified come from the result cache; the others are grouped into micro-batches and each
+        micro-batch is sent to the API in a single request.
+
+        Args:
+            image_urls: List of image URLs to classify.
+
+        Returns:
+            str: JSON object mapping each image URL to its probability scores (or an error).
+        """
+        results = {}
+        pending = []
 
-            response.raise_for_status()  # Raise an exception for bad status codes
-            
+        # Every image is hashed (downloaded in parallel) and looked up first, then all the misses are
+        # submitted together, so the batcher sees them at once and fills whole micro-batches
+        hashes = get_image_cache().get_content_hashes(image_urls)
+        for url, content_hash in hashes.items():
+            cached = None
+            if content_hash:
+                cached = get_inference_cache().get(content_hash, self.api_url, self.LABEL_MAPPING_VERSION)
+            if cached is not None:
+                results[url] = json.loads(cached)
+            else:
+                pending.append(url)
+
+        batcher = self._get_batcher()
+        futures = {url: batcher.submit(url) for url in pending}
+
+        for url, future in futures.items():
+            content_hash = hashes[url]
+            result = future.result()
+            if "error" not in json.loads(result):
+                if content_hash:
+                    get_inference_cache().put(content_hash, self.api_url, self.LABEL_MAPPING_VERSION, result)
+                self._record_ai_flag(url, result)
+            results[url] = json.loads(result)
+
+        return json.dumps(results, indent=2)
+
+    def _get_batcher(self):
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = MicroBatcher(self._request_batch_inference)
+            return self._batcher
+
+    def _request_inference(self, image_url: str, on_cold_start=None) -> str:
+        """
+        Sends the inference request to the HF endpoint, retrying while the endpoint is cold.
+        """
+        payload = {"inputs": image_url}
+
+        try:
+            response = self._post_inference(payload, on_cold_start)
             response_data = response.json()
             print("API Response:", response_data)  # Debug print
-            
-            # Check if response_data is a string (error message)
-            if isinstance(response_data, str):
-                return json.dumps({"error": response_data})
-                
-            # Check if response_data is a dict with 'error' key
-            if isinstance(response_data, dict) and 'error' in response_data:
-                return json.dumps(response_data)
-                
-            transformed_data = self._transform_response(response_data)
-            return json.dumps(transformed_data, indent=2)
-            
-        except requests.exceptions.HTTPError as e:
+            return self._format_result(response_data)
+
+        except Exception as e:
+            return self._format_exception(e)
+
+    def _request_batch_inference(self, image_urls: list, on_cold_start=None) -> list:
+        """
+        Sends a micro-batch in a single request using the list form of "inputs", then splits the
+        response back into one result per image, in the same order as image_urls.
+        """
+        payload = {"inputs": image_urls}
+
+        try:
+            response = self._post_inference(payload, on_cold_start)
+            response_data = response.json()
+            print("Batch API Response:", response_data)  # Debug print
+
+            # A batch answer is a list with one prediction list per input
+            if isinstance(response_data, list) and len(response_data) == len(image_urls) \
+                    and all(isinstance(item, list) for item in response_data):
+                return [self._format_result(item) for item in response_data]
+
+            # A single input may come back as a flat list of {"label", "score"} predictions
+            if len(image_urls) == 1:
+                return [self._format_result(response_data)]
+
+            error = self._format_result(response_data)
+            if "error" not in json.loads(error):
+                error = json.dumps({"error": "Batch response does not match the number of inputs"})
+            return [error] * len(image_urls)
+
+        except Exception as e:
+            return [self._format_exception(e)] * len(image_urls)
+
+    def _post_inference(self, payload, on_cold_start=None):
+        """
+        Posts the payload to the HF endpoint through the shared async client. If the endpoint is
+        cold (503), the client waits on the shared warm-up instead of sleeping in this thread.
+        """
+        inputs = payload["inputs"]
+        with span("hf.request", batch_size=len(inputs) if isinstance(inputs, list) else 1,
+                  **{"payload.bytes": len(json.dumps(payload))}):
+            def cold_start():
+                add_event("endpoint_cold_start")
+                if on_cold_start is not None:
+                    on_cold_start()
+
+            response = get_inference_client(self.api_url, self.headers).request(payload, cold_start)
+            set_attribute("http.status_code", response.status_code)
+            set_attribute("response.bytes", len(response.content))
+            return response
+
+    def warm_up(self):
+        """
+        Starts waking up the HF endpoint in the background so the first analysis does not wait for it.
+        """
+        get_inference_client(self.api_url, self.headers).warm_up()
+
+    def _format_result(self, response_data) -> str:
+        """
+        Converts one decoded API answer into the JSON string returned by the tools.
+        """
+        # Check if response_data is a string (error message)
+        if isinstance(response_data, str):
+            return json.dumps({"error": response_data})
+
+        # Check if response_data is a dict with 'error' key
+        if isinstance(response_data, dict) and 'error' in response_data:
+            return json.dumps(response_data)
+
+        transformed_data = self._transform_response(response_data)
+        return json.dumps(transformed_data, indent=2)
+
+    @staticmethod
+    def _format_exception(e) -> str:
+        if isinstance(e, (httpx.HTTPStatusError, EndpointWakeUpTimeout)):
             error_msg = f"It was not possible to connect to the interpretation API. Please contact the support team: {str(e)}"
-            print(error_msg)  # Debug print
-            return json.dumps({"error": error_msg})
-        except requests.exceptions.RequestException as e:
+        elif isinstance(e, httpx.HTTPError):
             error_msg = f"API request failed: {str(e)}"
-            print(error_msg)  # Debug print
-            return json.dumps({"error": error_msg})
-        except json.JSONDecodeError as e:
+        elif isinstance(e, json.JSONDecodeError):
             error_msg = f"Invalid JSON response: {str(e)}"
-            print(error_msg)  # Debug print
-            return json.dumps({"error": error_msg})
-        except Exception as e:
+        else:
             error_msg = f"Unexpected error: {str(e)}"
-            print(error_msg)  # Debug print
-            return json.dumps({"error": error_msg})
+        print(error_msg)  # Debug print
+        return json.dumps({"error": error_msg})
 
-    @staticmethod
-    def _transform_response(api_response):
+    @classmethod
+    def _transform_response(cls, api_response):
         """
         Transforms the API response to the desired format using a mapping dictionary.
         """
         # Debug print to see the structure of api_response
         print("Transform input:", api_response)
 
-        label_mapping = {
-            "LABEL_4": "Cardiomegaly",
-            "LABEL_0": "Edema",
-            "LABEL_1": "Consolidation",
-            "LABEL_2": "Pneumonia",
-            "LABEL_3": "No Finding"
-        }
+        label_mapping = cls.LABEL_MAPPING
 
         transformed_output = {}
 
@@ -149,6 +362,8 @@ class ImageInterpreterAgent(Toolkit):
 
 
 if __name__ == "__main__":
+    # I'm running as a standalone python for testing
     agent = ImageInterpreterAgent()
-    response = agent.interpret_xray()
+    ctx = StudyContext(image_url="https://prod-images-static.radiopaedia.org/images/27429050/0de8e5d6d8882005d17407a8283591_big_gallery.jpeg")
+    response = agent.interpret_study(ctx)
     print(response)
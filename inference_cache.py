@@ -0,0 +1,115 @@
+import os
+import time
+import sqlite3
+import threading
+
+import constants as c
+
+
+class InferenceCache:
+    """
+    Durable cache of classifier results shared by every session (and every process) on this host.
+
+    Results are keyed by (image content hash, model endpoint, label mapping version), so the same
+    image reached through different URLs hits the same entry, and a new endpoint or label mapping
+    never returns stale labels. The store is a SQLite file in WAL mode, which lets any number of
+    readers run while a writer commits.
+    """
+
+    def __init__(self, db_path=c.INFERENCE_CACHE_PATH, ttl=c.INFERENCE_CACHE_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS inference_results (
+                content_hash TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                label_version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, endpoint, label_version)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.commit()
+
+    def _connection(self):
+        # One connection per thread: sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, content_hash, endpoint, label_version):
+        """
+        Returns the cached result string, or None if there is no live entry.
+        """
+        row = self._connection().execute(
+            "SELECT result FROM inference_results "
+            "WHERE content_hash = ? AND endpoint = ? AND label_version = ? AND expires_at > ?",
+            (content_hash, endpoint, label_version, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, content_hash, endpoint, label_version, result, ttl=None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO inference_results "
+            "(content_hash, endpoint, label_version, result, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (content_hash, endpoint, label_version, result, now, now + ttl),
+        )
+        conn.commit()
+
+    def invalidate(self, content_hash=None, endpoint=None, label_version=None):
+        """
+        Deletes matching entries. With no arguments the whole cache is cleared.
+
+        Returns:
+            int: Number of deleted entries.
+        """
+        clauses, params = [], []
+        for column, value in (("content_hash", content_hash), ("endpoint", endpoint),
+                              ("label_version", label_version)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        conn = self._connection()
+        deleted = conn.execute(f"DELETE FROM inference_results{where}", params).rowcount
+        conn.commit()
+        return deleted
+
+    def purge_expired(self):
+        conn = self._connection()
+        deleted = conn.execute("DELETE FROM inference_results WHERE expires_at <= ?", (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+
+_inference_cache = None
+_inference_cache_lock = threading.Lock()
+
+
+def get_inference_cache() -> InferenceCache:
+    """
+    Returns the process-wide InferenceCache, creating it on first use.
+    """
+    global _inference_cache
+    with _inference_cache_lock:
+        if _inference_cache is None:
+            _inference_cache = InferenceCache()
+        return _inference_cache
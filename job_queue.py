@@ -0,0 +1,216 @@
+import time
+import uuid
+import queue
+import threading
+import contextvars
+from collections import OrderedDict, deque
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import constants as c
+from tracing import span
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class Job:
+    """
+    One unit of work run by the JobQueue. The function receives the job itself, so it can publish
+    partial output (append_text, report_sink, set_note) and check is_cancelled between steps.
+
+    study is the StudyContext the job works on, a snapshot taken by the script thread: tools change
+    it (and add_history) instead of st.session_state, and the script thread applies the changes
+    when it collects the finished job.
+    """
+
+    def __init__(self, fn, name="", meta=None, study=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.fn = fn
+        self.meta = meta or {}
+        self.study = study
+        self.history = []  # Copilot history entries added by the job's tools
+        self.status = "queued"  # queued -> running -> done | failed | cancelled
+        self.result = None
+        self.error = None
+        self.note = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.script_ctx = get_script_run_ctx()
+        self._chunks = []
+        self._report_chunks = []
+        self._cancel_event = threading.Event()
+
+    # ----------------- PROGRESS -----------------
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    @property
+    def report_text(self) -> str:
+        return "".join(self._report_chunks)
+
+    def append_text(self, chunk):
+        self._chunks.append(chunk)
+
+    def clear_text(self):
+        self._chunks = []
+        self._report_chunks = []
+
+    def report_sink(self, chunk):
+        """
+        on_chunk callback for ReportAgent: collects the streamed report instead of drawing it
+        from the worker thread.
+        """
+        self._report_chunks.append(chunk)
+
+    def set_note(self, note):
+        self.note = note
+
+    def add_history(self, entry):
+        self.history.append(entry)
+
+    # ----------------- STATE -----------------
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def cancel(self):
+        """
+        Requests cancellation. A queued job never starts; a running job stops at its next check.
+        """
+        self._cancel_event.set()
+
+    def wait_cancelled(self, timeout) -> bool:
+        """
+        Sleeps up to timeout seconds (e.g. between retries) and returns True early if cancelled.
+        """
+        return self._cancel_event.wait(timeout)
+
+    @property
+    def wait_time(self) -> float:
+        return (self.started_at or time.time()) - self.submitted_at
+
+
+class JobQueue:
+    """
+    Process-wide queue of background jobs (copilot turns, read pipelines) served by worker threads,
+    so the Streamlit script thread only submits work and polls for it.
+
+    Workers run each job inside the script run context of the session that submitted it, for the
+    Streamlit caches the tools go through, but jobs never touch st.session_state: the session's
+    script thread may be writing it at the same time. Finished jobs are kept for a while so the UI
+    can collect them.
+    """
+
+    def __init__(self, max_workers=c.JOB_QUEUE_WORKERS, max_jobs=c.JOB_QUEUE_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # id -> Job
+        self._wait_times = deque(maxlen=500)
+        self._running = 0
+        self._counts = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0}
+
+        for i in range(max_workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, fn, name="", meta=None, study=None) -> Job:
+        job = Job(fn, name=name, meta=meta, study=study)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+            self._counts["submitted"] += 1
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id) -> bool:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel()
+        return True
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job.is_cancelled:
+                self._finish(job, "cancelled")
+                continue
+
+            job.started_at = time.time()
+            with self._lock:
+                self._running += 1
+                self._wait_times.append(job.wait_time)
+            job.status = "running"
+
+            add_script_run_ctx(threading.current_thread(), job.script_ctx)
+            token = _current_job.set(job)
+            try:
+                with span(f"job.{job.name or 'job'}", job_id=job.id, wait_seconds=job.wait_time):
+                    job.result = job.fn(job)
+                status = "cancelled" if job.is_cancelled else "done"
+            except Exception as e:
+                print(f"Job {job.name} {job.id} failed: {str(e)}")
+                job.error = e
+                status = "failed"
+            finally:
+                _current_job.reset(token)
+                add_script_run_ctx(threading.current_thread(), None)
+                with self._lock:
+                    self._running -= 1
+            self._finish(job, status)
+
+    def _finish(self, job, status):
+        job.finished_at = time.time()
+        job.status = status
+        with self._lock:
+            self._counts[status] += 1
+
+    def get_metrics(self) -> dict:
+        """
+        Returns queue depth, running jobs, job counters and wait times (seconds from submission
+        to start) over the last jobs.
+        """
+        with self._lock:
+            waits = sorted(self._wait_times)
+            metrics = {"queue_depth": self._queue.qsize(), "running": self._running, **self._counts}
+        if waits:
+            metrics["wait_avg"] = sum(waits) / len(waits)
+            metrics["wait_p95"] = waits[min(len(waits) - 1, int(0.95 * len(waits)))]
+            metrics["wait_max"] = waits[-1]
+        return metrics
+
+
+def current_job():
+    """
+    Returns the Job being run, or None outside of a JobQueue job (e.g. on the script thread). Lets
+    tools called by an agent report progress on the job that runs them. Like spans, it follows the
+    job into pool threads started with tracing.run_in_context.
+    """
+    return _current_job.get()
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Returns the process-wide JobQueue, starting its workers on first use.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
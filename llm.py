@@ -1,22 +1,166 @@
-import os
 import json
+import re
+import time
 
 from prompts import Prompts
 
 from agno.models.google import Gemini
 from agno.agent import Agent
-from agno.tools.duckduckgo import DuckDuckGoTools
 from call_functions import load_case, list_available_cases
 from emr_loader import get_clinical_data_from_patient
 
-from constants import LLM_MODEL_WORKFLOW_AGENT
+from constants import (LLM_MODEL_WORKFLOW_AGENT, PARALLEL_TOOL_CALLS, COPILOT_MAX_TRIES, COPILOT_RETRY_DELAY,
+                       RESPONSE_CACHE_HISTORY_TURNS, RESPONSE_CACHE_FOLLOW_UP_MAX_WORDS)
+from parallel_tools import ParallelGemini
+from tracing import span, set_attribute
+from registry import (get_gemini_client, get_image_interpreter, get_report_agent, get_actionable_findings,
+                      get_search_tools)
 
 prompts = Prompts()
 
 
 class LLM():
+    # Tools whose result only depends on the study and report in the cache context, or whose only
+    # effect is the report text stored with a cached response. Turns that call any other tool
+    # (load_case, send_notification, get_notification_email, list_available_cases, ...) are never cached.
+    CACHEABLE_TOOLS = {"interpret_xray", "generate_report", "update_report", "search_actionable_findings",
+                       "get_clinical_data_from_patient", "duckduckgo_search", "duckduckgo_news"}
+
+    # Words that make a message refer back to the previous turns ("yes", "do it again", "same for that one")
+    # ("this" is left out: "this study" is already pinned by the study in the context)
+    FOLLOW_UP_WORDS = {"yes", "no", "ok", "okay", "sure", "it", "that", "those", "them", "same", "again", "above",
+                       "previous"}
+
     def __init__(self):
-        self.model = Gemini(api_key=os.environ.get("GEMINI_API_KEY"), id=LLM_MODEL_WORKFLOW_AGENT)
+        self.model_id = LLM_MODEL_WORKFLOW_AGENT
+
+    def new_model(self):
+        """
+        Returns a Gemini model for one agent. The Agent registers its tools on the model, so each
+        session gets its own model object, but all of them share the process-wide Gemini client.
+        With PARALLEL_TOOL_CALLS, independent tool calls of one turn run concurrently.
+        """
+        model_class = ParallelGemini if PARALLEL_TOOL_CALLS else Gemini
+        return model_class(id=self.model_id, client=get_gemini_client())
+
+    def run_turn(self, agent, user_message, job, max_tries=COPILOT_MAX_TRIES, retry_delay=COPILOT_RETRY_DELAY):
+        """
+        Runs one copilot turn as a background job: streams the answer into job.append_text and
+        retries failed attempts. Stops early if the job is cancelled (e.g. by a newer prompt).
+
+        Returns:
+            dict: "assistant_message", "reasoning", "ttft" and "cacheable", or None if cancelled.
+        """
+        with span("copilot.turn", model=self.model_id, **{"message.chars": len(user_message)}):
+            error = None
+            for attempt in range(1, max_tries + 1):
+                if job.is_cancelled:
+                    set_attribute("cancelled", True)
+                    return None
+                try:
+                    with span("copilot.attempt", attempt=attempt):
+                        result = self._run_attempt(agent, user_message, job)
+                    if result is None:
+                        set_attribute("cancelled", True)
+                    return result
+                except Exception as e:
+                    print(f"Copilot turn failed: {str(e)}")
+                    error = e
+                    job.clear_text()
+                    if job.wait_cancelled(retry_delay):
+                        set_attribute("cancelled", True)
+                        return None
+
+            return {"assistant_message": error, "reasoning": None, "ttft": None, "cacheable": False}
+
+    def _run_attempt(self, agent, user_message, job):
+        start = time.perf_counter()
+        time_to_first_token = None
+        for chunk in agent.run(user_message, stream=True):
+            if job.is_cancelled:
+                return None
+            if chunk.content:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start
+                    set_attribute("ttft_seconds", time_to_first_token)
+                job.append_text(chunk.content)
+
+        response = agent.run_response
+        set_attribute("tools", ",".join(self.tool_names(response)))
+        return {
+            "assistant_message": self.get_last_response(response),
+            "reasoning": self.get_reasoning_messages(response),
+            "ttft": time_to_first_token,
+            "cacheable": self.is_cacheable(response),
+        }
+
+    @staticmethod
+    def tool_names(response) -> list:
+        """
+        Names of the tools called during the run. Gemini returns the results of one round of calls
+        as a single tool message, with the names in combined_function_details.
+        """
+        names = []
+        for msg in response.messages or []:
+            if msg.role != "tool":
+                continue
+            if msg.tool_name:
+                names.append(msg.tool_name)
+            names.extend(name for name, _ in getattr(msg, "combined_function_details", None) or [])
+        return names
+
+    @classmethod
+    def is_follow_up(cls, user_message) -> bool:
+        """
+        True if the message only makes sense after the previous turns: very short replies, or
+        messages that point back at them.
+        """
+        words = re.findall(r"[a-z']+", user_message.lower())
+        return len(words) <= RESPONSE_CACHE_FOLLOW_UP_MAX_WORDS or not cls.FOLLOW_UP_WORDS.isdisjoint(words)
+
+    @classmethod
+    def response_cache_context(cls, session_state, user_message, history_turns=RESPONSE_CACHE_HISTORY_TURNS) -> str:
+        """
+        Returns the session state a copilot answer depends on, used to scope the response cache:
+        the session itself (answers are never shared between radiologists), its study and report.
+        Follow-ups ("yes", "do the same again") also depend on the last turns before them, so
+        they only hit after the same conversation; self-contained commands hit regardless of it.
+        """
+        context = {
+            "session_id": session_state.get("session_id", ""),
+            "study_id": str(session_state.get("study_id", "")),
+            "image_url": session_state.get("image_url", ""),
+            "report_text": session_state.get("report_text", ""),
+        }
+        if history_turns and cls.is_follow_up(user_message):
+            history = session_state.get("history", [])[:-1][-history_turns:]
+            context["history"] = [[str(turn.get("user_message")), str(turn.get("assistant_message"))]
+                                  for turn in history]
+        return json.dumps(context)
+
+    def is_cacheable(self, response) -> bool:
+        """
+        True if every tool called during the run is read-only or idempotent.
+        """
+        return all(name in self.CACHEABLE_TOOLS for name in self.tool_names(response))
+
+    @staticmethod
+    def remember_turn(agent, user_message, assistant_message):
+        """
+        Adds a turn answered without the agent (response cache, read pipeline) to the agent's
+        memory, so the following turns see it in their history as if the model had answered it.
+        """
+        from agno.memory.agent import AgentRun
+        from agno.models.message import Message
+        from agno.run.response import RunResponse
+
+        try:
+            messages = [Message(role="user", content=user_message),
+                        Message(role="assistant", content=assistant_message)]
+            agent.memory.add_run(AgentRun(message=messages[0],
+                                          response=RunResponse(content=assistant_message, messages=messages)))
+        except Exception as e:
+            print(f"Could not add the turn to the agent memory: {str(e)}")
 
     def get_reasoning_messages(self, response):
         """
@@ -80,18 +224,17 @@ class LLM():
 
 
     def agent(self):
-
-        # Delay the import here to prevent circular dependency
-        from report_agent import ReportAgent
-        from image_interpreter_agent import ImageInterpreterAgent
-        from actionable_findings_agent import ActionableFindings
-
+        """
+        Builds the workflow agent for one session. The toolkits are shared process-wide instances;
+        only the agent (chat memory) and its model wrapper are per session.
+        """
         instruction = prompts.get_prompt()
 
         new_agent = Agent(
             name="Web Agent",
-            model=self.model,
-            tools=[DuckDuckGoTools(), ImageInterpreterAgent(), ReportAgent(), ActionableFindings(), load_case, list_available_cases, get_clinical_data_from_patient],
+            model=self.new_model(),
+            tools=[get_search_tools(), get_image_interpreter(), get_report_agent(), get_actionable_findings(),
+                   load_case, list_available_cases, get_clinical_data_from_patient],
             show_tool_calls=True,
             markdown=True,
             read_tool_call_history=True,
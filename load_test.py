@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import argparse
+import resource
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+import constants as c
+import fakes
+from database import Database
+from benchmark import rss_mb, latency_percentiles
+from job_queue import get_job_queue
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# AppTest installs a mock Streamlit runtime for the length of each run and removes it afterwards,
+# so two script runs cannot overlap in one process. The runs are serialized; the copilot jobs they
+# submit still run concurrently on the shared JobQueue, which is what the load test measures.
+_script_run_lock = threading.Lock()
+
+# One reading: each step is a copilot message, as typed (or dictated) by the radiologist
+STEPS = [
+    ("load_case", "Load case {case}."),
+    ("analyse", "Analyse the image."),
+    ("report", "Generate the report."),
+    ("edit", "Add mild cardiomegaly to the impression."),
+    ("notify", "Notify the actionable findings to reading-room@example.com"),
+]
+
+
+class SimulatedSession:
+    """
+    One radiologist driving the real main.py script through AppTest: every step types a copilot
+    message, then reruns the script every poll_interval seconds, like the page's polling fragment,
+    until the copilot job has finished.
+    """
+
+    def __init__(self, case_number, poll_interval=c.JOB_POLL_INTERVAL, timeout=120):
+        self.case_number = case_number
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.step_latency = {}
+        self.script_runs = []  # Seconds per script run: the server-side cost of each rerun
+        self.errors = []
+
+    def _run(self, app):
+        with _script_run_lock:
+            start = time.perf_counter()
+            app.run()
+            self.script_runs.append(time.perf_counter() - start)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+
+    def _turn(self, app, message):
+        start = time.perf_counter()
+        # The message becomes this history entry; tools may add entries after it (e.g. "Now viewing...")
+        entry = len(app.session_state["history"])
+        app.chat_input[0].set_value(message)
+        self._run(app)
+        while app.session_state["processing"]:
+            if time.perf_counter() - start > self.timeout:
+                raise TimeoutError(f"No answer after {self.timeout} seconds")
+            time.sleep(self.poll_interval)
+            self._run(app)
+        answer = app.session_state["history"][entry]["assistant_message"]
+        if not isinstance(answer, str) or not answer:
+            raise RuntimeError(f"Copilot turn failed: {answer}")
+        return time.perf_counter() - start
+
+    def run(self) -> dict:
+        start = time.perf_counter()
+        try:
+            app = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+            self._run(app)
+            self.step_latency["open"] = time.perf_counter() - start
+            for step, message in STEPS:
+                try:
+                    self.step_latency[step] = self._turn(app, message.format(case=self.case_number))
+                except Exception as e:
+                    print(f"Session on case {self.case_number}: {step} failed: {str(e)}")
+                    self.errors.append(step)
+        except Exception as e:
+            print(f"Session on case {self.case_number} failed: {str(e)}")
+            self.errors.append("open")
+        return {"total": time.perf_counter() - start, "steps": self.step_latency,
+                "script_runs": self.script_runs, "errors": self.errors}
+
+
+class _MemorySampler:
+    """
+    Samples the process RSS in the background and keeps the peak.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="load-test-memory", daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_level(sessions, case_numbers, poll_interval, timeout) -> dict:
+    """
+    Runs sessions simulated sessions at the same time, each one reading its own case.
+    """
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with _MemorySampler() as memory:
+        with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="load-session") as executor:
+            results = list(executor.map(
+                lambda i: SimulatedSession(case_numbers[i % len(case_numbers)], poll_interval, timeout).run(),
+                range(sessions)))
+    wall = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+
+    completed = [result for result in results if not result["errors"]]
+    steps = {step: latency_percentiles([result["steps"][step] for result in results if step in result["steps"]])
+             for step in ["open"] + [step for step, _ in STEPS]}
+    return {
+        "sessions": sessions,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "wall_seconds": wall,
+        "completed": len(completed),
+        "errors": sum(len(result["errors"]) for result in results),
+        "throughput": len(completed) / wall if wall else 0.0,  # Complete readings per second
+        "session_latency": latency_percentiles([result["total"] for result in completed]),
+        "step_latency": steps,
+        "script_run_latency": latency_percentiles([seconds for result in results for seconds in result["script_runs"]]),
+        "cpu_seconds": cpu,
+        "cpu_cores": cpu / wall if wall else 0.0,
+        "peak_rss_mb": memory.peak,
+        "job_queue": get_job_queue().get_metrics(),
+        "services": fakes.get_stats(),
+    }
+
+
+def format_level(result) -> str:
+    session = result["session_latency"]
+    lines = [f"{result['sessions']:>3} sessions: {result['completed']} readings in {result['wall_seconds']:.1f}s "
+             f"({result['throughput'] * 60:.1f}/min), {result['errors']} errors, CPU {result['cpu_cores']:.2f} cores, "
+             f"peak RSS {result['peak_rss_mb']:.0f} MB, job wait p95 {result['job_queue'].get('wait_p95', 0.0):.2f}s"]
+    if session:
+        lines.append(f"      reading p50 {session['p50']:.2f}s  p95 {session['p95']:.2f}s  max {session['max']:.2f}s; "
+                     f"script run p95 {result['script_run_latency'].get('p95', 0.0):.3f}s")
+    lines.append("      " + "  ".join(f"{step} p95 {values['p95']:.2f}s"
+                                      for step, values in result["step_latency"].items() if values))
+    return "\n".join(lines)
+
+
+def find_saturation(levels, min_gain, slo=None):
+    """
+    Returns the first level at which adding sessions stopped paying off: throughput grew less than
+    min_gain (a fraction) over the previous level, the p95 reading latency exceeded slo seconds,
+    or readings failed. The first level has nothing to compare with, so only the last two apply
+    to it. None if every level still scaled.
+    """
+    for index, level in enumerate(levels):
+        p95 = level["session_latency"].get("p95")
+        if level["errors"] or (slo is not None and (p95 is None or p95 > slo)):
+            return level
+        if index and level["throughput"] < levels[index - 1]["throughput"] * (1 + min_gain):
+            return level
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test main.py with simulated concurrent sessions, "
+                                                 "against local fakes of the upstream services.")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="Comma-separated numbers of concurrent sessions")
+    parser.add_argument("--poll-interval", type=float, default=c.JOB_POLL_INTERVAL,
+                        help="Seconds between reruns while a copilot job runs (the page's polling interval)")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds a step may take before it fails")
+    parser.add_argument("--min-gain", type=float, default=0.1,
+                        help="Throughput growth below which a level counts as saturated (default 10%%)")
+    parser.add_argument("--slo", type=float, help="p95 reading latency (seconds) above which a level is saturated")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplies every fake service's latency")
+    parser.add_argument("--error-rate", type=float, help="Share of failed calls for every fake service")
+    parser.add_argument("--seed", type=int, default=c.FAKE_SEED)
+    parser.add_argument("--output", default=c.LOAD_TEST_OUTPUT_PATH, help="JSON Lines file the results are appended to")
+    args = parser.parse_args()
+
+    # The sessions run the real script, but nothing may reach the real services
+    c.USE_FAKES = True
+    os.environ.setdefault("SENDGRID_API_KEY", "fake")
+    fakes.configure(latency_scale=args.latency_scale, error_rate=args.error_rate, seed=args.seed)
+
+    session_levels = [int(level) for level in args.levels.split(",")]
+    # Every session reads its own study, as long as the worklist has enough of them
+    cases_df, _, _ = Database().query_worklist(page=1, page_size=max(session_levels), sort_by="id", descending=False)
+    case_numbers = cases_df["id"].to_list()
+    # Loads the process-wide agents, clients and database once, so the first level is not charged for it
+    print("Warming up...")
+    AppTest.from_file(APP_PATH, default_timeout=args.timeout).run()
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    levels = []
+    for sessions in session_levels:
+        fakes.configure(seed=args.seed)
+        result = run_level(sessions, case_numbers, args.poll_interval, args.timeout)
+        result["fakes"] = {"latency_scale": args.latency_scale, "error_rate": args.error_rate, "seed": args.seed}
+        levels.append(result)
+        print(format_level(result))
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    saturated = find_saturation(levels, args.min_gain, args.slo)
+    if saturated is None:
+        print(f"No saturation up to {levels[-1]['sessions']} sessions.")
+    elif levels.index(saturated) == 0:
+        print(f"Already saturated at {saturated['sessions']} sessions: {saturated['errors']} errors, p95 reading "
+              f"{saturated['session_latency'].get('p95', float('nan')):.2f}s. "
+              f"One process serves fewer than {saturated['sessions']} concurrent sessions "
+              f"(JOB_QUEUE_WORKERS={c.JOB_QUEUE_WORKERS}).")
+    else:
+        capacity = levels[levels.index(saturated) - 1]
+        print(f"Saturation at {saturated['sessions']} sessions: throughput {capacity['throughput'] * 60:.1f} -> "
+              f"{saturated['throughput'] * 60:.1f} readings/min, p95 reading "
+              f"{saturated['session_latency'].get('p95', float('nan')):.2f}s. "
+              f"One process serves about {capacity['sessions']} concurrent sessions "
+              f"(JOB_QUEUE_WORKERS={c.JOB_QUEUE_WORKERS}).")
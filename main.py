@@ -1,27 +1,32 @@
+import json
 import time
-import pandas as pd
+import uuid
+import threading
+from dataclasses import asdict
 
 import streamlit as st
-from streamlit_aux import Streamlit
+from streamlit_aux import Streamlit, ReportStreamSink
 from whisper import StreamlitWhisperApp
 
 # start up streamlit config first
 st_aux = Streamlit()
 whisper = StreamlitWhisperApp()
 
-from llm import LLM
-from prompts import Prompts
-from report_agent import ReportAgent
 from database import Database
 from emr_loader import search_records
-from call_functions import load_case
+from record_fetcher import get_record_fetcher, format_details
+from call_functions import load_case, prefetch_following
+from prefetch import get_prefetcher
+from response_cache import get_response_cache
+from read_pipeline import get_read_pipeline, format_read_summary
+from study_context import StudyContext
+from job_queue import get_job_queue
 
 import constants as c
+from registry import get_llm, get_image_interpreter
 
 db = Database()
-rep = ReportAgent()
-prompts = Prompts()
-llm = LLM()
+llm = get_llm()
 
 container_height = 780
 
@@ -37,6 +42,8 @@ if "history" not in st.session_state:
 
 if "agent" not in st.session_state:
     st.session_state["agent"] = llm.agent()
+    # Wake up the HF endpoint in the background; concurrent sessions share the same warm-up
+    get_image_interpreter().warm_up()
 
 if "report_text" not in st.session_state:
     st.session_state.report_text = ""
@@ -44,8 +51,19 @@ if "report_text" not in st.session_state:
 if "processing" not in st.session_state:
     st.session_state.processing = False
 
+if "session_id" not in st.session_state:
+    # Scopes this session's entries in the process-wide response cache
+    st.session_state.session_id = uuid.uuid4().hex
+
+if "copilot_job_id" not in st.session_state:
+    st.session_state.copilot_job_id = None
+    # Serializes the turns of this session's agent: a cancelled turn may still be finishing
+    st.session_state.agent_lock = threading.Lock()
+
 if "cases_df" not in st.session_state:
     st.session_state.cases_df = db.generate_samples()
+    # Warm images and classifier results for the first studies in the worklist
+    get_prefetcher().schedule(st.session_state.cases_df["url"].to_list())
 
 if "image_url" not in st.session_state:
     st.session_state.image_url = None
@@ -56,6 +74,180 @@ if "notification_email" not in st.session_state:
 if "df_chart" not in st.session_state:
     st.session_state.df_chart = None
 
+# ----------------- COPILOT JOBS -----------------
+def run_read_job(job, case_number, upcoming_urls):
+    """
+    Background job for "/read [case #]": the read pipeline, without the planner LLM.
+    """
+    result = get_read_pipeline().run(
+        job.study, case_number=case_number, upcoming_urls=upcoming_urls, on_chunk=job.report_sink,
+        on_cold_start=lambda: job.set_note("Starting up HuggingFace agent. Please wait..."))
+    assistant_message = format_read_summary(result)
+    job.append_text(assistant_message)
+    reasoning = json.dumps({"timings": result["timings"], "probabilities": result["probabilities"]}, indent=2)
+    return {"assistant_message": assistant_message, "reasoning": reasoning, "ttft": None, "cacheable": False}
+
+
+def run_agent_job(job, agent, agent_lock, user_message):
+    with agent_lock:
+        return llm.run_turn(agent, user_message, job)
+
+
+def submit_copilot_turn():
+    """
+    Starts the job for the latest pending command, unless it is already running. A job still
+    running for an earlier command is cancelled. Repeated commands of the session are answered
+    from the response cache without a job.
+    """
+    history = st.session_state["history"]
+    # Commands are flagged when the user sends them; entries added by tools (e.g. "Now viewing...")
+    # come without a user message and are never commands
+    pending = [index for index, turn in enumerate(history) if turn.get("pending") and turn.get("user_message")]
+    active = get_job_queue().get(st.session_state.copilot_job_id)
+    if active is not None:
+        if pending and active.meta["entry"] == pending[-1]:
+            return
+        if active.finished:
+            finish_copilot_turn(active)
+        else:
+            active.cancel()
+            history[active.meta["entry"]]["assistant_message"] = "_Cancelled: replaced by a newer request._"
+            history[active.meta["entry"]].pop("pending", None)
+
+    if not pending:
+        st.session_state.copilot_job_id = None
+        st.session_state.processing = False
+        return
+    entry = pending[-1]
+    # Commands sent before this one and not started yet are superseded by it
+    for index in pending[:-1]:
+        history[index].pop("pending", None)
+
+    user_message = history[entry]["user_message"]
+    # The job works on a snapshot of the study; finish_copilot_turn applies what it changed
+    study = StudyContext.from_session_state()
+    meta = {"entry": entry, "user_message": user_message, "study_before": asdict(study)}
+
+    # "/read [case #]" runs the standard read workflow without the planner LLM
+    if user_message.strip().lower().startswith("/read"):
+        argument = user_message.strip()[len("/read"):].strip().lstrip("#")
+        case_number = int(argument) if argument.isdigit() else None
+        upcoming = []
+        cases_df = st.session_state.get("cases_df")
+        if cases_df is not None:
+            urls = cases_df["url"].to_list()
+            study = db.get_study(case_number) if case_number is not None else None
+            current_url = study["url"] if study else st.session_state.image_url
+            if current_url in urls:
+                upcoming = urls[urls.index(current_url) + 1:]
+        job = get_job_queue().submit(lambda job: run_read_job(job, case_number, upcoming), name="read",
+                                     meta={**meta, "remember": True}, study=study)
+    else:
+        # Repeated commands in this session, on the same study and report, come from the cache
+        cache_context = llm.response_cache_context(st.session_state, user_message)
+        cached = get_response_cache().get(llm.model_id, user_message, context=cache_context, semantic=True)
+        if cached is not None:
+            if cached["report_text"] is not None:
+                st.session_state.report_text = cached["report_text"]
+            history[entry]["assistant_message"] = cached["assistant_message"]
+            history[entry]["reasoning"] = cached["reasoning"]
+            history[entry]["cached"] = True
+            history[entry].pop("pending", None)
+            llm.remember_turn(st.session_state["agent"], user_message, cached["assistant_message"])
+            st.session_state.copilot_job_id = None
+            st.session_state.processing = False
+            st.rerun()
+
+        agent, agent_lock = st.session_state["agent"], st.session_state.agent_lock
+        job = get_job_queue().submit(lambda job: run_agent_job(job, agent, agent_lock, user_message), name="copilot",
+                                     meta={**meta, "cache_context": cache_context}, study=study)
+
+    st.session_state.copilot_job_id = job.id
+
+
+def apply_study_changes(job):
+    """
+    Writes the fields the job's tools changed in its study snapshot to the session state, and adds
+    the history entries they created. If the user opened another study while the job ran, the
+    changes to the old study are dropped rather than written over the new one.
+    """
+    before = job.meta["study_before"]
+    after = asdict(job.study)
+    changed = [name for name, value in after.items() if value != before[name]]
+
+    session = StudyContext.from_session_state()
+    if (session.study_id, session.image_url) != (before["study_id"], before["image_url"]):
+        changed = [name for name in changed if name not in ("study_id", "image_url", "report_text")]
+    else:
+        st.session_state["history"].extend(job.history)
+        if "image_url" in changed:
+            prefetch_following(job.study.image_url)
+    job.study.to_session_state(only=changed)
+
+
+def finish_copilot_turn(job):
+    """
+    Moves the outcome of a finished job into its history entry (on the script thread).
+    """
+    history_entry = st.session_state["history"][job.meta["entry"]]
+    history_entry.pop("pending", None)
+    result = job.result
+    if job.status == "failed":
+        history_entry["assistant_message"] = job.error
+    elif result is None:
+        history_entry["assistant_message"] = history_entry.get("assistant_message") or "_Cancelled._"
+    else:
+        history_entry["assistant_message"] = result["assistant_message"]
+        history_entry["reasoning"] = result["reasoning"]
+        history_entry["ttft"] = result["ttft"]
+        apply_study_changes(job)
+        if job.meta.get("remember"):
+            llm.remember_turn(st.session_state["agent"], job.meta["user_message"], result["assistant_message"])
+        if result["cacheable"]:
+            report_after = job.study.report_text
+            get_response_cache().put(llm.model_id, job.meta["user_message"], {
+                "assistant_message": result["assistant_message"],
+                "reasoning": result["reasoning"],
+                "report_text": report_after if report_after != job.meta["study_before"]["report_text"] else None,
+            }, context=job.meta["cache_context"], semantic=True)
+
+    if st.session_state.copilot_job_id == job.id:
+        st.session_state.copilot_job_id = None
+        st.session_state.processing = False
+
+
+@st.fragment(run_every=c.JOB_POLL_INTERVAL)
+def show_copilot_job(report_preview):
+    """
+    Shows the progress of the running copilot job, with the report it is drafting streamed into the
+    Report Editor (report_preview), and applies its result once it finishes.
+    """
+    job = get_job_queue().get(st.session_state.copilot_job_id)
+    if job is None:
+        return
+    if job.finished:
+        finish_copilot_turn(job)
+        st.rerun()
+
+    with st.chat_message("assistant"):
+        if job.note:
+            st.warning(job.note, icon="⏳")
+        st.write(job.text or "Thinking...")
+        if job.report_text:
+            # The placeholder holds one element, so each poll replaces the preview instead of adding one
+            report_preview.show(job.report_text)
+
+        if job.status == "queued":
+            st.caption(f"Queued for {job.wait_time:.1f} s ({get_job_queue().get_metrics()['queue_depth']} jobs waiting)")
+        else:
+            st.caption(f"Running for {time.time() - job.started_at:.1f} s")
+        if st.button("Stop", key=f"stop_{job.id}"):
+            job.cancel()
+
+
+with st.sidebar:
+    st_aux.show_latency_panel()
+
 tab_workstation, tab_emr = st.tabs(["🏥 **AI Workstation**", "📂 **Access Electronic Medical Records**"])
 
 with tab_workstation:
@@ -69,20 +261,7 @@ with tab_workstation:
     with col1:
         with st.container(border=True, height=container_height):
             st.subheader("📋 Patient Worklist")
-            cols_cases = st.columns(len(st.session_state.cases_df))
-            sample_case_url = "https://upload.wikimedia.org/wikipedia/commons/a/a1/Normal_posteroanterior_%28PA%29_chest_radiograph_%28X-ray%29.jpg"
-            for idx, row in st.session_state.cases_df.iterrows():
-                with cols_cases[idx]:
-                    if st.button(f'**Study ID**:  {row["id"]}', key=f'select_{row["id"]}'):
-                        load_case(row["id"])
-                        #st.session_state.image_url = row["url"]
-                        #st.session_state.study_id = row["id"]
-                        #st.session_state["history"].append(
-                        #    {"user_message": None,
-                        #     "assistant_message": f"📋 Now viewing case {row['id']}. How can I assist you?",
-                        #     "reasoning": None})
-                        #st.session_state.report_text = ""
-                        st.rerun()
+            st_aux.show_worklist(db)
 
             st.divider()
 
@@ -114,9 +293,15 @@ with tab_workstation:
 
             container_internal_height = 95
             report_height = container_height - container_internal_height
-            report_text = st.text_area("Report", value=st.session_state.report_text, height=report_height,
-                                       key="report_editor", label_visibility="collapsed")
+            report_placeholder = st.empty()
+            report_text = report_placeholder.text_area("Report", value=st.session_state.report_text,
+                                                       height=report_height, key="report_editor",
+                                                       label_visibility="collapsed")
             st.session_state.report_text = report_text
+            # Lets ReportAgent stream a report into this column while the copilot is still running:
+            # directly on the script thread, or through the polling fragment for background jobs
+            report_preview = ReportStreamSink(report_placeholder, height=report_height)
+            st.session_state.report_stream_sink = report_preview
 
     # --- AI COPILOT ---
     with col3:
@@ -133,52 +318,33 @@ with tab_workstation:
                         with st.chat_message("assistant"):
                             st.write(interaction["assistant_message"])
 
+                            if interaction.get("cached"):
+                                st.caption("Answered from the response cache")
+                            elif interaction.get("ttft") is not None:
+                                st.caption(f"First token after {interaction['ttft']:.2f} s")
+
                             if interaction.get("reasoning"):
                                 with st.expander("**Understand agent reasoning...**"):
                                     with st.container(border=True):
                                         st.code(interaction["reasoning"])
 
-                # Show spinner while processing
+                # Copilot turns run as background jobs; the script thread only submits and polls them
                 if st.session_state.processing:
-                    with st.chat_message("assistant"):
-                        with st.spinner("Thinking..."):
-                            max_try = 3
-                            current_try = 0
-                            while current_try < max_try:
-                                try:
-                                    response = st.session_state["agent"].run(
-                                        st.session_state["history"][-1]["user_message"])
-                                    assistant_message = llm.get_last_response(response)
-                                    reasoning = llm.get_reasoning_messages(response)
-
-                                    st.session_state["history"][-1]["assistant_message"] = assistant_message
-                                    st.session_state["history"][-1]["reasoning"] = reasoning
-                                    st.session_state.processing = False
-                                    break
-                                except Exception as e:
-                                    time.sleep(2)
-                                    current_try = current_try + 1
-                                    assistant_message = e
-                                    reasoning = None
-                                    if current_try == max_try:
-                                        st.session_state["history"][-1]["assistant_message"] = assistant_message
-                                        st.session_state["history"][-1]["reasoning"] = reasoning
-                                        st.session_state.processing = False
-                                    continue
-
-                            st.rerun()
-
-            if not st.session_state.processing:
-                if prompt := st.chat_input("💬 Ask me about the X-ray..."):
-                    st.session_state["history"].append({
-                        "user_message": prompt,
-                        "assistant_message": None,
-                        "reasoning": None
-                    })
-                    st.session_state.processing = True
-                    st.rerun()
-
-                whisper.show_audio_input()
+                    submit_copilot_turn()
+                    show_copilot_job(report_preview)
+
+            if prompt := st.chat_input("💬 Ask me about the X-ray..."):
+                # A new prompt replaces the turn still running, if any
+                st.session_state["history"].append({
+                    "user_message": prompt,
+                    "assistant_message": None,
+                    "reasoning": None,
+                    "pending": True
+                })
+                st.session_state.processing = True
+                st.rerun()
+
+            whisper.show_audio_input()
 
     st_aux.show_footer()
 
@@ -245,26 +411,29 @@ with tab_emr:
 
             if "selected_record" in st.session_state:
                 # Extract the single row (Series) from the stored DataFrame
-                record = st.session_state.selected_record.iloc[0]
+                record = st.session_state.selected_record.iloc[0].to_dict()
+
+                if search_type == "Patient MRN":
+                    source, loading_message = "HIS", "Retrieving patient chart (EMR) from HIS..."
+                else:
+                    source, loading_message = "PACS", "Retrieving study order from PACS..."
 
-                # Build a Markdown string from all columns
-                details_md = []
-                for col_name in record.index:
-                    val = record.get(col_name, "N/A")
-                    if pd.notna(val) and val != "N/A":
-                        details_md.append(f"**{str(col_name).replace('_', ' ')}**: {val}")
+                # Fetched in the background and memoized per record: reruns do not wait for it
+                details_future = get_record_fetcher().fetch(source, record)
 
                 container_internal_height = 95
                 with st.container(border=True, height=container_height - container_internal_height):
-                    if search_type == "Patient MRN":
-                        with st.spinner("Retrieving patient chart (EMR) from HIS..."):
-                            time.sleep(4)
+                    if details_future.done():
+                        st.markdown(format_details(details_future.result()))
                     else:
-                        with st.spinner("Retrieving study order from PACS..."):
-                            time.sleep(1.5)
-
-                    # Join each line with a double newline for spacing
-                    st.markdown("\n\n".join(details_md))
+                        @st.fragment(run_every=0.5)
+                        def show_pending_details():
+                            # Only this fragment polls; the rest of the page stays interactive
+                            if details_future.done():
+                                st.rerun()
+                            st.info(f"⏳ {loading_message}")
+
+                        show_pending_details()
 
             else:
                 st.info("Select a record in the 'Search Results' column to view its details.")
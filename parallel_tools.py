@@ -0,0 +1,136 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from agno.models.google import Gemini
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import constants as c
+from tracing import span, set_attribute, run_in_context
+
+# Tools that only read state, so the order in which they run does not change their results.
+# A call to any other tool (load_case, generate_report, send_notification, ...) and everything
+# after it in the same turn still runs sequentially, in the order the model asked for.
+PARALLEL_SAFE_TOOLS = {"interpret_xray", "get_clinical_data_from_patient", "list_available_cases",
+                       "search_actionable_findings", "get_notification_email",
+                       "duckduckgo_search", "duckduckgo_news"}
+
+
+class _CompletedCall:
+    """
+    Stands in for a FunctionCall that already ran in the pool: execute() replays its outcome,
+    everything else is read from the original call.
+    """
+
+    def __init__(self, call, success, error):
+        self._call = call
+        self._success = success
+        self._error = error
+        self.result = call.result
+        self.error = call.error
+
+    def execute(self):
+        if self._error is not None:
+            raise self._error
+        return self._success
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+class _TracedCall:
+    """
+    Stands in for a FunctionCall run by the regular agno tool loop, timing it as a tool span.
+    """
+
+    def __init__(self, call):
+        self._call = call
+
+    def execute(self):
+        with span(f"tool.{self._call.function.name}", parallel=False):
+            return self._call.execute()
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+class ParallelGemini(Gemini):
+    """
+    Gemini model that runs independent tool calls of one turn concurrently.
+
+    The leading read-only calls of a turn (at most PARALLEL_TOOL_MAX_WORKERS) are executed together,
+    each on its own thread and with its own timeout, then handed to the regular agno tool loop in
+    their original order, so the messages and events the agent sees are the same as with sequential
+    execution.
+    """
+
+    def run_function_calls(self, function_calls, function_call_results, *args, **kwargs):
+        function_calls = [call if isinstance(call, _CompletedCall) else _TracedCall(call)
+                          for call in self._execute_in_parallel(function_calls)]
+        yield from super().run_function_calls(function_calls, function_call_results, *args, **kwargs)
+
+    @staticmethod
+    def _execute_in_parallel(function_calls):
+        batch = []
+        for call in function_calls:
+            if call.function.name not in PARALLEL_SAFE_TOOLS or len(batch) >= c.PARALLEL_TOOL_MAX_WORKERS:
+                break
+            batch.append(call)
+        if len(batch) < 2:
+            return function_calls
+
+        # Tools read st.session_state, so the workers run inside this session's script context
+        script_ctx = get_script_run_ctx()
+        # One thread per call, owned by this turn: the calls start right away, so each timeout only
+        # counts the call's own run time, and a hung call never holds up another session's turn.
+        # Turns run on JobQueue workers, which bounds the number of these threads.
+        executor = ThreadPoolExecutor(max_workers=len(batch), thread_name_prefix="agent-tool")
+        start = time.perf_counter()
+        # Each call gets its own copy of this context, so its span is a child of the current one
+        # and it still sees the job running the turn
+        futures = [executor.submit(run_in_context(_run_call), call, script_ctx, start) for call in batch]
+
+        completed, timings = [], []
+        try:
+            for call, future in zip(batch, futures):
+                name = call.function.name
+                timeout = c.TOOL_TIMEOUTS.get(name, c.TOOL_TIMEOUT)
+                try:
+                    success, error, timing = future.result(timeout=max(0.0, start + timeout - time.perf_counter()))
+                    timings.append((name, *timing))
+                    completed.append(_CompletedCall(call, success, error))
+                except FutureTimeoutError:
+                    # A running worker cannot be interrupted: it is left to finish and its late result is discarded
+                    future.cancel()
+                    print(f"Tool {name} timed out after {timeout}s")
+                    timed_out = _CompletedCall(call, False, None)
+                    timed_out.result = None
+                    timed_out.error = f"Tool {name} timed out after {timeout} seconds."
+                    completed.append(timed_out)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        wall = time.perf_counter() - start
+        busy = sum(end - begin for _, begin, end in timings)
+        for name, begin, end in timings:
+            print(f"Tool {name}: {begin:.2f}s -> {end:.2f}s")
+        print(f"Ran {len(batch)} tools in parallel: {wall:.2f}s wall, {busy:.2f}s total, "
+              f"{max(busy - wall, 0.0):.2f}s overlapped")
+        set_attribute("tools.parallel_overlap_seconds", max(busy - wall, 0.0))
+
+        return completed + list(function_calls[len(batch):])
+
+
+def _run_call(call, script_ctx, origin):
+    add_script_run_ctx(threading.current_thread(), script_ctx)
+    begin = time.perf_counter() - origin
+    try:
+        with span(f"tool.{call.function.name}", parallel=True):
+            try:
+                success, error = call.execute(), None
+            except Exception as e:
+                success, error = False, e
+                set_attribute("error", str(e))
+    finally:
+        add_script_run_ctx(threading.current_thread(), None)
+    return success, error, (begin, time.perf_counter() - origin)
@@ -0,0 +1,127 @@
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError
+
+from image_cache import get_image_cache
+import constants as c
+
+
+class PrefetchScheduler:
+    """
+    Warms the image cache and the classifier results for upcoming worklist studies in a thread pool,
+    so that load_case and "analyse image" return immediately for studies that are already warm.
+    """
+
+    def __init__(self, interpreter, max_workers=c.PREFETCH_MAX_WORKERS, ahead=c.PREFETCH_AHEAD,
+                 max_entries=c.PREFETCH_MAX_ENTRIES):
+        self.interpreter = interpreter
+        self.ahead = ahead
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        # image url -> Future of its prefetch; the results themselves live in the image and inference caches
+        self._futures = OrderedDict()
+        self._cancelled = set()  # urls whose running prefetch must stop before the inference request
+
+    def schedule(self, image_urls, limit=None):
+        """
+        Queues the first `limit` (default: PREFETCH_AHEAD) URLs that are not already warm or in flight.
+        """
+        limit = self.ahead if limit is None else limit
+        scheduled = []
+        with self._lock:
+            for url in image_urls:
+                if len(scheduled) >= limit:
+                    break
+                if not url:
+                    continue
+                future = self._futures.get(url)
+                if future is not None and not future.cancelled() and not (future.done() and future.exception()):
+                    continue
+                self._cancelled.discard(url)
+                self._futures[url] = self._executor.submit(self._warm, url)
+                self._futures.move_to_end(url)
+                scheduled.append(url)
+            # Forgetting a result only costs a lookup: the classifier result stays in the inference cache
+            while len(self._futures) > self.max_entries:
+                url, _ = self._futures.popitem(last=False)
+                self._cancelled.discard(url)
+        return scheduled
+
+    def cancel(self, image_urls=None):
+        """
+        Cancels queued prefetches (all of them if image_urls is None). Prefetches that are already
+        downloading stop before sending the inference request.
+        """
+        with self._lock:
+            urls = list(self._futures) if image_urls is None else image_urls
+            for url in urls:
+                future = self._futures.get(url)
+                if future is None or future.done():
+                    continue
+                if future.cancel():
+                    del self._futures[url]
+                else:
+                    self._cancelled.add(url)
+
+    def wait(self, image_url, timeout=c.PREFETCH_WAIT_TIMEOUT):
+        """
+        Waits up to timeout seconds for a running prefetch of image_url. Returns True if the study
+        is warm, i.e. its classifier result is in the inference cache; False if it was never
+        prefetched, was cancelled, failed or is still running.
+        """
+        with self._lock:
+            future = self._futures.get(image_url)
+            if future is not None:
+                self._futures.move_to_end(image_url)
+        if future is None:
+            return False
+        try:
+            future.result(timeout=timeout)
+        except (TimeoutError, CancelledError):
+            return False
+        except Exception as e:
+            print(f"Prefetch failed for {image_url}: {str(e)}")
+            return False
+        return True
+
+    def is_warm(self, image_url):
+        with self._lock:
+            future = self._futures.get(image_url)
+        return future is not None and future.done() and not future.cancelled() and future.exception() is None
+
+    def _warm(self, image_url):
+        # 1) Image bytes: makes the viewer and the content hash available without a download
+        get_image_cache().get_bytes(image_url)
+
+        with self._lock:
+            cancelled = image_url in self._cancelled
+            self._cancelled.discard(image_url)
+        if cancelled:
+            raise CancelledError()
+
+        # 2) Classifier probabilities, stored in the inference cache by interpret_image_url
+        result = self.interpreter.interpret_image_url(image_url)
+        if "error" in json.loads(result):
+            # Do not pin failures: drop them so the next request retries the endpoint
+            with self._lock:
+                self._futures.pop(image_url, None)
+            raise RuntimeError(json.loads(result)["error"])
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> PrefetchScheduler:
+    """
+    Returns the process-wide PrefetchScheduler, creating it on first use.
+    """
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            # Delay the import here to prevent circular dependency
+            from registry import get_image_interpreter
+            _prefetcher = PrefetchScheduler(get_image_interpreter())
+        return _prefetcher
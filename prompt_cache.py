@@ -0,0 +1,328 @@
+import json
+import time
+import hashlib
+import threading
+
+from google.genai import errors, types
+
+import constants as c
+from tracing import get_tracer, span, set_attribute
+
+
+def _serialize(value):
+    if value is None:
+        return None
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, (list, tuple)):
+        return [_serialize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _serialize(item) for key, item in value.items()}
+    return value
+
+
+def _get(config, name):
+    return config.get(name) if isinstance(config, dict) else getattr(config, name, None)
+
+
+def _replace(config, **updates):
+    if isinstance(config, dict):
+        return {**config, **updates}
+    return config.model_copy(update=updates)
+
+
+def _is_cache_miss(error) -> bool:
+    """
+    True if Gemini rejected the request because its cached content is gone (expired or deleted
+    server-side). Any other error has nothing to do with the cache and is not retried.
+    """
+    if not isinstance(error, errors.APIError):
+        return False
+    if error.code == 404 or error.status == "NOT_FOUND":
+        return True
+    message = (error.message or "").lower()
+    return "cache" in message and "expired" in message
+
+
+def _is_rejection(error) -> bool:
+    """
+    True if Gemini refused to cache the prefix itself (too few tokens, model without context
+    caching), which no retry will change. Quota, server and network errors are transient.
+    """
+    return isinstance(error, errors.ClientError) and (error.code == 400 or error.status == "INVALID_ARGUMENT")
+
+
+class PromptCacheManager:
+    """
+    Lifecycle manager for Gemini context caches of static request prefixes.
+
+    A prefix is the system instruction plus the tool declarations (and tool config) of a request.
+    The first time a prefix is seen, a cached content is created for it; requests then reference
+    the cache instead of resending the prefix. Handles are refreshed shortly before their TTL
+    expires, and when the prefix of a scope (model + tool set) changes, e.g. after a prompt edit,
+    the old cache is deleted. Prefixes Gemini refuses to cache (too short, unsupported model)
+    are remembered and sent uncached; after other errors, creation is retried once
+    PROMPT_CACHE_RETRY_DELAY has passed.
+    """
+
+    def __init__(self, client, ttl=c.PROMPT_CACHE_TTL, refresh_margin=c.PROMPT_CACHE_REFRESH_MARGIN):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._handles = {}  # fingerprint -> {"name", "expires_at"}
+        self._scopes = {}  # scope -> fingerprint currently cached for it
+        self._uncacheable = set()
+        self._retry_at = {}  # fingerprint -> time after which a failed creation is tried again
+        self._pending = set()  # fingerprints being created or refreshed by some request
+        self.metrics = {
+            "cached_input_tokens": 0,
+            "fresh_input_tokens": 0,
+            "cache_hits": 0,
+            "uncached_requests": 0,
+            "caches_created": 0,
+            "caches_refreshed": 0,
+            "caches_invalidated": 0,
+        }
+
+    # ----------------- LIFECYCLE -----------------
+    def cache_name_for(self, model, config):
+        """
+        Returns the cached content name to use for this request, or None to send it uncached.
+        """
+        system_instruction = _get(config, "system_instruction") if config is not None else None
+        if not system_instruction:
+            return None
+
+        tools = _get(config, "tools")
+        tool_config = _get(config, "tool_config")
+        prefix = {"model": model, "system_instruction": _serialize(system_instruction),
+                  "tools": _serialize(tools), "tool_config": _serialize(tool_config)}
+        fingerprint = hashlib.sha256(json.dumps(prefix, sort_keys=True).encode()).hexdigest()
+        scope = (model, json.dumps(_serialize(tools), sort_keys=True))
+
+        stale_handle = None
+        with self._lock:
+            if fingerprint in self._uncacheable or self._retry_at.get(fingerprint, 0) > time.time():
+                return None
+
+            stale = self._scopes.get(scope)
+            if stale is not None and stale != fingerprint:
+                # The static prefix changed (e.g. new prompt): drop the cache of the old one
+                stale_handle = self._handles.pop(stale, None)
+            self._scopes[scope] = fingerprint
+
+            handle = self._handles.get(fingerprint)
+            busy = fingerprint in self._pending
+            if handle is None and busy:
+                # Another request is creating this cache: send this one uncached rather than wait
+                return None
+            refresh = handle is not None and not busy and handle["expires_at"] - time.time() < self.refresh_margin
+            if handle is None or refresh:
+                self._pending.add(fingerprint)
+
+        # The cache API calls run outside the lock, so they never hold up other requests
+        if stale_handle is not None:
+            self._delete(stale_handle)
+        if handle is not None and not refresh:
+            return handle["name"]
+
+        try:
+            if refresh:
+                handle = self._refresh(fingerprint, handle)
+            if handle is None:
+                handle = self._create(fingerprint, model, system_instruction, tools, tool_config)
+        finally:
+            with self._lock:
+                self._pending.discard(fingerprint)
+        return handle["name"] if handle is not None else None
+
+    def _create(self, fingerprint, model, system_instruction, tools, tool_config):
+        try:
+            cached = self.client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    tools=tools,
+                    tool_config=tool_config,
+                    ttl=f"{self.ttl}s",
+                    display_name=f"workstation-{fingerprint[:12]}",
+                ),
+            )
+        except Exception as e:
+            with self._lock:
+                if _is_rejection(e):
+                    print(f"Prompt prefix not cacheable, sending it uncached: {str(e)}")
+                    self._uncacheable.add(fingerprint)
+                else:
+                    print(f"Could not create prompt cache, retrying in {c.PROMPT_CACHE_RETRY_DELAY}s: {str(e)}")
+                    self._retry_at[fingerprint] = time.time() + c.PROMPT_CACHE_RETRY_DELAY
+            return None
+
+        handle = {"name": cached.name, "expires_at": time.time() + self.ttl}
+        with self._lock:
+            self._retry_at.pop(fingerprint, None)
+            self._handles[fingerprint] = handle
+            self.metrics["caches_created"] += 1
+        return handle
+
+    def _refresh(self, fingerprint, handle):
+        try:
+            self.client.caches.update(name=handle["name"],
+                                      config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+        except Exception as e:
+            print(f"Could not refresh prompt cache {handle['name']}: {str(e)}")
+            with self._lock:
+                self._handles.pop(fingerprint, None)
+            return None
+        with self._lock:
+            handle["expires_at"] = time.time() + self.ttl
+            self.metrics["caches_refreshed"] += 1
+        return handle
+
+    def _delete(self, handle):
+        # Takes a handle already removed from _handles; called without the lock held
+        try:
+            self.client.caches.delete(name=handle["name"])
+        except Exception as e:
+            print(f"Could not delete prompt cache {handle['name']}: {str(e)}")
+        with self._lock:
+            self.metrics["caches_invalidated"] += 1
+
+    def invalidate(self, cache_name=None):
+        """
+        Drops the handle of cache_name (e.g. after the API reports it missing), or every handle.
+        """
+        with self._lock:
+            dropped = [fingerprint for fingerprint, handle in self._handles.items()
+                       if cache_name is None or handle["name"] == cache_name]
+            handles = [self._handles.pop(fingerprint) for fingerprint in dropped]
+        for handle in handles:
+            self._delete(handle)
+
+    # ----------------- METRICS -----------------
+    def record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        cached = usage.cached_content_token_count or 0
+        prompt = usage.prompt_token_count or 0
+        with self._lock:
+            self.metrics["cached_input_tokens"] += cached
+            self.metrics["fresh_input_tokens"] += max(prompt - cached, 0)
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics["active_caches"] = len(self._handles)
+        return metrics
+
+
+class _CachingModels:
+    """
+    Wraps client.models so every generate_content call goes through the PromptCacheManager (if
+    any) and is traced with its token counts.
+    """
+
+    def __init__(self, models, manager):
+        self._models = models
+        self._manager = manager
+
+    def _prepare(self, model, config):
+        if self._manager is None:
+            return config, None
+        cache_name = self._manager.cache_name_for(model, config)
+        if cache_name is None:
+            with self._manager._lock:
+                self._manager.metrics["uncached_requests"] += 1
+            return config, None
+        with self._manager._lock:
+            self._manager.metrics["cache_hits"] += 1
+        # The cached content already carries these; Gemini rejects requests that resend them
+        return _replace(config, system_instruction=None, tools=None, tool_config=None,
+                        cached_content=cache_name), cache_name
+
+    def _record_usage(self, response, trace_span=None):
+        if self._manager is not None:
+            self._manager.record_usage(response)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None or trace_span is None:
+            return
+        trace_span.set_attribute("tokens.input", usage.prompt_token_count or 0)
+        trace_span.set_attribute("tokens.cached", usage.cached_content_token_count or 0)
+        trace_span.set_attribute("tokens.output", usage.candidates_token_count or 0)
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        with span("gemini.generate_content", model=model) as trace_span:
+            cached_config, cache_name = self._prepare(model, config)
+            set_attribute("prompt_cache.hit", cache_name is not None)
+            try:
+                response = self._models.generate_content(model=model, contents=contents, config=cached_config,
+                                                         **kwargs)
+            except Exception as e:
+                if cache_name is None or not _is_cache_miss(e):
+                    raise
+                # The cache expired or was deleted server-side: retry once without it
+                self._manager.invalidate(cache_name)
+                set_attribute("prompt_cache.hit", False)
+                response = self._models.generate_content(model=model, contents=contents, config=config, **kwargs)
+            self._record_usage(response, trace_span)
+            return response
+
+    def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        # A generator cannot keep a span current across its yields, so this one is ended by hand
+        tracer = get_tracer()
+        trace_span = tracer.start_span("gemini.generate_content_stream", model=model)
+        error = None
+        try:
+            cached_config, cache_name = self._prepare(model, config)
+            try:
+                stream = self._models.generate_content_stream(model=model, contents=contents, config=cached_config,
+                                                              **kwargs)
+                first_chunk = next(stream, None)
+            except Exception as e:
+                if cache_name is None or not _is_cache_miss(e):
+                    raise
+                self._manager.invalidate(cache_name)
+                cache_name = None
+                stream = self._models.generate_content_stream(model=model, contents=contents, config=config,
+                                                              **kwargs)
+                first_chunk = next(stream, None)
+            if trace_span is not None:
+                trace_span.set_attribute("prompt_cache.hit", cache_name is not None)
+                trace_span.add_event("first_chunk")
+
+            last_chunk = None
+            if first_chunk is not None:
+                last_chunk = first_chunk
+                yield first_chunk
+            for chunk in stream:
+                last_chunk = chunk
+                yield chunk
+            if last_chunk is not None:
+                # Usage metadata is reported on the final chunk
+                self._record_usage(last_chunk, trace_span)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Also runs when the consumer stops reading early (e.g. a cancelled copilot turn)
+            tracer.end_span(trace_span, error=error)
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class CachingClient:
+    """
+    Drop-in wrapper around google.genai.Client that applies prompt-prefix caching (unless manager
+    is None) and tracing to client.models calls. Everything else is delegated to the wrapped client.
+    """
+
+    def __init__(self, client, manager: PromptCacheManager = None):
+        self._client = client
+        self.prompt_cache = manager
+        self.models = _CachingModels(client.models, manager)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -16,7 +16,7 @@ Your role is to assist radiologists by loading cases, interpreting medical image
    - Load a patient's medical image for review
    - Use predefined function load_case(case_number: int) -> str
    - List all available cases
-   - Use predefined function list_available_cases() -> str
+   - Use predefined function list_available_cases(page: int, page_size: int, modality: str, priority: str, ai_flagged_only: bool, after_case: int) -> str
 
 2. **Interpret Medical Images**  
    - Analyze medical images and extract relevant findings.
@@ -61,9 +61,11 @@ When appropriate, call the following functions to perform specific actions:
   - After a case was successfully open, ask if the user wants you to look for clinical data in the electronic medical records 
   - Output: A JSON string of "True" if loading was successful, or "False" otherwise
 
-  - **list_available_cases() -> str**
-  - This function extracts all the case IDs and returns them as a list.    
-  - Output: A JSON string of a list of integers representing available case IDs.
+  - **list_available_cases(page: int = 1, page_size: int = 20, modality: str = "", priority: str = "", ai_flagged_only: bool = False, after_case: int = 0) -> str**
+  - Lists one page of available cases in ascending case ID order, optionally filtered by modality, priority (STAT, Urgent, Routine) or AI flag.
+  - To find the next case, pass the current case ID as after_case and page_size=1.
+  - Only request further pages when the user needs them.
+  - Output: A JSON object with "cases" (id, modality, date, priority, ai_flagged), "page", "pages" and "total".
 
 ### **2. Image Analysis**
   - **interpret_xray() -> dict**
@@ -145,11 +147,14 @@ IMPRESSION:
             "- Maintain **clarity, coherence, and professional tone**.\n"
             "- Format the report strictly according to the template below.\n\n"
             "### TEMPLATE:\n{template}\n\n"
-            "### FINDINGS:\n{findings}\n\n"
             "Return only the **updated structured report**."
         )
         return instructions
 
+    def get_request_generate_report(self):
+        """Returns the per-study part of the report generation request (the instructions are static)."""
+        return "### FINDINGS:\n{findings}"
+
     def get_instructions_update_report(self):
         """Returns improved instructions for updating a structured chest radiograph report."""
         instructions = (
@@ -165,6 +170,22 @@ IMPRESSION:
         )
         return instructions
     
+    def get_instructions_patch_report(self):
+        """Returns instructions for a section-level patch of a structured chest radiograph report."""
+        instructions = (
+            "You are an AI radiology assistant. Your task is to apply the user's requested changes to the structured chest radiograph report below.\n\n"
+            "### Guidelines:\n"
+            "- Return **only the sections that change**. Do not repeat sections that stay the same.\n"
+            "- For each changed section, return its **complete new content**, one list item per line, keeping the original line style (bullets, numbering).\n"
+            "- Ensure **logical coherence**: If a new finding is added, **remove any contradictory statements** in the sections you return, and return every section that needs to change for that.\n"
+            "- Use only these section names: {sections}\n\n"
+            "### CURRENT REPORT:\n{report}\n\n"
+            "### REQUESTED CHANGES:\n{changes}\n\n"
+            "Return only a JSON list, without markdown, in this format:\n"
+            '[{{"section": "IMPRESSION", "lines": ["1. Mild cardiomegaly."]}}]'
+        )
+        return instructions
+
     def get_instructions_search_actionable_findings(self) -> str:
         """
         Generates a prompt to analyze the report for actionable findings.
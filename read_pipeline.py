@@ -0,0 +1,138 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from call_functions import open_case
+from emr_loader import get_clinical_data
+from prefetch import get_prefetcher
+from registry import get_image_interpreter, get_report_agent, get_actionable_findings
+from study_context import StudyContext
+from tracing import span, run_in_context
+
+STAGES = ["load", "interpret", "clinical_data", "report", "findings"]
+
+
+class ReadPipeline:
+    """
+    Deterministic version of the standard read workflow: load case -> analyse image -> generate
+    report -> identify actionable findings, called directly instead of planned by the agent.
+
+    The steps that depend on each other run in order on the calling thread, so on_chunk and
+    on_cold_start may use Streamlit. Independent work overlaps with them in a small pool: the
+    patient's clinical data is read while the image is classified and the report is written,
+    and the following worklist studies are prefetched.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="read-pipeline")
+
+    def run(self, ctx: StudyContext, case_number=None, upcoming_urls=None, on_chunk=None, on_cold_start=None) -> dict:
+        """
+        Reads the study in ctx (or case_number, if given) and updates ctx.report_text.
+
+        Returns:
+            dict: "study_id", "probabilities", "report", "actionable_findings", "clinical_data",
+            "error" (None on success) and "timings" (seconds per stage, plus "total").
+        """
+        with span("read.pipeline", case_number=case_number):
+            return self._run(ctx, case_number, upcoming_urls, on_chunk, on_cold_start)
+
+    def _run(self, ctx, case_number, upcoming_urls, on_chunk, on_cold_start):
+        start = time.perf_counter()
+        timings = {}
+        result = {"study_id": ctx.study_id, "probabilities": None, "report": None,
+                  "actionable_findings": None, "clinical_data": None, "error": None, "timings": timings}
+
+        def timed(stage, function, *args, **kwargs):
+            stage_start = time.perf_counter()
+            try:
+                with span(f"read.{stage}"):
+                    return function(*args, **kwargs)
+            finally:
+                timings[stage] = time.perf_counter() - stage_start
+
+        if case_number is not None:
+            if not timed("load", open_case, ctx, case_number):
+                result["error"] = f"Case {case_number} was not found"
+                timings["total"] = time.perf_counter() - start
+                return result
+            result["study_id"] = ctx.study_id
+
+        if not ctx.image_url:
+            result["error"] = "No study is loaded"
+            timings["total"] = time.perf_counter() - start
+            return result
+
+        # Off the critical path: clinical history and the next studies of the worklist
+        clinical_future = None
+        if ctx.study_id:
+            clinical_future = self._executor.submit(run_in_context(timed), "clinical_data", get_clinical_data,
+                                                    ctx.study_id)
+        if upcoming_urls:
+            get_prefetcher().schedule(upcoming_urls)
+
+        probabilities = timed("interpret", get_image_interpreter().interpret_study, ctx, on_cold_start=on_cold_start)
+        result["probabilities"] = probabilities
+        try:
+            parsed = json.loads(probabilities)
+        except json.JSONDecodeError:
+            parsed = None
+        if not isinstance(parsed, dict) or "error" in parsed:
+            result["error"] = parsed.get("error") if isinstance(parsed, dict) else probabilities
+        else:
+            result["report"] = timed("report", get_report_agent().generate_study_report, ctx, probabilities,
+                                     on_chunk=on_chunk)
+            findings = timed("findings", get_actionable_findings().search_study_findings, ctx)
+            result["actionable_findings"] = json.loads(findings)
+
+        if clinical_future is not None:
+            try:
+                result["clinical_data"] = clinical_future.result()
+            except Exception as e:
+                print(f"Could not load clinical data: {str(e)}")
+
+        timings["total"] = time.perf_counter() - start
+        print("Read pipeline timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+        return result
+
+
+def format_read_summary(result: dict) -> str:
+    """
+    Builds the copilot message for a pipeline run: outcome, actionable findings and stage timings.
+    """
+    if result["error"]:
+        lines = [f"The read could not be completed: {result['error']}"]
+    else:
+        lines = [f"Study ID {result['study_id']} was read and the report is in the editor."]
+        findings = result["actionable_findings"] or []
+        if findings:
+            lines.append("\n**Actionable findings:**")
+            for finding in findings:
+                if isinstance(finding, dict):
+                    lines.append(f"- {finding.get('finding', '')} ({finding.get('urgency', '')}): "
+                                 f"{finding.get('recommendation', '')}")
+                else:
+                    lines.append(f"- {finding}")
+        else:
+            lines.append("\nNo actionable findings were identified.")
+
+    timings = result["timings"]
+    stages = [f"{stage} {timings[stage]:.2f} s" for stage in STAGES if stage in timings]
+    lines.append(f"\n_Timings: {', '.join(stages)}; total {timings['total']:.2f} s._")
+    return "\n".join(lines)
+
+
+_read_pipeline = None
+_read_pipeline_lock = threading.Lock()
+
+
+def get_read_pipeline() -> ReadPipeline:
+    """
+    Returns the process-wide ReadPipeline, creating it on first use.
+    """
+    global _read_pipeline
+    with _read_pipeline_lock:
+        if _read_pipeline is None:
+            _read_pipeline = ReadPipeline()
+        return _read_pipeline
@@ -0,0 +1,88 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import constants as c
+from database import get_backend
+
+
+class RecordFetcher:
+    """
+    Loads the Record Details view of the EMR tab off the script thread.
+
+    Each (source, record) pair is fetched once in a thread pool and the Future is memoized, so
+    later reruns render from memory immediately. For demos, EMR_SIMULATED_LATENCY adds a delay
+    per source ("HIS" for patient charts, "PACS" for study orders); the delay runs in the worker
+    thread, so it never blocks the other widgets.
+    """
+
+    def __init__(self, max_workers=c.EMR_FETCH_MAX_WORKERS, max_records=c.EMR_FETCH_MAX_RECORDS,
+                 simulated_latency=c.EMR_SIMULATED_LATENCY):
+        self.max_records = max_records
+        self.simulated_latency = simulated_latency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="record-fetch")
+        self._lock = threading.Lock()
+        self._futures = OrderedDict()  # (source, record key) -> Future returning the details dict
+
+    def fetch(self, source, record: dict):
+        """
+        Returns a Future with the details of record from source, starting the fetch if needed.
+        """
+        key = (source, json.dumps(record, sort_keys=True, default=str))
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(self._load, source, record)
+                self._futures[key] = future
+            self._futures.move_to_end(key)
+            while len(self._futures) > self.max_records:
+                self._futures.popitem(last=False)
+            return future
+
+    def _load(self, source, record):
+        latency = self.simulated_latency.get(source, 0)
+        if latency:
+            time.sleep(latency)
+
+        details = dict(record)
+        if source == "PACS":
+            # Complete the study order with the PACS worklist record
+            study = get_backend().get_study(record.get("Study ID"))
+            if study:
+                details.update({
+                    "Priority": study.get("priority"),
+                    "AI flagged": "Yes" if study.get("ai_flagged") else "No",
+                })
+        return details
+
+
+def format_details(details: dict) -> str:
+    """
+    Builds the Markdown shown in the Record Details panel, skipping empty fields.
+    """
+    details_md = []
+    for col_name, val in details.items():
+        if val is not None and pd.notna(val) and val != "N/A":
+            details_md.append(f"**{str(col_name).replace('_', ' ')}**: {val}")
+
+    # Join each line with a double newline for spacing
+    return "\n\n".join(details_md)
+
+
+_record_fetcher = None
+_record_fetcher_lock = threading.Lock()
+
+
+def get_record_fetcher() -> RecordFetcher:
+    """
+    Returns the process-wide RecordFetcher, creating it on first use.
+    """
+    global _record_fetcher
+    with _record_fetcher_lock:
+        if _record_fetcher is None:
+            _record_fetcher = RecordFetcher()
+        return _record_fetcher
@@ -0,0 +1,69 @@
+import os
+
+import streamlit as st
+from google import genai
+
+import constants as c
+
+# Process-wide instances shared by every Streamlit session (and by headless callers).
+# Everything returned here is stateless or thread-safe: per-session state (study, report,
+# notification email, chat memory) lives in st.session_state and in each session's Agent.
+# The toolkit imports are delayed to prevent circular dependencies.
+
+
+@st.cache_resource
+def get_gemini_client():
+    from prompt_cache import CachingClient, PromptCacheManager
+    if c.USE_FAKES:
+        from fakes import FakeGeminiClient
+        client = FakeGeminiClient()
+    else:
+        client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    return CachingClient(client, PromptCacheManager(client) if c.PROMPT_CACHE_ENABLED else None)
+
+
+def get_prompt_cache_metrics() -> dict:
+    """
+    Returns cached vs fresh input token counts and cache lifecycle counters, or {} if disabled.
+    """
+    manager = getattr(get_gemini_client(), "prompt_cache", None)
+    return manager.get_metrics() if manager is not None else {}
+
+
+@st.cache_resource
+def get_llm():
+    from llm import LLM
+    return LLM()
+
+
+@st.cache_resource
+def get_image_interpreter():
+    from image_interpreter_agent import ImageInterpreterAgent
+    return ImageInterpreterAgent()
+
+
+@st.cache_resource
+def get_report_agent():
+    from report_agent import ReportAgent
+    return ReportAgent()
+
+
+@st.cache_resource
+def get_actionable_findings():
+    from actionable_findings_agent import ActionableFindings
+    return ActionableFindings()
+
+
+@st.cache_resource
+def get_search_tools():
+    from agno.tools.duckduckgo import DuckDuckGoTools
+    return DuckDuckGoTools()
+
+
+@st.cache_resource
+def get_whisper_transcriber():
+    from whisper import WhisperTranscriber
+    if c.USE_FAKES:
+        from fakes import FakeOpenAI
+        return WhisperTranscriber(os.getenv("OPENAI_API_KEY"), client=FakeOpenAI())
+    return WhisperTranscriber(os.getenv("OPENAI_API_KEY"))
@@ -1,5 +1,5 @@
-import os
 import json
+import time
 
 from agno.tools import Toolkit
 from agno.models.google import Gemini
@@ -7,8 +7,13 @@ from agno.models.message import Message
 
 import streamlit as st
 from prompts import Prompts
+from study_context import StudyContext, streamlit_context
+from job_queue import current_job
 
-from constants import LLM_MODEL_REPORT_AGENT
+from constants import LLM_MODEL_REPORT_AGENT, REPORT_INCREMENTAL_UPDATES
+from registry import get_gemini_client
+from response_cache import get_response_cache
+from tracing import span, set_attribute
 
 prompts = Prompts()
 
@@ -22,76 +27,224 @@ class ReportAgent(Toolkit):
         """Initialize the ReportAgent."""
         super().__init__(name="report_generator")
 
-        self.model = Gemini(api_key=os.environ.get("GEMINI_API_KEY"), id=LLM_MODEL_REPORT_AGENT)
+        # Shares the process-wide Gemini client; this model is only used for plain completions
+        self.model = Gemini(id=LLM_MODEL_REPORT_AGENT, client=get_gemini_client())
 
         # Register the function for external access
         self.register(self.generate_report)
         self.register(self.update_report)
 
-    def _generate_report_prompt(self, findings: str) -> str:
+    def _generate_report_messages(self, findings: str) -> list:
         """
-        Generates a prompt to update the normal template with the findings.
+        Builds the messages to fill the normal template with the findings. The instructions and
+        template go in a static system message, so Gemini can serve them from the prompt cache;
+        only the findings change between studies.
         """
         findings_str = json.dumps(findings, indent=2) if findings else ""
 
         instructions = prompts.get_instructions_generate_report()
         template = prompts.get_report_template()
 
-        instructions_complete = instructions.format(findings=findings_str, template=template)
+        return [
+            Message(role="system", content=instructions.format(template=template)),
+            Message(role="user", content=prompts.get_request_generate_report().format(findings=findings_str)),
+        ]
 
-        return instructions_complete
-
-    def _update_report_prompt(self, changes: str) -> str:
+    def _update_report_prompt(self, changes: str, report: str) -> str:
         """
         Generates a prompt to update the already existing report with the changes requested by the user.
         """
         instructions = prompts.get_instructions_update_report()
-        report = st.session_state.report_text
 
         instructions_complete = instructions.format(changes=changes, report=report)
 
         return instructions_complete
 
+    def _complete(self, messages, on_chunk=None) -> str:
+        """
+        Runs the model and returns the full text. With on_chunk, the response is streamed and each
+        chunk is passed to on_chunk as it arrives; the time to first token is logged.
+        """
+        if on_chunk is None:
+            response = self.model.response(messages=messages)
+            return response.content if response.content else ""
+
+        start = time.perf_counter()
+        time_to_first_token = None
+        chunks = []
+        for response in self.model.response_stream(messages=messages):
+            if not response.content:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+                print(f"Report time to first token: {time_to_first_token:.2f}s")
+                set_attribute("report.ttft_seconds", time_to_first_token)
+            chunks.append(response.content)
+            on_chunk(response.content)
+
+        print(f"Report streamed in {time.perf_counter() - start:.2f}s")
+        return "".join(chunks)
+
+    @staticmethod
+    def _streamlit_sink():
+        """
+        Returns the Report Editor's streaming callback for this session, if the page registered one.
+        Inside a background job, the report is collected by the job for the page to show.
+        """
+        job = current_job()
+        if job is not None:
+            return job.report_sink
+        try:
+            return st.session_state.get("report_stream_sink")
+        except Exception:
+            return None
+
     def generate_report(self, findings: str) -> str:
         """
         Generates a radiology report based on disease probability data.
         """
-        # Construct the prompt
+        with streamlit_context() as ctx:
+            return self.generate_study_report(ctx, findings, on_chunk=self._streamlit_sink())
+
+    def update_report(self, requested_changes: str) -> str:
+        """
+        Updates the current report with the changes requested by the user.
+        """
+        with streamlit_context() as ctx:
+            return self.update_study_report(ctx, requested_changes, on_chunk=self._streamlit_sink())
+
+    def generate_study_report(self, ctx: StudyContext, findings: str, on_chunk=None) -> str:
+        """
+        Generates the report for the study in ctx and stores it in ctx.report_text.
+        If on_chunk is given, the report is streamed and on_chunk receives each new piece of text.
+        """
+        with span("report.generate", study_id=ctx.study_id, streamed=on_chunk is not None):
+            return self._generate_study_report(ctx, findings, on_chunk)
+
+    def _generate_study_report(self, ctx: StudyContext, findings: str, on_chunk=None) -> str:
+        # Construct the messages
         findings = str(findings)
-        prompt = self._generate_report_prompt(findings)
+        messages = self._generate_report_messages(findings)
 
-        # Create a proper Message object for the user message
-        messages = [Message(role="user", content=prompt)]
+        # The same findings always give the same report: serve repeats without calling the model
+        cache = get_response_cache()
+        prompt = "\n\n".join(message.content for message in messages)
+        report_text = cache.get(LLM_MODEL_REPORT_AGENT, prompt)
+        if report_text is not None:
+            print("Report served from the response cache")
+            if on_chunk is not None:
+                on_chunk(report_text)
+            ctx.report_text = report_text
+            return report_text
 
         # Get response from model
-        response = self.model.response(messages=messages)
-
-        report_text = response.content if response.content else ""
-        st.session_state.report_text = report_text
+        report_text = self._complete(messages, on_chunk)
+        ctx.report_text = report_text
+        if report_text:
+            cache.put(LLM_MODEL_REPORT_AGENT, prompt, report_text)
 
         # Extract content from response
         return report_text
 
-    def update_report(self, requested_changes: str) -> str:
+    def update_study_report(self, ctx: StudyContext, requested_changes: str, on_chunk=None) -> str:
         """
-        Updates the current report with the changes requested by the user.
+        Applies the requested changes to ctx.report_text, streaming to on_chunk if given.
+
+        The model is first asked for a section-level patch, so small edits only cost the tokens of
+        the sections they touch. If the patch does not validate, the whole report is regenerated.
         """
-        # Construct the prompt
+        with span("report.update", study_id=ctx.study_id, streamed=on_chunk is not None):
+            return self._update_study_report(ctx, requested_changes, on_chunk)
+
+    def _update_study_report(self, ctx: StudyContext, requested_changes: str, on_chunk=None) -> str:
         requested_changes = str(requested_changes)
-        prompt = self._update_report_prompt(requested_changes)
+
+        if REPORT_INCREMENTAL_UPDATES:
+            try:
+                report_text = self._patch_report(ctx.report_text, requested_changes)
+                print("Report updated with a section patch")
+                set_attribute("report.patched", True)
+                if on_chunk is not None:
+                    on_chunk(report_text)
+                ctx.report_text = report_text
+                return report_text
+            except ValueError as e:
+                print(f"Section patch rejected, regenerating the full report: {str(e)}")
+                set_attribute("report.patched", False)
+
+        # Construct the prompt
+        prompt = self._update_report_prompt(requested_changes, ctx.report_text)
 
         # Create a proper Message object for the user message
         messages = [Message(role="user", content=prompt)]
 
         # Get response from model
-        response = self.model.response(messages=messages)
-
-        report_text = response.content if response.content else ""
-        st.session_state.report_text = report_text
+        report_text = self._complete(messages, on_chunk)
+        ctx.report_text = report_text
 
         # Extract content from response
         return report_text
 
+    def _patch_report(self, report: str, changes: str) -> str:
+        """
+        Asks the model for the changed sections only and applies them to report.
+
+        Raises:
+            ValueError: If the report has no sections or the patch is not valid.
+        """
+        sections = self._split_sections(report)
+        if not sections:
+            raise ValueError("report has no recognizable sections")
+
+        instructions = prompts.get_instructions_patch_report()
+        prompt = instructions.format(sections=", ".join(sections), report=report, changes=changes)
+        response = self.model.response(messages=[Message(role="user", content=prompt)])
+
+        content = (response.content or "").strip()
+        if content.startswith("```"):
+            content = content.strip("`")
+            if content.startswith("json"):
+                content = content[4:]
+        try:
+            patch = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"patch is not valid JSON: {str(e)}")
+
+        if not isinstance(patch, list) or not patch:
+            raise ValueError("patch must be a non-empty list")
+
+        for item in patch:
+            if not isinstance(item, dict):
+                raise ValueError("patch entries must be objects")
+            section = str(item.get("section", "")).strip().rstrip(":").upper()
+            lines = item.get("lines")
+            if section not in sections:
+                raise ValueError(f"unknown section: {section}")
+            if not isinstance(lines, list) or not lines or not all(isinstance(line, str) and line.strip() for line in lines):
+                raise ValueError(f"section {section} must have a non-empty list of lines")
+            sections[section] = [line.rstrip() for line in lines]
+
+        return "\n\n".join(f"{name}:\n" + "\n".join(lines) for name, lines in sections.items())
+
+    @staticmethod
+    def _split_sections(report: str) -> dict:
+        """
+        Splits a report into {"FINDINGS": [lines], "IMPRESSION": [lines], ...} using the
+        upper-case "NAME:" headers of the report template. Returns {} if the report has none.
+        """
+        sections = {}
+        current = None
+        for line in report.splitlines():
+            stripped = line.strip()
+            if stripped.endswith(":") and stripped[:-1].replace(" ", "").isalpha() and stripped.isupper():
+                current = stripped[:-1]
+                sections[current] = []
+            elif current is not None and stripped:
+                sections[current].append(line.rstrip())
+            elif current is None and stripped:
+                # Text before the first header cannot be patched by section
+                return {}
+        return sections
 
 if __name__ == "__main__":
     agent = ReportAgent()
@@ -106,5 +259,5 @@ if __name__ == "__main__":
     }
 
     # Generate and print the structured report
-    report = agent.generate_report(example_findings)
+    report = agent.generate_study_report(StudyContext(), example_findings)
     print(report)
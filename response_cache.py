@@ -0,0 +1,126 @@
+import re
+import json
+import hashlib
+import threading
+
+import numpy as np
+from cachetools import TTLCache
+
+import constants as c
+from tracing import set_attribute
+
+
+class ResponseCache:
+    """
+    In-memory cache of LLM responses shared by every session.
+
+    - Exact tier: keyed by a hash of the model id, the normalized prompt and its context (e.g. the
+      study and report the prompt refers to), with TTL and LRU eviction.
+    - Semantic tier (optional): on an exact miss, the prompt is embedded and compared with the
+      prompts cached for the same model and context; a close enough match is returned instead.
+      Only meant for free-text user phrasing, so it is enabled per lookup.
+    """
+
+    def __init__(self, max_entries=c.RESPONSE_CACHE_MAX_ENTRIES, ttl=c.RESPONSE_CACHE_TTL,
+                 semantic=c.RESPONSE_CACHE_SEMANTIC, threshold=c.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+                 embed=None):
+        self.semantic = semantic
+        self.threshold = threshold
+        self._embed = embed or self._gemini_embedding
+        self._lock = threading.Lock()
+        self._entries = TTLCache(maxsize=max_entries, ttl=ttl)  # key -> response
+        self._vectors = TTLCache(maxsize=max_entries, ttl=ttl)  # key -> (scope, unit vector)
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def normalize(text) -> str:
+        return re.sub(r"\s+", " ", str(text)).strip().casefold()
+
+    def _scope(self, model_id, context):
+        payload = json.dumps([model_id, self.normalize(context)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _key(self, model_id, prompt, context):
+        payload = json.dumps([model_id, self.normalize(context), self.normalize(prompt)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, model_id, prompt, context="", semantic=False):
+        """
+        Returns the cached response for prompt, or None on a miss.
+        """
+        key = self._key(model_id, prompt, context)
+        with self._lock:
+            if key in self._entries:
+                self.stats["exact_hits"] += 1
+                set_attribute("response_cache", "exact")
+                return self._entries[key]
+
+        if semantic and self.semantic:
+            vector = self._unit_vector(prompt)
+            if vector is not None:
+                scope = self._scope(model_id, context)
+                with self._lock:
+                    best_key, best_score = None, self.threshold
+                    for candidate, (candidate_scope, candidate_vector) in self._vectors.items():
+                        if candidate_scope != scope or candidate not in self._entries:
+                            continue
+                        score = float(np.dot(vector, candidate_vector))
+                        if score >= best_score:
+                            best_key, best_score = candidate, score
+                    if best_key is not None:
+                        self.stats["semantic_hits"] += 1
+                        set_attribute("response_cache", "semantic")
+                        print(f"Semantic response cache hit (similarity {best_score:.3f})")
+                        return self._entries[best_key]
+
+        with self._lock:
+            self.stats["misses"] += 1
+        set_attribute("response_cache", "miss")
+        return None
+
+    def put(self, model_id, prompt, response, context="", semantic=False):
+        key = self._key(model_id, prompt, context)
+        vector = self._unit_vector(prompt) if semantic and self.semantic else None
+        with self._lock:
+            self._entries[key] = response
+            if vector is not None:
+                self._vectors[key] = (self._scope(model_id, context), vector)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries)}
+
+    def _unit_vector(self, text):
+        try:
+            vector = np.asarray(self._embed(self.normalize(text)), dtype=np.float32)
+        except Exception as e:
+            print(f"Could not embed prompt for the response cache: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    @staticmethod
+    def _gemini_embedding(text):
+        from registry import get_gemini_client
+        response = get_gemini_client().models.embed_content(model=c.RESPONSE_CACHE_EMBEDDING_MODEL, contents=text)
+        return response.embeddings[0].values
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Returns the process-wide ResponseCache, creating it on first use.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
@@ -0,0 +1,361 @@
+import os
+import csv
+import json
+import sqlite3
+import argparse
+import threading
+
+import pandas as pd
+
+import constants as c
+from emr_store import STUDY_COLUMNS, WORKLIST_COLUMNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    mrn TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS studies (
+    study_id INTEGER PRIMARY KEY,
+    study_key TEXT NOT NULL,
+    mrn TEXT NOT NULL REFERENCES patients (mrn),
+    date TEXT,
+    modality TEXT,
+    url TEXT,
+    priority TEXT,
+    ai_flagged INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_studies_key ON studies (study_key);
+CREATE INDEX IF NOT EXISTS idx_studies_mrn ON studies (mrn);
+
+CREATE TABLE IF NOT EXISTS chart_entries (
+    entry_id INTEGER PRIMARY KEY,
+    study_id INTEGER NOT NULL REFERENCES studies (study_id),
+    mrn TEXT NOT NULL,
+    date TEXT,
+    fields TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chart_entries_study ON chart_entries (study_id);
+CREATE INDEX IF NOT EXISTS idx_chart_entries_mrn ON chart_entries (mrn, entry_id);
+"""
+
+# Worklist filters and sort orders; created after the migration adds the worklist columns
+WORKLIST_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_studies_url ON studies (url);
+CREATE INDEX IF NOT EXISTS idx_studies_date ON studies (date);
+CREATE INDEX IF NOT EXISTS idx_studies_modality_date ON studies (modality, date);
+CREATE INDEX IF NOT EXISTS idx_studies_priority_date ON studies (priority, date);
+CREATE INDEX IF NOT EXISTS idx_studies_flagged_date ON studies (ai_flagged, date);
+"""
+
+WORKLIST_SORTS = {
+    "id": "study_id",
+    "date": "date",
+    "modality": "modality",
+    # Ranked by urgency like the in-memory store: descending puts STAT first and unknown priorities last
+    "priority": "CASE priority " + " ".join(
+        f"WHEN '{name}' THEN {len(c.PRIORITIES) - i}" for i, name in enumerate(c.PRIORITIES)) + " ELSE 0 END",
+}
+
+# Substring search over IDs uses FTS5 trigram indexes when this SQLite build has them (3.34+)
+TRIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS study_keys USING fts5(key, tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS patient_keys USING fts5(key, tokenize='trigram');
+"""
+
+
+class SQLiteBackend:
+    """
+    SQLite-backed EMR/PACS store with the same query interface as EMRStore.
+
+    The database runs in WAL mode so the Streamlit sessions can read while the bulk loader
+    writes. Studies, patients and chart entries live in indexed tables, and every query is
+    paginated, so nothing is loaded into memory beyond the requested page.
+    """
+
+    def __init__(self, db_path=c.EMR_DATABASE_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.executescript(WORKLIST_INDEXES)
+        try:
+            conn.executescript(TRIGRAM_SCHEMA)
+            self.has_trigram = True
+        except sqlite3.OperationalError:
+            self.has_trigram = False
+        conn.commit()
+
+    @staticmethod
+    def _migrate(conn):
+        # Databases created before the worklist columns existed
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(studies)")}
+        for column, kind in (("priority", "TEXT"), ("ai_flagged", "INTEGER")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE studies ADD COLUMN {column} {kind}")
+
+    def _connection(self):
+        # One connection per thread: sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    # ----------------- QUERIES -----------------
+    def search_studies(self, search_field, offset=0, limit=c.EMR_PAGE_SIZE) -> pd.DataFrame:
+        """
+        Returns one page of studies whose Study ID contains search_field.
+        """
+        clause, params = self._match("study_key", "study_keys", search_field)
+        rows = self._connection().execute(
+            f"SELECT study_id, mrn, date, modality FROM studies WHERE {clause} "
+            f"ORDER BY study_id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        if not rows:
+            return pd.DataFrame()
+        return pd.DataFrame(rows, columns=STUDY_COLUMNS)
+
+    def search_charts(self, search_field, offset=0, limit=c.EMR_PAGE_SIZE) -> pd.DataFrame:
+        """
+        Returns one page of flattened chart entries of the patients whose MRN contains search_field.
+        """
+        clause, params = self._match("mrn", "patient_keys", search_field)
+        rows = self._connection().execute(
+            f"SELECT mrn, fields FROM chart_entries WHERE {clause} ORDER BY mrn, entry_id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        if not rows:
+            return pd.DataFrame()
+        return pd.DataFrame([{"Patient MRN": mrn, **json.loads(fields)} for mrn, fields in rows])
+
+    def charts_for_study(self, study_id) -> list:
+        rows = self._connection().execute(
+            "SELECT fields FROM chart_entries WHERE study_id = ? ORDER BY entry_id", (self._as_id(study_id),)
+        ).fetchall()
+        return [json.loads(fields) for (fields,) in rows]
+
+    def has_study(self, study_id) -> bool:
+        row = self._connection().execute(
+            "SELECT 1 FROM studies WHERE study_id = ?", (self._as_id(study_id),)
+        ).fetchone()
+        return row is not None
+
+    def worklist(self, offset=0, limit=c.EMR_PAGE_SIZE) -> pd.DataFrame:
+        """
+        Returns one page of worklist studies (id, url): the studies that have an image.
+        """
+        rows = self._connection().execute(
+            "SELECT study_id, url FROM studies WHERE url IS NOT NULL ORDER BY study_id LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+        return pd.DataFrame(rows, columns=["id", "url"])
+
+    def query_worklist(self, offset=0, limit=c.WORKLIST_PAGE_SIZE, sort_by="date", descending=True,
+                       filters=None):
+        """
+        Returns (one page of worklist studies, total number of matching studies). Filtering and
+        sorting run in SQL, so only the requested page leaves the database.
+
+        filters may contain: modality, priority (list), date_from, date_to (ISO dates), ai_flagged (bool),
+        id_after (only studies with a greater Study ID).
+        """
+        filters = filters or {}
+        clauses, params = ["url IS NOT NULL"], []
+        if filters.get("modality"):
+            clauses.append("modality = ?")
+            params.append(filters["modality"])
+        if filters.get("priority"):
+            clauses.append(f"priority IN ({', '.join('?' * len(filters['priority']))})")
+            params.extend(filters["priority"])
+        if filters.get("date_from"):
+            clauses.append("date >= ?")
+            params.append(str(filters["date_from"]))
+        if filters.get("date_to"):
+            clauses.append("date <= ?")
+            params.append(str(filters["date_to"]))
+        if filters.get("id_after"):
+            clauses.append("study_id > ?")
+            params.append(int(filters["id_after"]))
+        if filters.get("ai_flagged") is not None:
+            clauses.append("COALESCE(ai_flagged, 0) = ?")
+            params.append(int(bool(filters["ai_flagged"])))
+        where = " AND ".join(clauses)
+
+        order = WORKLIST_SORTS.get(sort_by, "date")
+        direction = "DESC" if descending else "ASC"
+
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM studies WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT study_id, url, modality, date, priority, COALESCE(ai_flagged, 0) FROM studies WHERE {where} "
+            f"ORDER BY {order} {direction}, study_id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        page = pd.DataFrame(rows, columns=WORKLIST_COLUMNS)
+        page["ai_flagged"] = page["ai_flagged"].astype(bool)
+        return page, total
+
+    def get_study(self, study_id):
+        """
+        Returns the worklist record of one study by primary key, or None. Like the worklist, only
+        studies with an image are returned.
+        """
+        row = self._connection().execute(
+            "SELECT study_id, url, modality, date, priority, ai_flagged FROM studies "
+            "WHERE study_id = ? AND url IS NOT NULL",
+            (self._as_id(study_id),),
+        ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(WORKLIST_COLUMNS, row))
+        record["ai_flagged"] = bool(record["ai_flagged"])
+        return record
+
+    def worklist_facets(self) -> dict:
+        """
+        Returns the values the worklist filters can take.
+        """
+        conn = self._connection()
+        modalities = [row[0] for row in conn.execute(
+            "SELECT DISTINCT modality FROM studies WHERE modality IS NOT NULL ORDER BY modality")]
+        return {"modality": modalities, "priority": list(c.PRIORITIES)}
+
+    def set_ai_flag(self, image_url, flagged):
+        """
+        Records the classifier verdict for the studies showing image_url.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("UPDATE studies SET ai_flagged = ? WHERE url = ?", (int(bool(flagged)), image_url))
+
+    def is_empty(self) -> bool:
+        return self._connection().execute("SELECT 1 FROM studies LIMIT 1").fetchone() is None
+
+    def _match(self, column, fts_table, query):
+        query = str(query)
+        if not query:
+            return "1 = 1", []
+        if self.has_trigram and len(query) >= 3:
+            return (f"{column} IN (SELECT key FROM {fts_table} WHERE key MATCH ?)",
+                    ['"' + query.replace('"', '""') + '"'])
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"{column} LIKE ? ESCAPE '\\'", [f"%{escaped}%"]
+
+    @staticmethod
+    def _as_id(study_id):
+        try:
+            return int(study_id)
+        except (TypeError, ValueError):
+            return None
+
+    # ----------------- BULK LOADING -----------------
+    def load_cases(self, cases, batch_size=c.EMR_LOAD_BATCH_SIZE):
+        """
+        Inserts (or replaces) records in the CASES format, committing every batch_size studies.
+        cases can be any iterable, so large exports are streamed instead of held in memory.
+
+        Returns:
+            int: Number of studies loaded.
+        """
+        conn = self._connection()
+        loaded = 0
+        batch = []
+        for case in cases:
+            batch.append(case)
+            if len(batch) >= batch_size:
+                loaded += self._insert_batch(conn, batch)
+                batch = []
+        if batch:
+            loaded += self._insert_batch(conn, batch)
+        return loaded
+
+    def _insert_batch(self, conn, cases):
+        with conn:
+            for case in cases:
+                study_id = int(case["Study ID"])
+                mrn = str(case["Patient MRN"])
+                charts = case.get("medical_charts") or []
+                if isinstance(charts, str):
+                    charts = json.loads(charts)
+
+                if conn.execute("INSERT OR IGNORE INTO patients (mrn) VALUES (?)", (mrn,)).rowcount \
+                        and self.has_trigram:
+                    conn.execute("INSERT INTO patient_keys (key) VALUES (?)", (mrn,))
+
+                replaced = conn.execute("SELECT 1 FROM studies WHERE study_id = ?", (study_id,)).fetchone()
+                conn.execute("DELETE FROM chart_entries WHERE study_id = ?", (study_id,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO studies (study_id, study_key, mrn, date, modality, url, priority) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (study_id, str(study_id), mrn, case.get("Date"), case.get("Modality"), case.get("url"),
+                     case.get("Priority")),
+                )
+                if not replaced and self.has_trigram:
+                    conn.execute("INSERT INTO study_keys (key) VALUES (?)", (str(study_id),))
+
+                conn.executemany(
+                    "INSERT INTO chart_entries (study_id, mrn, date, fields) VALUES (?, ?, ?, ?)",
+                    [(study_id, mrn, chart.get("Date"), json.dumps(chart)) for chart in charts],
+                )
+        return len(cases)
+
+    def load_file(self, path, batch_size=c.EMR_LOAD_BATCH_SIZE):
+        """
+        Streams a JSON Lines, JSON, CSV or Parquet export into the database.
+        CSV and Parquet exports store medical_charts as a JSON string column.
+        """
+        return self.load_cases(iter_export(path), batch_size=batch_size)
+
+    def seed(self, cases, samples):
+        """
+        Loads the built-in demo records (CASES plus the SAMPLE_CASES image URLs) into an empty database.
+        """
+        urls = {sample["id"]: sample["url"] for sample in samples}
+        self.load_cases({**case, "url": urls.get(case["Study ID"])} for case in cases)
+
+
+def iter_export(path):
+    """
+    Yields case records from an export file one at a time, picking the reader from the extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in (".jsonl", ".ndjson"):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif extension == ".json":
+        # A plain JSON array has to be parsed at once; prefer JSON Lines for large exports
+        with open(path, "r") as f:
+            yield from json.load(f)
+    elif extension == ".csv":
+        with open(path, "r", newline="") as f:
+            yield from csv.DictReader(f)
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=c.EMR_LOAD_BATCH_SIZE):
+            yield from batch.to_pylist()
+    else:
+        raise ValueError(f"Unsupported export format: {extension}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load an EMR/PACS export into the workstation database.")
+    parser.add_argument("path", help="JSON Lines, JSON, CSV or Parquet export")
+    parser.add_argument("--db", default=c.EMR_DATABASE_PATH, help="SQLite database file")
+    args = parser.parse_args()
+
+    backend = SQLiteBackend(args.db)
+    print(f"Loaded {backend.load_file(args.path)} studies into {args.db}")
@@ -1,10 +1,33 @@
 from PIL import Image
-from io import BytesIO
-import requests
+import pandas as pd
 import streamlit as st
-from llm import LLM
+from image_cache import get_image_cache
+from call_functions import load_case
+from prefetch import get_prefetcher
+from tracing import get_tracer
+from job_queue import get_job_queue
+from response_cache import get_response_cache
 
-llm = LLM()
+
+class ReportStreamSink:
+    """
+    Streams report text into the Report Editor while the model is still writing it. The text area
+    is swapped for a read-only preview in the same placeholder; the next rerun restores the editor.
+    Background jobs collect the text themselves, and the page's polling fragment shows it here.
+    """
+
+    def __init__(self, placeholder, height=None):
+        self.placeholder = placeholder
+        self.height = height
+        self.text = ""
+
+    def __call__(self, chunk):
+        self.text += chunk
+        self.show(self.text)
+
+    def show(self, text):
+        with self.placeholder.container(height=self.height, border=False):
+            st.code(text, language=None, wrap_lines=True)
 
 
 class Streamlit:
@@ -22,8 +45,8 @@ class Streamlit:
     def load_image_from_url(self, url):
         if url:
             try:
-                response = requests.get(url)
-                return Image.open(BytesIO(response.content))
+                # Served from the shared cache: no download or decode for images seen before
+                return get_image_cache().get_image(url)
             except:
                 return None
         else:
@@ -37,7 +60,104 @@ class Streamlit:
                 return None
         return None
 
+    # ----------------- WORKLIST -----------------
+    @staticmethod
+    def show_worklist(db, height=220):
+        """
+        Paginated worklist. Filtering and sorting run in the database and only the current page is
+        fetched; the table itself is virtualized, so only the visible rows are drawn.
+        """
+        facets = db.worklist_facets()
+
+        with st.popover("🔎 Filter & sort", use_container_width=True):
+            modality = st.selectbox("Modality", ["All"] + facets["modality"], key="worklist_modality")
+            priority = st.multiselect("Priority", facets["priority"], key="worklist_priority")
+            dates = st.date_input("Study date", value=(), key="worklist_dates")
+            ai_flagged_only = st.toggle("AI-flagged only", key="worklist_ai_flagged")
+            sort_by = st.selectbox("Sort by", ["date", "priority", "id", "modality"], format_func=str.title,
+                                   key="worklist_sort_by")
+            descending = st.toggle("Descending", value=True, key="worklist_descending")
+
+        query = dict(
+            sort_by=sort_by,
+            descending=descending,
+            modality=None if modality == "All" else modality,
+            priority=priority or None,
+            date_from=dates[0] if len(dates) > 0 else None,
+            date_to=dates[1] if len(dates) > 1 else None,
+            ai_flagged=True if ai_flagged_only else None,
+        )
+
+        page = st.session_state.get("worklist_page", 1)
+        cases_df, total, pages = db.query_worklist(page=page, **query)
+        if page > pages:
+            # Filters changed and the old page no longer exists
+            st.session_state.worklist_page = page = pages
+            cases_df, total, pages = db.query_worklist(page=page, **query)
+
+        st.session_state.cases_df = cases_df
+        # Warm images and classifier results for the visible page
+        get_prefetcher().schedule(cases_df["url"].to_list())
+
+        selection = st.dataframe(
+            cases_df.drop(columns=["url"]),
+            height=height,
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key="worklist_table",
+            column_config={
+                "id": st.column_config.NumberColumn("Study ID", format="%d"),
+                "modality": "Modality",
+                "date": "Date",
+                "priority": "Priority",
+                "ai_flagged": st.column_config.CheckboxColumn("AI flag"),
+            },
+        )
+
+        col_page, col_total = st.columns([1, 2])
+        with col_page:
+            st.number_input("Page", min_value=1, max_value=pages, step=1, key="worklist_page",
+                            label_visibility="collapsed")
+        with col_total:
+            st.caption(f"Page {page} of {pages} · {total} studies")
+
+        selected_rows = selection.selection.get("rows", [])
+        if selected_rows:
+            study_id = int(cases_df.iloc[selected_rows[0]]["id"])
+            # Only react to a new selection, not to the row that stays selected across reruns
+            if study_id != st.session_state.get("worklist_selected_id"):
+                st.session_state.worklist_selected_id = study_id
+                load_case(study_id)
+                st.rerun()
+
     # --- FOOTER ---
+    @staticmethod
+    @st.fragment(run_every=2)
+    def show_latency_panel():
+        """
+        Live p50/p95/p99 latency per traced stage, plus queue and cache counters.
+        """
+        st.subheader("⏱️ Latency")
+        rows = get_tracer().get_percentiles()
+        if rows:
+            df = pd.DataFrame(rows).set_index("span")
+            for column in ["p50", "p95", "p99", "max"]:
+                df[column] = (df[column] * 1000).round(0)
+            st.dataframe(df.rename(columns={"p50": "p50 ms", "p95": "p95 ms", "p99": "p99 ms", "max": "max ms"}),
+                         use_container_width=True)
+        else:
+            st.caption("No traced requests yet.")
+
+        from registry import get_prompt_cache_metrics
+        st.caption("Job queue")
+        st.json(get_job_queue().get_metrics(), expanded=False)
+        st.caption("Prompt cache")
+        st.json(get_prompt_cache_metrics(), expanded=False)
+        st.caption("Response cache")
+        st.json(get_response_cache().get_stats(), expanded=False)
+
     @staticmethod
     def show_footer():
         buttons = {
@@ -49,12 +169,13 @@ class Streamlit:
             "⚡ **`identify findings in report`**": "Identify significant findings in report",
             "✅ **`sign report`**": "Sign report",
             "🔔 **`send notification`**": "Send notification",
+            "🚀 **`read study`**": "/read",
             "📂 **`load EMR`**": "Retrieve and summarize patient clinical history",
         }
 
         def run_button_command(command):
             st.session_state["history"].append(
-                {"user_message": command, "assistant_message": None, "reasoning": None})
+                {"user_message": command, "assistant_message": None, "reasoning": None, "pending": True})
             st.session_state.processing = True
             st.rerun()
 
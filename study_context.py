@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, asdict
+from typing import Optional
+
+import streamlit as st
+
+from job_queue import current_job
+
+
+@dataclass
+class StudyContext:
+    """
+    The per-session state the tools work on. Tools receive it explicitly, so they can run in
+    worker threads, process pools or headless batch jobs without touching st.session_state.
+    """
+    study_id: Optional[int] = None
+    image_url: Optional[str] = None
+    report_text: str = ""
+    notification_email: Optional[str] = None
+
+    @classmethod
+    def from_session_state(cls, session_state=None) -> "StudyContext":
+        session_state = st.session_state if session_state is None else session_state
+        values = {}
+        for field in fields(cls):
+            try:
+                value = session_state.get(field.name)
+            except Exception:
+                # No Streamlit session (e.g. running as a standalone script)
+                value = None
+            if value is not None:
+                values[field.name] = value
+        return cls(**values)
+
+    def to_session_state(self, session_state=None, only=None):
+        """
+        Writes the context back to the session state, or only the field names listed in `only`.
+        """
+        session_state = st.session_state if session_state is None else session_state
+        for name, value in asdict(self).items():
+            if only is None or name in only:
+                session_state[name] = value
+
+
+@contextmanager
+def streamlit_context():
+    """
+    Thin adapter between st.session_state and StudyContext for the agent-facing tools: yields a
+    context read from the session state, then writes back only the fields the tool changed.
+    Inside a background job it yields the job's own snapshot instead, and the session state is
+    left to the script thread.
+    """
+    job = current_job()
+    if job is not None and job.study is not None:
+        yield job.study
+        return
+
+    ctx = StudyContext.from_session_state()
+    before = asdict(ctx)
+    yield ctx
+    changed = [name for name, value in asdict(ctx).items() if before[name] != value]
+    if changed:
+        ctx.to_session_state(only=changed)
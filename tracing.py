@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import atexit
+import secrets
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from collections import defaultdict, deque
+
+import constants as c
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation. Spans opened while another span is current become its children and share
+    its trace id, so an agent turn, its tool calls and their model/HTTP calls form one tree.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "OK"
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes})
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {"name": event["name"], "timeUnixNano": str(event["time_ns"]),
+                 "attributes": _otlp_attributes(event["attributes"])}
+                for event in self.events
+            ],
+            "status": {"code": 1 if self.status == "OK" else 2, "message": self.status_message},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+def _otlp_attributes(attributes) -> list:
+    converted = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed})
+    return converted
+
+
+class Tracer:
+    """
+    Records spans, keeps a rolling window of durations per span name for the latency panel, and
+    exports finished spans as OpenTelemetry (OTLP/JSON) batches, one per line of export_path.
+    The file can be replayed into any OTLP-compatible collector.
+
+    Finished spans are only buffered on the calling thread; a background thread writes them every
+    flush_interval seconds, or sooner once flush_every spans are waiting. When the file would grow
+    past max_file_bytes it is renamed to <export_path>.1 (replacing the previous one) and restarted.
+    """
+
+    def __init__(self, export_path=c.TRACE_EXPORT_PATH, window=c.TRACE_WINDOW,
+                 flush_every=c.TRACE_FLUSH_EVERY, flush_interval=c.TRACE_FLUSH_INTERVAL,
+                 max_file_bytes=c.TRACE_MAX_FILE_BYTES, enabled=c.TRACING_ENABLED):
+        self.export_path = export_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Keeps the batches of concurrent flushes whole and in order
+        self._pending = []
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._flush_requested = threading.Event()
+
+        directory = os.path.dirname(self.export_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if self.enabled:
+            threading.Thread(target=self._flush_periodically, name="trace-flusher", daemon=True).start()
+            atexit.register(self.flush)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        if not self.enabled:
+            yield None
+            return
+
+        span = Span(name, parent=_current_span.get(), attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "ERROR"
+            span.status_message = str(e)
+            span.add_event("exception", type=type(e).__name__, message=str(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._record(span)
+
+    def start_span(self, name, **attributes):
+        """
+        Starts a child of the current span without making it current, for work that spans several
+        yields of a generator (e.g. a streamed response). Finish it with end_span.
+        """
+        if not self.enabled:
+            return None
+        return Span(name, parent=_current_span.get(), attributes=attributes)
+
+    def end_span(self, span, error=None):
+        if span is None:
+            return
+        if error is not None:
+            span.status = "ERROR"
+            span.status_message = str(error)
+        span.end_ns = time.time_ns()
+        self._record(span)
+
+    def _record(self, span):
+        with self._lock:
+            self._durations[span.name].append(span.duration)
+            self._pending.append(span)
+            full = len(self._pending) >= self.flush_every
+        if full:
+            self._flush_requested.set()
+
+    def _flush_periodically(self):
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered spans now, from the calling thread.
+        """
+        with self._write_lock:
+            with self._lock:
+                spans, self._pending = self._pending, []
+            if not spans:
+                return
+            batch = {
+                "resourceSpans": [{
+                    "resource": {"attributes": _otlp_attributes({"service.name": c.TRACE_SERVICE_NAME})},
+                    "scopeSpans": [{"scope": {"name": "workstation.tracing"},
+                                    "spans": [span.to_otlp() for span in spans]}],
+                }]
+            }
+            line = json.dumps(batch) + "\n"
+            try:
+                self._rotate(len(line))
+                with open(self.export_path, "a") as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Could not export traces: {str(e)}")
+
+    def _rotate(self, incoming):
+        try:
+            size = os.path.getsize(self.export_path)
+        except FileNotFoundError:
+            return
+        if size and size + incoming > self.max_file_bytes:
+            os.replace(self.export_path, self.export_path + ".1")
+
+    def get_percentiles(self) -> list:
+        """
+        Returns one row per span name: count, p50, p95, p99 and max duration in seconds, over the
+        last spans of that name.
+        """
+        with self._lock:
+            windows = {name: sorted(durations) for name, durations in self._durations.items() if durations}
+
+        def percentile(values, q):
+            return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+        return [
+            {"span": name, "count": len(values), "p50": percentile(values, 0.50),
+             "p95": percentile(values, 0.95), "p99": percentile(values, 0.99), "max": values[-1]}
+            for name, values in sorted(windows.items())
+        ]
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Returns the process-wide Tracer, creating it on first use.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def span(name, **attributes):
+    """
+    Context manager that times a block as a child of the current span.
+    """
+    return get_tracer().span(name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_attribute(key, value):
+    """
+    Sets an attribute on the current span, if any (e.g. token counts, cache hits).
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def add_event(name, **attributes):
+    current = _current_span.get()
+    if current is not None:
+        current.add_event(name, **attributes)
+
+
+def run_in_context(function):
+    """
+    Wraps function so it runs with the caller's current span when submitted to another thread
+    (thread pools do not carry context variables over on their own).
+    """
+    context = contextvars.copy_context()
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+    return wrapper
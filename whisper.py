@@ -1,65 +1,149 @@
-import time
+import io
 import os
+import wave
+import struct
 import streamlit as st
 from openai import OpenAI
-import tempfile
-import wave
 import constants as c
+from tracing import span
+
+
+class _SegmentReader(io.RawIOBase):
+    """
+    Read-only file over a list of buffers, served in place: nothing is concatenated or copied
+    until the reader (e.g. the HTTP client building the upload) asks for the bytes.
+    """
+
+    def __init__(self, segments, name="dictation.wav"):
+        super().__init__()
+        self.name = name
+        self._segments = [memoryview(segment).cast("B") for segment in segments]
+        self.size = sum(len(segment) for segment in self._segments)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def readinto(self, buffer):
+        written, start = 0, 0
+        for segment in self._segments:
+            if written < len(buffer) and self._position < start + len(segment):
+                offset = self._position - start
+                count = min(len(buffer) - written, len(segment) - offset)
+                buffer[written:written + count] = segment[offset:offset + count]
+                self._position += count
+                written += count
+            start += len(segment)
+        return written
+
+
+class WavRecording:
+    """
+    A WAV recording held in memory (e.g. the buffer of st.audio_input's upload). The RIFF chunks
+    are parsed in place and the samples stay a memoryview of the original buffer, so cropping only
+    moves an offset and a new 8-byte data header is the only thing written.
+    """
+
+    def __init__(self, data):
+        self.buffer = memoryview(data).cast("B")
+        if len(self.buffer) < 12 or self.buffer[0:4] != b"RIFF" or self.buffer[8:12] != b"WAVE":
+            raise wave.Error("not a WAV recording")
+
+        self._fmt_chunk = None
+        self.frames = None
+        position = 12
+        while position + 8 <= len(self.buffer):
+            chunk_id = self.buffer[position:position + 4].tobytes()
+            (size,) = struct.unpack_from("<I", self.buffer, position + 4)
+            if chunk_id == b"fmt ":
+                # Odd-sized chunks are followed by a pad byte, which the copy must keep to stay aligned
+                self._fmt_chunk = self.buffer[position:min(position + 8 + size + (size & 1), len(self.buffer))]
+                self.channels, self.rate, _, self.block_align, self.sample_bits = \
+                    struct.unpack_from("<HIIHH", self.buffer, position + 10)
+            elif chunk_id == b"data":
+                # Recorders that stream to the buffer may leave the size unset: keep what is there
+                self.frames = self.buffer[position + 8:min(position + 8 + size, len(self.buffer))]
+                break
+            position += 8 + size + (size & 1)
+
+        if self._fmt_chunk is None or self.frames is None or not self.block_align:
+            raise wave.Error("WAV recording without a format or data chunk")
+
+    @property
+    def nframes(self) -> int:
+        return len(self.frames) // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.nframes / float(self.rate)
+
+    def open(self, max_duration=None) -> _SegmentReader:
+        """
+        Returns a file-like WAV of the first max_duration seconds (all of it if None), read straight
+        from the recording's buffer.
+        """
+        frames = self.nframes if max_duration is None else min(self.nframes, int(self.rate * max_duration))
+        data = self.frames[:frames * self.block_align]
+        riff_header = struct.pack("<4sI4s", b"RIFF", 4 + len(self._fmt_chunk) + 8 + len(data), b"WAVE")
+        data_header = struct.pack("<4sI", b"data", len(data))
+        return _SegmentReader([riff_header, self._fmt_chunk, data_header, data])
+
 
 class WhisperTranscriber:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, client=None):
+        self.client = client if client is not None else OpenAI(api_key=api_key)
 
     def transcribe_audio(self, audio_file):
-        transcription = self.client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            response_format="text"
-        )
+        with span("whisper.transcribe", model="whisper-1", **{"payload.bytes": self._payload_size(audio_file)}):
+            transcription = self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                response_format="text"
+            )
         return transcription
 
+    @staticmethod
+    def _payload_size(audio_file):
+        if isinstance(getattr(audio_file, "size", None), int):
+            return audio_file.size
+        if hasattr(audio_file, "getbuffer"):
+            return audio_file.getbuffer().nbytes
+        try:
+            return os.fstat(audio_file.fileno()).st_size
+        except (AttributeError, OSError):
+            return None
+
 
 class StreamlitWhisperApp:
     def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        self.transcriber = WhisperTranscriber(api_key)
+        # Delay the import here to prevent circular dependency
+        from registry import get_whisper_transcriber
+        self.transcriber = get_whisper_transcriber()
         if "audio_key" not in st.session_state:
             st.session_state.audio_key = 0
 
-    def get_audio_duration(self, file_path):
-        with wave.open(file_path, "rb") as audio:
-            frames = audio.getnframes()
-            rate = audio.getframerate()
-            duration = frames / float(rate)
-        return duration
-
-    def crop_audio(self, input_file_path, max_duration=c.MAX_DURATION_AUDIO):
-        # Create a new temporary file for cropped output
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_cropped:
-            cropped_path = temp_cropped.name
-
-        # Read and crop from input file
-        with wave.open(input_file_path, "rb") as audio:
-            params = audio.getparams()
-            rate = audio.getframerate()
-            frames = audio.getnframes()
-            duration = frames / float(rate)
-
-            # If duration is fine, just copy the file
-            if duration <= max_duration:
-                with wave.open(cropped_path, "wb") as dst_audio:
-                    dst_audio.setparams(params)
-                    dst_audio.writeframes(audio.readframes(frames))
-            else:
-                # Crop to max duration
-                max_frames = int(rate * max_duration)
-                with wave.open(cropped_path, "wb") as dst_audio:
-                    st.toast(f"Your message was cropped to {max_duration} seconds.", icon="🚨")
-                    time.sleep(3)
-                    dst_audio.setparams(params)
-                    dst_audio.writeframes(audio.readframes(max_frames))
-
-        return cropped_path
+    def get_audio_duration(self, recording: WavRecording):
+        return recording.duration
+
+    def crop_audio(self, recording: WavRecording, max_duration=c.MAX_DURATION_AUDIO):
+        """
+        Returns the recording, cut to max_duration seconds, as a file-like WAV read in place.
+        """
+        if recording.duration > max_duration:
+            # Toasts outlive the rerun that follows the transcription, so nothing waits for it here
+            st.toast(f"Your message was cropped to {max_duration} seconds.", icon="🚨")
+        return recording.open(max_duration=max_duration)
 
     def show_audio_input(self):
         audio_file = st.audio_input("Talk to the Co-Pilot:",
@@ -68,7 +152,7 @@ class StreamlitWhisperApp:
 
         def run_button_command(command_message):
             st.session_state["history"].append(
-                {"user_message": command_message, "assistant_message": None, "reasoning": None}
+                {"user_message": command_message, "assistant_message": None, "reasoning": None, "pending": True}
             )
             st.session_state.processing = True
 
@@ -78,44 +162,22 @@ class StreamlitWhisperApp:
             st.rerun()
 
         if audio_file:
-            input_file_path = None
-            cropped_file_path = None
-
             try:
-                # Save input audio to temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-                    temp_file.write(audio_file.read())
-                    input_file_path = temp_file.name
-
-                # Process the audio and get path to cropped file
-                cropped_file_path = self.crop_audio(input_file_path)
-
-                # Get duration for logging
-                with wave.open(cropped_file_path, "rb") as audio:
-                    frames = audio.getnframes()
-                    rate = audio.getframerate()
-                    duration = frames / float(rate)
-                    print(f"Processed Audio Duration: {duration:.2f} seconds")
+                # The upload stays in memory: the recording is a view of its buffer, never a copy
+                recording = WavRecording(audio_file.getbuffer())
+                audio = self.crop_audio(recording)
+                print(f"Processed Audio Duration: {min(recording.duration, c.MAX_DURATION_AUDIO):.2f} seconds")
 
                 # Transcribe
-                with open(cropped_file_path, "rb") as audio:
-                    transcription = self.transcriber.transcribe_audio(audio)
-                    if transcription:
-                        run_button_command(transcription)
-                        print(transcription)
-                    else:
-                        st.error("Failed to transcribe audio. Please try again.")
+                transcription = self.transcriber.transcribe_audio(audio)
+                if transcription:
+                    run_button_command(transcription)
+                    print(transcription)
+                else:
+                    st.error("Failed to transcribe audio. Please try again.")
 
             except Exception as e:
                 st.error(f"Error processing audio: {str(e)}")
-            finally:
-                # Clean up both temporary files
-                for file_path in [input_file_path, cropped_file_path]:
-                    if file_path and os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                        except PermissionError:
-                            pass  # Let OS clean up if file is still locked
 
 
 if __name__ == "__main__":